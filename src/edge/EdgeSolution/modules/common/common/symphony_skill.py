@@ -23,6 +23,8 @@ class Node(BaseModel):
     inputs: Optional[List[Route]] = None
     outputs: Optional[List[Route]] = None
     configurations: Optional[Dict[str, object]] = None
+    # see voe_cascade_config.Node
+    execution: Optional[Literal['thread', 'process']] = None
 
 
 class SourceNode(Node):
@@ -51,6 +53,8 @@ class NodeRoute(BaseModel):
 class Edge(BaseModel):
     source: NodeRoute
     target: NodeRoute
+    queue_policy: Optional[Literal['block', 'drop_oldest', 'drop_newest']] = None
+    sample_interval: Optional[int] = None
 
 
 
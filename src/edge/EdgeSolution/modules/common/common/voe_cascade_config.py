@@ -1,7 +1,7 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-from typing import Union, Dict, List
+from typing import Union, Dict, List, Optional
 try:
     from typing import Literal
 except:
@@ -18,6 +18,8 @@ class Node(BaseModel):
     type: Literal['source', 'transform', 'export', 'model']
     name: str
     configurations: Dict[str, str]
+    # run the element in a thread or in a worker process (sources always use a thread)
+    execution: Optional[Literal['thread', 'process']] = None
 
 
 class SourceNode(Node):
@@ -36,13 +38,22 @@ class ModelNode(Node):
     type: Literal['model']
 
 
+QueuePolicy = Literal['block', 'drop_oldest', 'drop_newest']
+
+
 class Edge(BaseModel):
     source: NodeId
     target: NodeId
+    # what the source does when the target queue is full
+    queue_policy: QueuePolicy = 'block'
+    # forward only every Nth frame to the target
+    sample_interval: int = 1
 
 class CascadeConfig(BaseModel):
     edges: List[Edge]
     nodes: List[Node]
+    # pipeline name, used to label the stream metrics
+    name: Optional[str] = None
 
 
 if __name__ == '__main__':
@@ -16,5 +16,11 @@ class ModelConfig(BaseModel):
     executor: Literal['customvision', 'openvino', 'onnxruntime', 'openai']
     type: Literal['ObjectDetection', 'Classification', 'GPT4']
     download_uri: Optional[str] = None
+    # dynamic batching across the streams sharing this model, None means the predict module default
+    max_batch_size: Optional[int] = None
+    max_batch_wait_ms: Optional[float] = None
+    # openvino only
+    performance_hint: Optional[Literal['THROUGHPUT', 'LATENCY']] = None
+    num_requests: Optional[int] = None
 
     
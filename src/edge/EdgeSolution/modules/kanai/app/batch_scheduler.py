@@ -0,0 +1,140 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import queue
+import threading
+import time
+import collections
+from concurrent.futures import Future
+
+import numpy as np
+
+import tracing
+
+
+THROUGHPUT_WINDOW = 10 # second
+
+
+class BatchScheduler:
+    """Collect predict requests from every stream sharing a model and run them as one batch
+
+    A batch is flushed when it reaches max_batch_size or when the oldest request
+    has waited max_wait_ms, results are scattered back through futures. Models
+    with predict_batch_async get the batch without blocking the scheduler, so
+    the next batch is collected while the device is still busy.
+
+    Requests submitted with a tracing context record their batch wait,
+    preprocess (async models only) and inference spans.
+    """
+
+    def __init__(self, name, model, max_batch_size=4, max_wait_ms=5):
+        self.name = name
+        self.model = model
+        # the model may have refused a dynamic batch dimension
+        max_batch_size = min(int(max_batch_size), getattr(model, 'max_batch_size', max_batch_size))
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+
+        self._q = queue.Queue()
+
+        # keep the last N requests for latency percentiles & throughput
+        self._latencies = collections.deque(maxlen=1000)
+        self._finished = collections.deque(maxlen=10000)
+        self._batch_sizes = collections.deque(maxlen=100)
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self.loop)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def submit(self, image, trace=None):
+        future = Future()
+        self._q.put((time.time(), image, future, trace))
+        return future
+
+    def predict(self, image, trace=None):
+        return self.submit(image, trace).result()
+
+    def _collect(self):
+        requests = [self._q.get()]
+        deadline = time.time() + self.max_wait
+        while len(requests) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                requests.append(self._q.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return requests
+
+    def loop(self):
+        while True:
+            requests = self._collect()
+            images = [image for _, image, _, _ in requests]
+
+            # [started, dispatched] for the spans of the traced requests
+            timings = [time.time(), None]
+
+            if hasattr(self.model, 'predict_batch_async'):
+                try:
+                    self.model.predict_batch_async(images, lambda results, error, requests=requests, timings=timings: self._finish(requests, results, error, timings))
+                    # the batch is preprocessed and queued on the device
+                    timings[1] = time.time()
+                except Exception as e:
+                    self._finish(requests, None, e, timings)
+                continue
+
+            try:
+                if len(images) == 1:
+                    results = [self.model.predict(images[0])]
+                else:
+                    results = self.model.predict_batch(images)
+            except Exception as e:
+                self._finish(requests, None, e, timings)
+                continue
+
+            self._finish(requests, results, None, timings)
+
+    def _finish(self, requests, results, error, timings):
+        if error is not None:
+            print(f'[BatchScheduler] {self.name} failed to predict a batch of {len(requests)}: {error}', flush=True)
+            for _, _, future, _ in requests:
+                future.set_exception(error)
+            return
+
+        timestamp = time.time()
+        with self._lock:
+            self._batch_sizes.append(len(requests))
+            for submitted, _, _, _ in requests:
+                self._latencies.append(timestamp - submitted)
+                self._finished.append(timestamp)
+
+        started, dispatched = timings
+        for submitted, _, _, trace in requests:
+            if trace is not None:
+                tracing.tracer.span(trace, self.name, 'batch_wait', submitted, started, batch_size=len(requests))
+                if dispatched is not None:
+                    tracing.tracer.span(trace, self.name, 'preprocess', started, dispatched)
+                tracing.tracer.span(trace, self.name, 'infer', dispatched or started, timestamp)
+
+        for (_, _, future, _), result in zip(requests, results):
+            future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            finished = list(self._finished)
+            batch_sizes = list(self._batch_sizes)
+
+        # requests per second over the last THROUGHPUT_WINDOW seconds
+        since = time.time() - THROUGHPUT_WINDOW
+        throughput = sum(1 for t in finished if t > since) / THROUGHPUT_WINDOW
+
+        return {
+            'throughput': throughput,
+            'p50_latency_ms': float(np.percentile(latencies, 50)) * 1000 if latencies else 0.0,
+            'p99_latency_ms': float(np.percentile(latencies, 99)) * 1000 if latencies else 0.0,
+            'avg_batch_size': float(np.mean(batch_sizes)) if batch_sizes else 0.0,
+            'queue_size': self._q.qsize(),
+        }
@@ -0,0 +1,207 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+#
+# Capture backends for RtspSource, selected by the source node configurations
+#   backend: opencv (default) | ffmpeg | gstreamer
+#   width, height: output size, scaled by the decoder for ffmpeg & gstreamer
+#   hwaccel: ffmpeg -hwaccel value (e.g. auto, cuda, vaapi)
+#   decoder: gstreamer decoding element (e.g. nvv4l2decoder, vaapih264dec, avdec_h264)
+#   codec: h264 (default) | h265, the rtp depayloader & parser put before a decoder
+#          other than decodebin, or depay: the whole depay/parse chain
+#
+
+import os
+import subprocess
+import time
+
+import numpy as np
+import cv2
+
+
+# seconds ffprobe may take to read the size of a stream
+PROBE_TIMEOUT = 20
+
+
+class CaptureBackend:
+    """Decode frames from a video uri as BGR uint8 arrays
+
+    read(image) works like cv2.VideoCapture.read, the frame is decoded into
+    image when it has the right shape. stats() gives the decode fps and the
+    cpu time spent per frame so the cheapest backend can be picked per camera.
+    """
+
+    name = ''
+
+    def __init__(self, uri, width=None, height=None):
+        self.uri = uri
+        self.width = int(width) if width else None
+        self.height = int(height) if height else None
+
+        self.frames = 0
+        self.cpu_time = 0
+        self.fps = 0
+        self._last_frame_timestamp = time.time()
+
+    def _read(self, image):
+        raise NotImplementedError
+
+    def _cpu_time(self):
+        # cpu time of the capture thread, decoders running elsewhere should add theirs
+        return time.thread_time()
+
+    def read(self, image=None):
+        cpu_start = self._cpu_time()
+        b, image = self._read(image)
+        if b:
+            timestamp = time.time()
+            self.frames += 1
+            self.cpu_time += self._cpu_time() - cpu_start
+            self.fps = self.fps * 7/8 + 1 / max(1e-6, timestamp - self._last_frame_timestamp) * 1/8
+            self._last_frame_timestamp = timestamp
+        return b, image
+
+    def release(self):
+        pass
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'decode_fps': self.fps,
+            'cpu_ms_per_frame': self.cpu_time / self.frames * 1000 if self.frames else 0.0,
+            'frames': self.frames,
+        }
+
+
+class OpenCVCapture(CaptureBackend):
+
+    name = 'opencv'
+
+    def __init__(self, uri, width=None, height=None, **kwargs):
+        super().__init__(uri, width, height)
+        self.cap = cv2.VideoCapture(uri)
+
+    def _read(self, image):
+        if not (self.width and self.height):
+            return self.cap.read(image)
+
+        # no decoder side scaling with the default backend
+        b, frame = self.cap.read()
+        if not b or frame is None:
+            return False, None
+        return True, cv2.resize(frame, (self.width, self.height), dst=image)
+
+    def release(self):
+        self.cap.release()
+
+
+class FFmpegCapture(CaptureBackend):
+    """Pipe raw BGR frames out of an ffmpeg subprocess"""
+
+    name = 'ffmpeg'
+
+    def __init__(self, uri, width=None, height=None, hwaccel=None, **kwargs):
+        super().__init__(uri, width, height)
+
+        if not (self.width and self.height):
+            self.width, self.height = self._probe_size()
+
+        cmd = ['ffmpeg', '-loglevel', 'error']
+        if hwaccel:
+            cmd += ['-hwaccel', hwaccel]
+        if uri.startswith('rtsp'):
+            cmd += ['-rtsp_transport', 'tcp']
+        cmd += ['-i', uri, '-an',
+                '-vf', f'scale={self.width}:{self.height}',
+                '-pix_fmt', 'bgr24', '-f', 'rawvideo', 'pipe:']
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=0)
+        self._clock_ticks = os.sysconf('SC_CLK_TCK')
+
+    def _probe_size(self):
+        out = subprocess.check_output(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                                       '-show_entries', 'stream=width,height', '-of', 'csv=p=0', self.uri], timeout=PROBE_TIMEOUT)
+        width, height = out.decode().strip().split('\n')[0].split(',')[:2]
+        return int(width), int(height)
+
+    def _cpu_time(self):
+        # the decoding happens in ffmpeg, add its utime + stime
+        try:
+            with open(f'/proc/{self.proc.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            ffmpeg_time = (int(fields[11]) + int(fields[12])) / self._clock_ticks
+        except (OSError, IndexError, ValueError):
+            ffmpeg_time = 0
+        return time.thread_time() + ffmpeg_time
+
+    def _read(self, image):
+        shape = (self.height, self.width, 3)
+        if image is None or image.shape != shape:
+            image = np.empty(shape, dtype=np.uint8)
+
+        buf = memoryview(image).cast('B')
+        n = 0
+        while n < len(buf):
+            r = self.proc.stdout.readinto(buf[n:])
+            if not r:
+                return False, None
+            n += r
+        return True, image
+
+    def release(self):
+        self.proc.kill()
+        self.proc.wait()
+
+
+class GStreamerCapture(CaptureBackend):
+    """GStreamer pipeline through opencv, scaling and colour conversion are done in the pipeline"""
+
+    name = 'gstreamer'
+
+    def __init__(self, uri, width=None, height=None, decoder='decodebin', codec='h264', depay=None, **kwargs):
+        super().__init__(uri, width, height)
+
+        if uri.startswith('rtsp'):
+            src = f'rtspsrc location={uri} latency=0'
+            # rtspsrc outputs rtp packets, only decodebin plugs the depayloader itself
+            if decoder != 'decodebin':
+                if depay is None:
+                    if codec not in ('h264', 'h265'):
+                        raise Exception(f'Unknown codec {codec}, set depay for the gstreamer backend')
+                    depay = f'rtp{codec}depay ! {codec}parse'
+                src += f' ! {depay}'
+        else:
+            src = f'uridecodebin uri={uri}'
+            decoder = None
+
+        caps = 'video/x-raw,format=BGR'
+        if self.width and self.height:
+            caps += f',width={self.width},height={self.height}'
+
+        elements = [src]
+        if decoder:
+            elements.append(decoder)
+        elements += ['videoconvert', 'videoscale', caps, 'appsink drop=true max-buffers=1 sync=false']
+        self.pipeline = ' ! '.join(elements)
+
+        self.cap = cv2.VideoCapture(self.pipeline, cv2.CAP_GSTREAMER)
+        if not self.cap.isOpened():
+            print(f'[GStreamerCapture] cannot open {self.pipeline}, is opencv built with gstreamer?', flush=True)
+
+    def _read(self, image):
+        return self.cap.read(image)
+
+    def release(self):
+        self.cap.release()
+
+
+capture_backends = {
+    'opencv': OpenCVCapture,
+    'ffmpeg': FFmpegCapture,
+    'gstreamer': GStreamerCapture,
+}
+
+
+def create_capture(backend, uri, **kwargs):
+    if backend not in capture_backends:
+        raise Exception(f'Unknown capture backend {backend}')
+    return capture_backends[backend](uri, **kwargs)
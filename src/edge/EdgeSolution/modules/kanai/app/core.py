@@ -26,6 +26,32 @@ class ObjectDetectionResult(BaseModel):
     objects: List[Object]
 
 
+class ObjectDetectionArrays:
+    """Object detection result kept as arrays
+
+    boxes is N x 4 (l, t, w, h). The model nodes copy the arrays into the
+    frame ObjectsTable, the pydantic objects are only built when .objects is read.
+    """
+
+    def __init__(self, boxes, confidences, labels):
+        self.boxes = boxes
+        self.confidences = confidences
+        self.labels = labels
+        self._objects = None
+
+    def __len__(self):
+        return len(self.confidences)
+
+    @property
+    def objects(self) -> List[Object]:
+        if self._objects is None:
+            self._objects = [
+                Object(bbox=Bbox(l=float(l), t=float(t), w=float(w), h=float(h)), confidence=float(confidence), label=label)
+                for (l, t, w, h), confidence, label in zip(self.boxes, self.confidences, self.labels)
+            ]
+        return self._objects
+
+
 
 class Classification(BaseModel):
     name: str
@@ -42,12 +68,15 @@ class Model:
     def predict(self, image):
         raise NotImplementedError
 
+    def predict_batch(self, images):
+        return [self.predict(image) for image in images]
+
 
 class ObjectDetectionModel(Model):
     def predict(self, image) -> ObjectDetectionResult:
         raise NotImplementedError
 
 
-class ClassificationModel:
+class ClassificationModel(Model):
     def predict(self, image) -> ClassificationResult:
         raise NotImplementedError
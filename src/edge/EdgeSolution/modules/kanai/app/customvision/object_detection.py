@@ -35,61 +35,47 @@ class ObjectDetection(object):
         self.max_detections = max_detections
 
     def _logistic(self, x):
-        return np.where(x > 0, 1 / (1 + np.exp(-x)), np.exp(x) / (1 + np.exp(x)))
+        # same as 1 / (1 + exp(-x)) without overflowing for large |x|
+        return 0.5 * (1 + np.tanh(0.5 * x))
 
     def _non_maximum_suppression(self, boxes, class_probs, max_detections):
         """Remove overlapping bouding boxes
+
+        Every (box, class) pair above the threshold is a candidate, a candidate is
+        suppressed by a better one of the same class overlapping more than
+        IOU_THRESHOLD. Returns arrays (boxes, classes, probs) sorted by probability.
         """
         assert len(boxes) == len(class_probs)
 
-        max_detections = min(max_detections, len(boxes))
-        max_probs = np.amax(class_probs, axis=1)
-        max_classes = np.argmax(class_probs, axis=1)
-
-        areas = boxes[:, 2] * boxes[:, 3]
-
-        selected_boxes = []
-        selected_classes = []
-        selected_probs = []
-
-        while len(selected_boxes) < max_detections:
-            # Select the prediction with the highest probability.
-            i = np.argmax(max_probs)
-            if max_probs[i] < self.prob_threshold:
-                break
-
-            # Save the selected prediction
-            selected_boxes.append(boxes[i])
-            selected_classes.append(max_classes[i])
-            selected_probs.append(max_probs[i])
-
-            box = boxes[i]
-            other_indices = np.concatenate((np.arange(i), np.arange(i + 1, len(boxes))))
-            other_boxes = boxes[other_indices]
-
-            # Get overlap between the 'box' and 'other_boxes'
-            x1 = np.maximum(box[0], other_boxes[:, 0])
-            y1 = np.maximum(box[1], other_boxes[:, 1])
-            x2 = np.minimum(box[0] + box[2], other_boxes[:, 0] + other_boxes[:, 2])
-            y2 = np.minimum(box[1] + box[3], other_boxes[:, 1] + other_boxes[:, 3])
-            w = np.maximum(0, x2 - x1)
-            h = np.maximum(0, y2 - y1)
-
-            # Calculate Intersection Over Union (IOU)
+        box_indices, classes = np.nonzero(class_probs >= self.prob_threshold)
+        probs = class_probs[box_indices, classes]
+        order = np.argsort(-probs, kind='stable')
+        box_indices, classes, probs = box_indices[order], classes[order], probs[order]
+
+        candidates = boxes[box_indices]
+        x1 = candidates[:, 0]
+        y1 = candidates[:, 1]
+        x2 = candidates[:, 0] + candidates[:, 2]
+        y2 = candidates[:, 1] + candidates[:, 3]
+        areas = candidates[:, 2] * candidates[:, 3]
+
+        # greedy selection is sequential, but it runs at most max_detections times
+        # and each step compares the selected candidate with all others at once
+        selected = []
+        alive = np.arange(len(candidates))
+        while len(alive) > 0 and len(selected) < max_detections:
+            i, alive = alive[0], alive[1:]
+            selected.append(i)
+
+            w = np.maximum(0, np.minimum(x2[i], x2[alive]) - np.maximum(x1[i], x1[alive]))
+            h = np.maximum(0, np.minimum(y2[i], y2[alive]) - np.maximum(y1[i], y1[alive]))
             overlap_area = w * h
-            iou = overlap_area / (areas[i] + areas[other_indices] - overlap_area)
+            iou = overlap_area / (areas[i] + areas[alive] - overlap_area)
 
-            # Find the overlapping predictions
-            overlapping_indices = other_indices[np.where(iou > self.IOU_THRESHOLD)[0]]
-            overlapping_indices = np.append(overlapping_indices, i)
+            alive = alive[(iou <= self.IOU_THRESHOLD) | (classes[alive] != classes[i])]
 
-            # Set the probability of overlapping predictions to zero, and udpate max_probs and max_classes.
-            class_probs[overlapping_indices, max_classes[i]] = 0
-            max_probs[overlapping_indices] = np.amax(class_probs[overlapping_indices], axis=1)
-            max_classes[overlapping_indices] = np.argmax(class_probs[overlapping_indices], axis=1)
-
-        assert len(selected_boxes) == len(selected_classes) and len(selected_boxes) == len(selected_probs)
-        return selected_boxes, selected_classes, selected_probs
+        selected = np.array(selected, dtype=int)
+        return candidates[selected], classes[selected], probs[selected]
 
     def _extract_bb(self, prediction_output, anchors):
         assert len(prediction_output.shape) == 3
@@ -152,17 +138,27 @@ class ObjectDetection(object):
         prediction_outputs = self.predict(inputs)
         return self.postprocess(prediction_outputs)
 
+    def predict_arrays(self, image):
+        inputs = self.preprocess(image)
+        prediction_outputs = self.predict(inputs)
+        return self.postprocess_arrays(prediction_outputs)
+
+
     def preprocess(self, image):
         image = image.convert("RGB") if image.mode != "RGB" else image
         image = self._update_orientation(image)
 
-        ratio = math.sqrt(self.DEFAULT_INPUT_SIZE / image.width / image.height)
-        new_width = int(image.width * ratio)
-        new_height = int(image.height * ratio)
+        image = image.resize(self.input_size(image.width, image.height))
+        return image
+
+    def input_size(self, width, height):
+        """Network input (width, height) for an image of the given size"""
+        ratio = math.sqrt(self.DEFAULT_INPUT_SIZE / width / height)
+        new_width = int(width * ratio)
+        new_height = int(height * ratio)
         new_width = 32 * math.ceil(new_width / 32)
         new_height = 32 * math.ceil(new_height / 32)
-        image = image.resize((new_width, new_height))
-        return image
+        return new_width, new_height
 
     def predict(self, preprocessed_inputs):
         """Evaluate the model and get the output
@@ -180,17 +176,7 @@ class ObjectDetection(object):
         Returns:
             List of Prediction objects.
         """
-        boxes, class_probs = self._extract_bb(prediction_outputs, self.ANCHORS)
-
-        # Remove bounding boxes whose confidence is lower than the threshold.
-        max_probs = np.amax(class_probs, axis=1)
-        index, = np.where(max_probs > self.prob_threshold)
-        index = index[(-max_probs[index]).argsort()]
-
-        # Remove overlapping bounding boxes
-        selected_boxes, selected_classes, selected_probs = self._non_maximum_suppression(boxes[index],
-                                                                                         class_probs[index],
-                                                                                         self.max_detections)
+        selected_boxes, selected_classes, selected_probs = self.postprocess_arrays(prediction_outputs)
 
         return [{'probability': round(float(selected_probs[i]), 8),
                  'tagId': int(selected_classes[i]),
@@ -202,3 +188,19 @@ class ObjectDetection(object):
                      'height': round(float(selected_boxes[i][3]), 8)
                  }
                  } for i in range(len(selected_boxes))]
+
+    def postprocess_arrays(self, prediction_outputs):
+        """ Same as postprocess but keeps the predictions as arrays.
+
+        Returns:
+            boxes (N x 4, left/top/width/height), class ids (N) and probabilities (N),
+            sorted by probability.
+        """
+        boxes, class_probs = self._extract_bb(prediction_outputs, self.ANCHORS)
+
+        # Remove bounding boxes whose confidence is lower than the threshold.
+        max_probs = np.amax(class_probs, axis=1)
+        index, = np.where(max_probs > self.prob_threshold)
+
+        # Remove overlapping bounding boxes
+        return self._non_maximum_suppression(boxes[index], class_probs[index], self.max_detections)
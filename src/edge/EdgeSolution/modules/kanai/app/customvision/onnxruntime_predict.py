@@ -10,10 +10,14 @@ import os
 import sys
 import onnxruntime
 import onnx
+import threading
 import numpy as np
+import cv2
 from PIL import Image, ImageDraw
 from customvision.object_detection import ObjectDetection
-import tempfile
+from model_cache import get_cache_dir, atomic_save
+from preprocess_cache import preprocess_cache
+import time
 
 #MODEL_FILENAME = 'model.onnx'
 #LABELS_FILENAME = 'labels.txt'
@@ -22,28 +26,73 @@ class ONNXRuntimeObjectDetection(ObjectDetection):
     """Object Detection class for ONNX Runtime"""
     def __init__(self, model_filename, labels):
         super(ONNXRuntimeObjectDetection, self).__init__(labels)
-        model = onnx.load(model_filename)
-        with tempfile.TemporaryDirectory() as dirpath:
-            temp = os.path.join(dirpath, os.path.basename(model_filename))
+        start = time.time()
+
+        providers = ['CPUExecutionProvider']
+
+        # OpenVINO
+        if 'OpenVINOExecutionProvider' in onnxruntime.get_available_providers():
+            providers = ['OpenVINOExecutionProvider'] + providers
+
+        # TensorRT & Cuda
+        if 'CUDAExecutionProvider' in onnxruntime.get_available_providers():
+            providers = ['CUDAExecutionProvider'] + providers
+        if 'TensorrtExecutionProvider' in onnxruntime.get_available_providers():
+            providers = ['TensorrtExecutionProvider'] + providers
+
+        cache_dir = get_cache_dir([model_filename], providers[0], onnxruntime.get_device())
+
+        patched_filename = os.path.join(cache_dir, 'model.onnx')
+        cache_hit = os.path.exists(patched_filename)
+        if not cache_hit:
+            model = onnx.load(model_filename)
+            model.graph.input[0].type.tensor_type.shape.dim[0].dim_param = 'batch'
             model.graph.input[0].type.tensor_type.shape.dim[-1].dim_param = 'dim1'
             model.graph.input[0].type.tensor_type.shape.dim[-2].dim_param = 'dim2'
-            onnx.save(model, temp)
-            
-            providers = ['CPUExecutionProvider']
+            atomic_save(lambda filename: onnx.save(model, filename), patched_filename)
+
+        provider_options = []
+        for provider in providers:
+            if provider == 'TensorrtExecutionProvider':
+                provider_options.append({'trt_engine_cache_enable': True, 'trt_engine_cache_path': cache_dir})
+            else:
+                provider_options.append({})
+
+        optimized_filename = os.path.join(cache_dir, 'model.optimized.onnx')
+        self.session = None
+
+        # graphs partitioned to compiling providers (TensorRT, OpenVINO) cannot be saved
+        if providers[0] in ('CPUExecutionProvider', 'CUDAExecutionProvider'):
+            if os.path.exists(optimized_filename):
+                sess_options = onnxruntime.SessionOptions()
+                sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+                try:
+                    self.session = onnxruntime.InferenceSession(optimized_filename, sess_options, providers=providers, provider_options=provider_options)
+                except Exception as e:
+                    print(f'[ONNXRuntime] dropping broken cache {optimized_filename}: {e}', flush=True)
+                    os.remove(optimized_filename)
+                    cache_hit = False
+
+            if self.session is None:
+                sess_options = onnxruntime.SessionOptions()
+                sess_options.optimized_model_filepath = optimized_filename
+                try:
+                    self.session = onnxruntime.InferenceSession(patched_filename, sess_options, providers=providers, provider_options=provider_options)
+                except Exception as e:
+                    print(f'[ONNXRuntime] cannot save the optimized graph: {e}', flush=True)
 
-            # OpenVINO
-            if 'OpenVINOExecutionProvider' in onnxruntime.get_available_providers():
-                providers = ['OpenVINOExecutionProvider'] + providers
+        if self.session is None:
+            self.session = onnxruntime.InferenceSession(patched_filename, providers=providers, provider_options=provider_options)
 
-            # TensorRT & Cuda
-            if 'CUDAExecutionProvider' in onnxruntime.get_available_providers():
-                providers = ['CUDAExecutionProvider'] + providers
-            if 'TensorrtExecutionProvider' in onnxruntime.get_available_providers():
-                providers = ['TensorrtExecutionProvider'] + providers
+        print(f'[ONNXRuntime] {model_filename} ready on {providers[0]} in {time.time()-start:.1f}s (cache {"hit" if cache_hit else "miss"}: {cache_dir})', flush=True)
 
-            self.session = onnxruntime.InferenceSession(temp, providers=providers)
         self.input_name = self.session.get_inputs()[0].name
         self.is_fp16 = self.session.get_inputs()[0].type == 'tensor(float16)'
+        self.is_batchable = True
+
+        # preallocated NCHW inputs for predict_frames, keyed by (batch size, dsize)
+        self._input_buffers = {}
+        self._input_lock = threading.Lock()
         
     def predict(self, preprocessed_image):
         inputs = np.array(preprocessed_image, dtype=np.float32)[np.newaxis,:,:,(2,1,0)] # RGB -> BGR
@@ -55,6 +104,44 @@ class ONNXRuntimeObjectDetection(ObjectDetection):
         outputs = self.session.run(None, {self.input_name: inputs})
         return np.squeeze(outputs).transpose((1,2,0)).astype(np.float32)
 
+    def predict_frames(self, images, dsize):
+        """Evaluate the model on BGR uint8 frames (e.g. from cv2) resized to dsize
+
+        Each frame is resized once and written straight into a preallocated
+        NCHW buffer, skipping the PIL path used for still images. Returns one
+        postprocess_arrays result per frame.
+        """
+        if len(images) > 1 and not self.is_batchable:
+            return [self.predict_frames([image], dsize)[0] for image in images]
+
+        with self._input_lock:
+            inputs = self._input_buffer(len(images), dsize)
+            for i, image in enumerate(images):
+                # the network takes BGR, which is what the frames already are
+                inputs[i] = preprocess_cache.get(image, dsize, 'NCHW', 'BGR', inputs.dtype)
+
+            try:
+                outputs = self.session.run(None, {self.input_name: inputs})
+            except Exception as e:
+                if len(images) == 1: raise
+                # some exported graphs hardcode the batch size somewhere inside
+                print(f'[ONNXRuntime] batched inference is not supported by this model: {e}', flush=True)
+                self.is_batchable = False
+                outputs = None
+
+        if outputs is None:
+            return self.predict_frames(images, dsize)
+
+        return [self.postprocess_arrays(output.transpose((1,2,0)).astype(np.float32)) for output in outputs[0]]
+
+    def _input_buffer(self, batch_size, dsize):
+        key = (batch_size, dsize)
+        if key not in self._input_buffers:
+            width, height = dsize
+            dtype = np.float16 if self.is_fp16 else np.float32
+            self._input_buffers[key] = np.empty((batch_size, 3, height, width), dtype=dtype)
+        return self._input_buffers[key]
+
 #def main(image_filename):
 #    # Load labels
 #    with open(LABELS_FILENAME, 'r') as f:
@@ -5,9 +5,7 @@ import onnxruntime as ort
 import numpy as np
 import cv2
 
-from PIL import Image
-
-from core import ObjectDetectionModel, ObjectDetectionResult, Object, Bbox
+from core import ObjectDetectionModel, ObjectDetectionResult, ObjectDetectionArrays, Object, Bbox
 from customvision.onnxruntime_predict import ONNXRuntimeObjectDetection
 
 
@@ -23,13 +21,9 @@ class CustomVisionObjectDetectionModel(ObjectDetectionModel):
 
         self.model = ONNXRuntimeObjectDetection(model_onnx, self.labels)
 
-    def _preprocess(self, image):
-
-        image = cv2.resize(image, (416, 416))
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        pil_image = Image.fromarray(image)
-
-        return pil_image
+        # frames used to be squashed to 416x416 and scaled again by ObjectDetection.preprocess,
+        # now they are resized once, straight to the size the network was actually fed
+        self.dsize = self.model.input_size(416, 416)
 
 
     def _postprocess(self, output_data, threshold):
@@ -46,28 +40,26 @@ class CustomVisionObjectDetectionModel(ObjectDetectionModel):
 
         #return ObjectDetectionResult(objects=objects)
         #print(output_data)
-        objects = []
-        for obj in output_data:
-            if obj['probability'] < threshold: continue
-            bbox = Bbox(
-                l=obj['boundingBox']['left'],
-                t=obj['boundingBox']['top'],
-                w=obj['boundingBox']['width'],
-                h=obj['boundingBox']['height'],
-            )
-            objects.append( Object(bbox=bbox, confidence=obj['probability'], label=obj['tagName']))
-        return ObjectDetectionResult(objects=objects)
+        boxes, classes, probs = output_data
+        keep = probs >= threshold
+        return ObjectDetectionArrays(boxes[keep], probs[keep], [self.labels[c] for c in classes[keep]])
 
 
 
     def predict(self, image, threshold=0.1) -> ObjectDetectionResult:
 
-        input_data = self._preprocess(image)
-        output_data = self.model.predict_image(input_data)
+        output_data = self.model.predict_frames([image], self.dsize)[0]
         result = self._postprocess(output_data, threshold)
         
 
         return result
+
+    def predict_batch(self, images, threshold=0.1):
+
+        output_data = self.model.predict_frames(images, self.dsize)
+        results = [self._postprocess(outputs, threshold) for outputs in output_data]
+
+        return results
         
 
 if __name__ == '__main__':
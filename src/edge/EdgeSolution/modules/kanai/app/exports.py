@@ -3,6 +3,7 @@
 
 from node import Export
 import utils
+import tracing
 
 import os
 import time
@@ -58,9 +59,12 @@ class VideoSnippetExport(Export):
         self.exporting_thread = None
 
     def _append_image(self, frame):
-        img = frame.image.image_pointer.copy()
+        img = frame.image.image_pointer
         if self.insights_overlay:
-            utils.insights_overlay(img, frame)
+            img = utils.insights_overlay(img, frame)
+        elif not img.flags.owndata:
+            # the image may be a view of a reused buffer (e.g. a shared frame pool slot)
+            img = img.copy()
         self.imgs.append(img)
 
     def _export_video(self):
@@ -115,7 +119,7 @@ class VideoSnippetExport(Export):
         # current logic is that we start recording while there's any objects is detected
         if self.status is VideoSnippetStatus.WAITING:
             if cur_timestamp > self.last_timestamp + self.delay_buffer*60:
-                if len(frame.insights_meta.objects_meta) > 0:
+                if len(frame.insights_meta) > 0:
 
                     print('start recording')
                     self.status = VideoSnippetStatus.RECORDING
@@ -186,7 +190,8 @@ class IothubExport(Export):
 
         def _exporter():
             while True:
-                j = self._export_q.get()
+                trace, j = self._export_q.get()
+                start = time.time()
                 try:
                     print('IotHubExport: send a message to metrics')
                     if iot:
@@ -198,6 +203,7 @@ class IothubExport(Export):
                 except Exception as e:
                     print(
                         f"IotHubExport: An error occurred while sending message to metrics: {e}.")
+                tracing.tracer.span(trace, self.name, 'send', start, time.time())
 
         self._export_thread = threading.Thread(target=_exporter)
         self._export_thread.start()
@@ -207,9 +213,9 @@ class IothubExport(Export):
         cur_timestamp = time.time()
         if cur_timestamp > self.last_timestamp + self.delay_buffer:
 
-            if len(frame.insights_meta.objects_meta) > 0:
+            if len(frame.insights_meta) > 0:
                 if not self._export_q.full():
-                    self._export_q.put(frame.json())
+                    self._export_q.put((tracing.context(frame), frame.json()))
                 else:
                     print(f'IotHubExport: drop result since queue is full', flush=True)
                 self.last_timestamp = cur_timestamp
@@ -226,13 +232,15 @@ class MqttExport(Export):
 
         def _exporter():
             while True:
-                j = self._export_q.get()
+                trace, j = self._export_q.get()
+                start = time.time()
                 try:
                     print('MqttExport: send a message to metrics')
                     send_message(j)
                 except Exception as e:
                     print(
                         f"MqttExport: An error occurred while sending message to metrics: {e}.")
+                tracing.tracer.span(trace, self.name, 'send', start, time.time())
 
         self._export_thread = threading.Thread(target=_exporter)
         self._export_thread.start()
@@ -242,9 +250,9 @@ class MqttExport(Export):
         cur_timestamp = time.time()
         if cur_timestamp > self.last_timestamp + self.delay_buffer:
 
-            if len(frame.insights_meta.objects_meta) > 0:
+            if len(frame.insights_meta) > 0:
                 if not self._export_q.full():
-                    self._export_q.put(frame.json())
+                    self._export_q.put((tracing.context(frame), frame.json()))
                 else:
                     print(f'MqttExport: drop result since queue is full', flush=True)
                 self.last_timestamp = cur_timestamp
@@ -262,13 +270,15 @@ class IotedgeExport(Export):
 
         def _exporter():
             while True:
-                j = self._export_q.get()
+                trace, j = self._export_q.get()
+                start = time.time()
                 try:
                     print('IotEdgeExport: send a message to localmetrics')
                     iot.send_message_to_output(j, 'localmetrics')
                 except Exception as e:
                     print(
                         f"IotEdgeExport: An error occurred while sending message to localmetrics: {e}.")
+                tracing.tracer.span(trace, self.name, 'send', start, time.time())
 
         self._export_thread = threading.Thread(target=_exporter)
         self._export_thread.start()
@@ -277,9 +287,9 @@ class IotedgeExport(Export):
         cur_timestamp = time.time()
         if cur_timestamp > self.last_timestamp + self.delay_buffer:
 
-            if len(frame.insights_meta.objects_meta) > 0:
+            if len(frame.insights_meta) > 0:
                 if not self._export_q.full():
-                    self._export_q.put(frame.json())
+                    self._export_q.put((tracing.context(frame), frame.json()))
                 else:
                     print(f'IotEdgeExport: drop result since queue is full', flush=True)
                 self.last_timestamp = cur_timestamp
@@ -295,13 +305,15 @@ class HttpExport(Export):
 
         def _exporter():
             while True:
-                j = self._export_q.get()
+                trace, j = self._export_q.get()
+                start = time.time()
                 try:
                     print('HttpExport: send a request to ', self.url)
                     httpx.post(self.url, json=j)
                 except httpx.RequestError as exc:
                     print(
                         f"An error occurred while requesting {exc.request.url!r}.")
+                tracing.tracer.span(trace, self.name, 'send', start, time.time())
 
         self._export_thread = threading.Thread(target=_exporter)
         self._export_thread.start()
@@ -309,7 +321,7 @@ class HttpExport(Export):
     def process(self, frame):
 
         if not self._export_q.full():
-            self._export_q.put(frame.json())
+            self._export_q.put((tracing.context(frame), frame.json()))
         else:
             print(f'HttpExport: drop result since queue is full', flush=True)
 
@@ -328,9 +340,9 @@ class Cv2ImshowExport(Export):
 
     def process(self, frame):
 
-        img = frame.image.image_pointer.copy()
+        img = frame.image.image_pointer
         if self.insights_overlay:
-            utils.insights_overlay(img, frame)
+            img = utils.insights_overlay(img, frame)
 
         cv2.imshow('Frame', img)
         cv2.waitKey(1)
@@ -0,0 +1,103 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import time
+
+
+# sources capture at their configured fps, they adapt it to the pipeline only
+# with STREAM_ADAPTIVE_FPS=true or when the node sets adaptive_fps to true
+ADAPTIVE_FPS = os.environ.get('STREAM_ADAPTIVE_FPS', 'false') == 'true'
+
+CONTROL_INTERVAL = 1 # second
+# busy fraction of the slowest element above which the stream is overloaded, and below which it has headroom
+OVERLOAD_UTILIZATION = 0.95
+HEADROOM_UTILIZATION = 0.8
+# the rate aimed at when overloaded, as a fraction of what the slowest element sustains
+TARGET_UTILIZATION = 0.85
+DECREASE = 0.8
+
+
+def watched_elements(source):
+    """Elements a source feeds through blocking edges, one per thread
+
+    Branches behind a dropping or sampling edge lose their own frames
+    instead of holding back the source, they are left out.
+    """
+    elements = []
+    stack = [source]
+    while stack:
+        element = stack.pop()
+        last = element._fused[-1] if element._fused else element
+        for link in last._links:
+            if link.queue_policy == 'block' and link.sample_interval == 1 and link.child not in elements:
+                elements.append(link.child)
+                stack.append(link.child)
+    return elements
+
+
+class FpsController:
+    """Adapts the capture rate of a source to what the elements after it keep up with
+
+    The source calls update() for every frame and sample() once it waited for
+    the next one. Every CONTROL_INTERVAL the controller looks at the input
+    queues of the watched elements and at how busy their threads were: the
+    time spent in process (e.g. the model latency) per second, divided by the
+    frames they may have in flight. It slows down below what the busiest
+    element sustains when queues build up or it is saturated, and speeds up
+    step by step to max_fps when there is headroom, never going under min_fps.
+    """
+
+    def __init__(self, elements, max_fps, min_fps):
+        self.elements = elements
+        self.max_fps = max_fps
+        self.min_fps = min(min_fps, max_fps)
+        self.fps = max_fps
+        self.step = max(0.5, max_fps / 10)
+
+        self.utilization = 0
+        self.queue_depth = 0
+
+        self._depth_sum = 0
+        self._frames = 0
+        self._last_update = time.time()
+        self._busy = self._busy_seconds()
+
+    def _busy_seconds(self):
+        busy = []
+        for element in self.elements:
+            seconds = sum(e.metrics.process_seconds.sum for e in [element] + element._fused)
+            busy.append(seconds / getattr(element, 'MAX_IN_FLIGHT', 1))
+        return busy
+
+    def sample(self):
+        """Record the queue depths, right before the next frame is sent"""
+        if self.elements:
+            self._depth_sum += max(element.queue_depth() for element in self.elements)
+        self._frames += 1
+
+    def update(self):
+        """Target fps, call it once per frame"""
+        timestamp = time.time()
+        elapsed = timestamp - self._last_update
+        if elapsed < CONTROL_INTERVAL:
+            return self.fps
+
+        busy = self._busy_seconds()
+        self.utilization = max((b - last) / elapsed for b, last in zip(busy, self._busy)) if busy else 0
+        self.queue_depth = self._depth_sum / max(1, self._frames)
+        fps = self._frames / elapsed
+
+        if self.queue_depth >= 1 or self.utilization > OVERLOAD_UTILIZATION:
+            target = self.fps * DECREASE
+            if self.utilization > 0:
+                target = min(target, fps / self.utilization * TARGET_UTILIZATION)
+            self.fps = max(self.min_fps, target)
+        elif self.queue_depth < 0.5 and self.utilization < HEADROOM_UTILIZATION:
+            self.fps = min(self.max_fps, self.fps + self.step)
+
+        self._busy = busy
+        self._depth_sum = 0
+        self._frames = 0
+        self._last_update = timestamp
+        return self.fps
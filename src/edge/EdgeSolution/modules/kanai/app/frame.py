@@ -4,7 +4,8 @@
 from enum import Enum
 
 from typing import List, Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_serializer
+from pydantic_core import core_schema
 import numpy as np
 from common.env import INSTANCE
 
@@ -41,6 +42,18 @@ class Attribute(BaseModel):
     #inference_id: str
 
 
+class Direction(BaseModel):
+    x: float
+    y: float
+
+
+class TrackingInfo(BaseModel):
+    tracking_id: str
+    # frame ratios per second
+    speed: float = 0.0
+    direction: Optional[Direction] = None
+
+
 class ObjectMeta(BaseModel):
     timestamp: float
     label: str
@@ -48,18 +61,271 @@ class ObjectMeta(BaseModel):
     inference_id: str
     attributes: List[Attribute] #FIXME
     bbox: Optional[Bbox] = None
+    # set by TrackingTransform, only serialized for tracked objects
+    tracking_info: Optional[TrackingInfo] = None
+
+    @model_serializer(mode='wrap')
+    def _serialize(self, handler):
+        d = handler(self)
+        if d.get('tracking_info') is None:
+            d.pop('tracking_info', None)
+        return d
+
+
+class ObjectsTable:
+    """Objects of a frame stored as columns
+
+    boxes is N x 4 (l, t, w, h, NaN without bbox), label_ids index into
+    labels. track_ids is -1 for untracked objects, velocities is N x 2 (box
+    center, frame ratios per second) and NaN without tracking. Attributes are a side table, attribute i belongs to object
+    attr_object_ids[i]. Columns are replaced, never written in place, so
+    selections and copies can share them.
+    """
+
+    def __init__(self):
+        self.boxes = np.empty((0, 4))
+        self.confidences = np.empty(0)
+        self.label_ids = np.empty(0, dtype=np.int32)
+        self.timestamps = np.empty(0)
+        self.inference_ids = np.empty(0, dtype=object)
+        self.track_ids = np.empty(0, dtype=np.int64)
+        self.velocities = np.empty((0, 2))
+        self.labels = []
+        self._label_ids = {}
+
+        self.attr_object_ids = np.empty(0, dtype=np.int32)
+        self.attr_names = np.empty(0, dtype=object)
+        self.attr_labels = np.empty(0, dtype=object)
+        self.attr_confidences = np.empty(0)
+
+    def __len__(self):
+        return len(self.confidences)
+
+    def label_id(self, label):
+        if label not in self._label_ids:
+            self._label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        return self._label_ids[label]
+
+    def label_mask(self, labels):
+        ids = [self._label_ids[label] for label in labels if label in self._label_ids]
+        return np.isin(self.label_ids, ids)
+
+    def append(self, boxes, confidences, labels, timestamps=0, inference_ids='0', track_ids=-1, velocities=np.nan):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        n = len(boxes)
+        if n == 0: return
+
+        unique_labels, inverse = np.unique(np.asarray(labels, dtype=object).astype(str), return_inverse=True)
+        label_ids = np.array([self.label_id(label) for label in unique_labels.tolist()], dtype=np.int32)[inverse]
+
+        self.boxes = np.concatenate([self.boxes, boxes])
+        self.confidences = np.concatenate([self.confidences, np.asarray(confidences, dtype=np.float64).reshape(n)])
+        self.label_ids = np.concatenate([self.label_ids, label_ids.reshape(n)])
+        self.timestamps = np.concatenate([self.timestamps, np.broadcast_to(np.asarray(timestamps, dtype=np.float64), (n,))])
+        self.inference_ids = np.concatenate([self.inference_ids, np.broadcast_to(np.asarray(inference_ids, dtype=object), (n,))])
+        self.track_ids = np.concatenate([self.track_ids, np.broadcast_to(np.asarray(track_ids, dtype=np.int64), (n,))])
+        self.velocities = np.concatenate([self.velocities, np.broadcast_to(np.asarray(velocities, dtype=np.float64), (n, 2))])
+
+    def add_attributes(self, object_ids, names, labels, confidences):
+        object_ids = np.asarray(object_ids, dtype=np.int32).reshape(-1)
+        n = len(object_ids)
+        self.attr_object_ids = np.concatenate([self.attr_object_ids, object_ids])
+        self.attr_names = np.concatenate([self.attr_names, np.broadcast_to(np.asarray(names, dtype=object), (n,))])
+        self.attr_labels = np.concatenate([self.attr_labels, np.broadcast_to(np.asarray(labels, dtype=object), (n,))])
+        self.attr_confidences = np.concatenate([self.attr_confidences, np.asarray(confidences, dtype=np.float64).reshape(n)])
+
+    def select(self, index):
+        """New table with the objects picked by a boolean mask or indices"""
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+
+        table = self._with_labels()
+        table.boxes = self.boxes[index]
+        table.confidences = self.confidences[index]
+        table.label_ids = self.label_ids[index]
+        table.timestamps = self.timestamps[index]
+        table.inference_ids = self.inference_ids[index]
+        table.track_ids = self.track_ids[index]
+        table.velocities = self.velocities[index]
+
+        if len(self.attr_object_ids):
+            new_ids = np.full(len(self), -1, dtype=np.int32)
+            new_ids[index] = np.arange(len(index), dtype=np.int32)
+            attr_object_ids = new_ids[self.attr_object_ids]
+            keep = attr_object_ids >= 0
+            table.attr_object_ids = attr_object_ids[keep]
+            table.attr_names = self.attr_names[keep]
+            table.attr_labels = self.attr_labels[keep]
+            table.attr_confidences = self.attr_confidences[keep]
+
+        return table
+
+    def copy(self):
+        table = self._with_labels()
+        for name in ('boxes', 'confidences', 'label_ids', 'timestamps', 'inference_ids', 'track_ids', 'velocities',
+                     'attr_object_ids', 'attr_names', 'attr_labels', 'attr_confidences'):
+            setattr(table, name, getattr(self, name))
+        return table
+
+    def _with_labels(self):
+        table = ObjectsTable()
+        table.labels = list(self.labels)
+        table._label_ids = dict(self._label_ids)
+        return table
+
+    def to_dicts(self):
+        attributes = [[] for _ in range(len(self))]
+        for object_id, name, label, confidence in zip(self.attr_object_ids.tolist(), self.attr_names,
+                                                      self.attr_labels, self.attr_confidences.tolist()):
+            attributes[object_id].append({'name': name, 'label': label, 'confidence': confidence})
 
+        labels = self.labels
+        dicts = []
+        for (l, t, w, h), confidence, label_id, timestamp, inference_id, track_id, (vx, vy), object_attributes in zip(
+                self.boxes.tolist(), self.confidences.tolist(), self.label_ids.tolist(),
+                self.timestamps.tolist(), self.inference_ids.tolist(), self.track_ids.tolist(),
+                self.velocities.tolist(), attributes):
+            d = {
+                'timestamp': timestamp,
+                'label': labels[label_id],
+                'confidence': confidence,
+                'inference_id': inference_id,
+                'attributes': object_attributes,
+                'bbox': None if l != l else {'l': l, 't': t, 'w': w, 'h': h},
+            }
+            # untracked objects keep the payload they had before tracking_info existed
+            if track_id >= 0:
+                d['tracking_info'] = _tracking_info(track_id, vx, vy)
+            dicts.append(d)
+        return dicts
 
-class InsightsMeta(BaseModel):
-    objects_meta: List[ObjectMeta] = []
+    def to_objects_meta(self):
+        return [ObjectMeta(**d) for d in self.to_dicts()]
 
+    @classmethod
+    def from_objects_meta(cls, objects_meta):
+        table = cls()
+        if not objects_meta: return table
 
+        nan_bbox = (np.nan, np.nan, np.nan, np.nan)
+        table.append(
+            [nan_bbox if o.bbox is None else (o.bbox.l, o.bbox.t, o.bbox.w, o.bbox.h) for o in objects_meta],
+            [o.confidence for o in objects_meta],
+            [o.label for o in objects_meta],
+            [o.timestamp for o in objects_meta],
+            [o.inference_id for o in objects_meta],
+            [-1 if o.tracking_info is None or not o.tracking_info.tracking_id.isdigit() else int(o.tracking_info.tracking_id) for o in objects_meta],
+            [(np.nan, np.nan) if o.tracking_info is None else _velocity(o.tracking_info) for o in objects_meta])
+
+        attributes = [(i, a) for i, o in enumerate(objects_meta) for a in o.attributes]
+        if attributes:
+            table.add_attributes(
+                [i for i, _ in attributes],
+                [a.name for _, a in attributes],
+                [a.label for _, a in attributes],
+                [a.confidence for _, a in attributes])
+        return table
+
+
+def _tracking_info(track_id, vx, vy):
+    if vx != vx:
+        return {'tracking_id': str(track_id), 'speed': 0.0, 'direction': None}
+    speed = (vx * vx + vy * vy) ** 0.5
+    direction = {'x': vx / speed, 'y': vy / speed} if speed > 0 else None
+    return {'tracking_id': str(track_id), 'speed': speed, 'direction': direction}
+
+
+def _velocity(tracking_info):
+    if tracking_info.direction is None:
+        return (0.0, 0.0)
+    return (tracking_info.direction.x * tracking_info.speed, tracking_info.direction.y * tracking_info.speed)
+
+
+class InsightsMeta:
+    """Insights of a frame
+
+    The objects are kept in an ObjectsTable (.objects) which models and
+    filters work on with numpy. objects_meta builds the pydantic ObjectMeta
+    list on demand for code editing objects one by one, the list is then
+    the source of truth until .objects is read again.
+    """
+
+    __slots__ = ('_objects', '_objects_meta')
+
+    def __init__(self, objects_meta=None):
+        self._objects = None if objects_meta is not None else ObjectsTable()
+        self._objects_meta = objects_meta
+
+    @property
+    def objects(self) -> ObjectsTable:
+        if self._objects is None:
+            self._objects = ObjectsTable.from_objects_meta(self._objects_meta)
+            self._objects_meta = None
+        return self._objects
+
+    @objects.setter
+    def objects(self, objects):
+        self._objects = objects
+        self._objects_meta = None
+
+    @property
+    def objects_meta(self) -> List[ObjectMeta]:
+        if self._objects_meta is None:
+            self._objects_meta = self._objects.to_objects_meta()
+            self._objects = None
+        return self._objects_meta
+
+    @objects_meta.setter
+    def objects_meta(self, objects_meta):
+        self._objects_meta = list(objects_meta)
+        self._objects = None
+
+    def __len__(self):
+        if self._objects is not None:
+            return len(self._objects)
+        return len(self._objects_meta)
+
+    def __repr__(self):
+        return f'InsightsMeta(objects_meta={self.dict()["objects_meta"]})'
+
+    def copy(self, deep=False):
+        if self._objects is not None:
+            insights_meta = InsightsMeta()
+            insights_meta._objects = self._objects.copy() if deep else self._objects
+            return insights_meta
+        return InsightsMeta([o.copy(deep=True) for o in self._objects_meta] if deep else self._objects_meta)
+
+    def dict(self):
+        if self._objects is not None:
+            return {'objects_meta': self._objects.to_dicts()}
+        return {'objects_meta': [o.model_dump() for o in self._objects_meta]}
+
+    @classmethod
+    def validate(cls, value):
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls([ObjectMeta(**o) if isinstance(o, dict) else o for o in value.get('objects_meta', [])])
+        raise ValueError(f'cannot build InsightsMeta from {type(value).__name__}')
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        # validation keeps InsightsMeta objects as they are, the json looks like the former pydantic model
+        return core_schema.no_info_plain_validator_function(
+            cls.validate,
+            serialization=core_schema.plain_serializer_function_ser_schema(lambda insights_meta: insights_meta.dict(), when_used='json'))
+
+
+# serialization model, inside a Stream frames are frame_attr.Frame
 class Frame(BaseModel):
     image: Image
-    insights_meta: InsightsMeta = InsightsMeta()
+    insights_meta: InsightsMeta = Field(default_factory=InsightsMeta)
     timestamp: float
     frame_id: str
     instance_id: str = INSTANCE
     skill_id: str
     device_id: str
     datetime: str
+
@@ -1,14 +1,17 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-from enum import Enum
+from typing import Optional
 
-from attrs import define, field
+from attrs import define, field, evolve, asdict
 import numpy as np
+import pydantic_core
 
-class ColorFormat(Enum):
-    RGB = 'RGB'
-    BGR = 'BGR'
+from common.env import INSTANCE
+
+# the pydantic models are only built at the boundaries (exports, grpc) to serialize a frame
+import frame as pydantic_frame
+from frame import ColorFormat, InsightsMeta
 
 
 @define
@@ -18,34 +21,74 @@ class ImageProperties:
     color_format: ColorFormat
 
 
-@define
+@define(eq=False)
 class Image:
-    image_pointer: np.ndarray
+    image_pointer: np.ndarray = field(repr=False)
     properties: ImageProperties
 
 
-@define
-class Bbox:
-    l: float
-    t: float
-    w: float
-    h: float
+@define(eq=False)
+class Frame:
+    """Frame travelling through a Stream
 
-@define
-class ObjectMeta:
-    #timestamp: float
-    label: str
-    confidence: float
-    #inference_id: str
-    #attributes: list[str] #FIXME
-    bbox: Bbox
+    Slotted and without validation, so building and forking one per edge is
+    cheap. It has the same fields as frame.Frame, json() gives the same
+    payload.
+    """
+    image: Image
+    timestamp: float
+    frame_id: str
+    skill_id: str
+    device_id: str
+    datetime: str
+    insights_meta: InsightsMeta = field(factory=InsightsMeta)
+    instance_id: str = INSTANCE
+    # sampled for span tracing, see tracing
+    trace: bool = False
+    # set by MotionGateTransform and KeyframeTransform, True when the models reuse their last insights
+    static: Optional[bool] = None
 
-@define
-class InsightsMeta:
-    objects_meta: list[ObjectMeta] = field(default=[])
+    def to_pydantic(self) -> pydantic_frame.Frame:
+        properties = self.image.properties
+        return pydantic_frame.Frame.model_construct(
+            image=pydantic_frame.Image.model_construct(
+                image_pointer=self.image.image_pointer,
+                properties=pydantic_frame.ImageProperties.model_construct(
+                    height=properties.height, width=properties.width, color_format=properties.color_format)),
+            insights_meta=self.insights_meta,
+            timestamp=self.timestamp,
+            frame_id=self.frame_id,
+            instance_id=self.instance_id,
+            skill_id=self.skill_id,
+            device_id=self.device_id,
+            datetime=self.datetime,
+        )
 
-@define
-class Frame:
-    image: Image
-    insights_meta: InsightsMeta = field(default=InsightsMeta())
+    def json(self):
+        # same json as self.to_pydantic().model_dump_json(), without building the pydantic models
+        properties = self.image.properties
+        return pydantic_core.to_json({
+            'image': {'properties': {'height': properties.height, 'width': properties.width, 'color_format': properties.color_format.value}},
+            'insights_meta': self.insights_meta.dict(),
+            'timestamp': float(self.timestamp),
+            'frame_id': self.frame_id,
+            'instance_id': self.instance_id,
+            'skill_id': self.skill_id,
+            'device_id': self.device_id,
+            'datetime': self.datetime,
+        }, inf_nan_mode='null').decode()
+
+    def meta(self):
+        """Every field but the image, e.g. to rebuild the frame in another process"""
+        meta = asdict(self, recurse=False)
+        del meta['image']
+        return meta
+
+
+def fork_frame(frame):
+    """Copy a frame for another branch of the graph.
 
+    The image buffer is shared between branches (sources mark it read-only),
+    only the insights meta is cloned so each branch can edit its own objects.
+    """
+    return evolve(frame, insights_meta=frame.insights_meta.copy(deep=True))
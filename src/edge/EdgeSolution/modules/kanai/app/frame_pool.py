@@ -0,0 +1,52 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import queue
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class FramePool:
+    """Fixed size image slots in one shared memory block
+
+    The owner (name=None) creates the block and hands out free slots, other
+    processes attach to it by name and only read the slots they are given.
+    """
+
+    def __init__(self, slot_size, num_slots, name=None):
+        self.slot_size = slot_size
+        self.num_slots = num_slots
+        self.is_owner = name is None
+
+        if self.is_owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=slot_size * num_slots)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+        self._free = queue.Queue()
+        if self.is_owner:
+            for slot in range(num_slots):
+                self._free.put(slot)
+
+    def acquire(self, timeout=None):
+        return self._free.get(timeout=timeout)
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def fits(self, img):
+        return img.nbytes <= self.slot_size
+
+    def view(self, slot, shape, dtype):
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=slot * self.slot_size)
+
+    def write(self, slot, img):
+        self.view(slot, img.shape, img.dtype)[...] = img
+
+    def close(self):
+        # unlink first so the segment is freed even if a view is still alive
+        if self.is_owner:
+            self.shm.unlink()
+        self.shm.close()
@@ -21,6 +21,7 @@ from common.voe_status import StatusEnum
 
 from predict_module import predict_module
 from streaming_module import streaming_module
+import metrics
 
 last_skills = {
 }
@@ -33,6 +34,42 @@ STATUS_INITIALIZING_PREDICTMODULE = '2'
 STATUS_INITIALIZING_STREAMINGMODULE = '3'
 
 
+def wait_for_export(model_config):
+    """Poll symphony until the customvision model is exported, then fill download_uri
+
+    Runs in the predict module loading workers so every model is exported concurrently.
+    """
+
+    if not (model_config.provider == 'customvision' and \
+            model_config.executor == 'customvision' and \
+            model_config.type == 'ObjectDetection'):
+        return
+
+    model_name = model_config.name
+
+    while True:
+        try:
+            res = client.export_model(model_name)
+            if res is None or len(res) == 0:
+                print(
+                    f'Model {model_name} is Not Ready to Export', flush=True)
+            elif len(res) > 0:
+                m = res[0]
+                if m['status'] == 'Exporting':
+                    print(f'Exporting Model {model_name}')
+                elif m['status'] == 'Done':
+                    download_uri = m['downloadUri']
+                    break
+
+        except Exception as e:
+            print(e, flush=True)
+
+        time.sleep(3)
+
+    print('Got Download URI', download_uri)
+    model_config.download_uri = download_uri
+
+
 def process_skill(skill, skill_name, instance_name):
 
     skill_spec = SkillSpec(**skill['spec'])
@@ -80,35 +117,7 @@ def process_skill(skill, skill_name, instance_name):
                 type=model_type,
             )
 
-            if model_config.provider == 'customvision' and \
-                    model_config.executor == 'customvision' and \
-                    model_config.type == 'ObjectDetection':
-
-                while True:
-                    try:
-                        res = client.export_model(model_name)
-                        if res is None or len(res) == 0:
-                            print(
-                                f'Model {model_name} is Not Ready to Export', flush=True)
-                        elif len(res) > 0:
-                            m = res[0]
-                            if m['status'] == 'Exporting':
-                                print(f'Exporting Model {model_name}')
-                            elif m['status'] == 'Done':
-                                download_uri = m['downloadUri']
-                                break
-
-                    except Exception as e:
-                        print(e, flush=True)
-
-                    time.sleep(3)
-
-                else:
-                    raise Exception(
-                        'Unknown subtype {skill_node.sub_type} for customvision')
-
-                print('Got Download URI', download_uri)
-                model_config.download_uri = download_uri
+            # customvision models are exported later, see wait_for_export
 
             model_configs.append(model_config)
 
@@ -131,7 +140,8 @@ def process_skill(skill, skill_name, instance_name):
                 id=skill_node.id,
                 type='model',
                 name=node_name,
-                configurations=configurations
+                configurations=configurations,
+                execution=skill_node.execution
             )
         elif skill_node.type == 'source':
 
@@ -153,7 +163,8 @@ def process_skill(skill, skill_name, instance_name):
                 id=skill_node.id,
                 type=skill_node.type,
                 name=skill_node.name,
-                configurations=configurations or {}
+                configurations=configurations or {},
+                execution=skill_node.execution
             )
 
         else:
@@ -161,7 +172,8 @@ def process_skill(skill, skill_name, instance_name):
                 id=skill_node.id,
                 type=skill_node.type,
                 name=skill_node.name,
-                configurations=skill_node.configurations or {}
+                configurations=skill_node.configurations or {},
+                execution=skill_node.execution
             )
 
         nodes.append(node)
@@ -171,6 +183,10 @@ def process_skill(skill, skill_name, instance_name):
             source=skill_edge.source.node,
             target=skill_edge.target.node
         )
+        if skill_edge.queue_policy is not None:
+            edge.queue_policy = skill_edge.queue_policy
+        if skill_edge.sample_interval is not None:
+            edge.sample_interval = skill_edge.sample_interval
         edges.append(edge)
 
     cascade_config = CascadeConfig(edges=edges, nodes=nodes)
@@ -219,6 +235,7 @@ if __name__ == '__main__':
         print(skill, flush=True)
         new_cascade_config, new_model_configs = process_skill(
             skill, skill_name, instance_name)
+        new_cascade_config.name = skill_alias
 
         cascade_configs.append(new_cascade_config)
         model_configs += new_model_configs
@@ -227,18 +244,28 @@ if __name__ == '__main__':
         cascade_configs=cascade_configs)
     predictmodule_setting = PredictModule.Setting(model_configs=model_configs)
 
+    metrics.start_http_server()
+
     print('Initializing predict module', flush=True)
     client.post_instance_status(
         instance_name, STATUS_INITIALIZING_PREDICTMODULE, "initialzing predict module")
-    predict_module.set(predictmodule_setting)
+    # models load in the background, each stream starts as soon as its models are ready
+    predict_module.set(predictmodule_setting, prepare=wait_for_export)
 
     print('Initializing streaming module', flush=True)
     client.post_instance_status(
         instance_name, STATUS_INITIALIZING_STREAMINGMODULE, "initialzing streaming module")
     streaming_module.start(streamingmodule_setting)
-
-    print('Running', flush=True)
-    client.post_instance_status(instance_name, STATUS_RUNNING, "running")
+    # the status stays initializing while models are exported or downloaded
+    streaming_module.wait_started()
+
+    if streaming_module.failed:
+        failed = ', '.join(f'{name}: {error}' for name, error in streaming_module.failed.items())
+        print(f'Running, {len(streaming_module.failed)} pipelines failed to start ({failed})', flush=True)
+        client.post_instance_status(instance_name, STATUS_RUNNING, f"running, failed to start {failed}")
+    else:
+        print('Running', flush=True)
+        client.post_instance_status(instance_name, STATUS_RUNNING, "running")
 
     streaming_module.join()
 
@@ -0,0 +1,168 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import json
+import bisect
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import tracing
+
+
+# prometheus endpoint (http://<kanai>:METRICS_PORT/metrics), 0 disables it
+# the traced frames are served in the chrome trace format on /trace
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9464))
+
+# seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # counts[i] is the number of values <= buckets[i] and > buckets[i-1], the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ElementMetrics:
+    """Counters of one element, written by the element threads only"""
+
+    def __init__(self):
+        self.labels = {}
+        self.process_seconds = Histogram()
+        self.queue_wait_seconds = Histogram()
+        self.frames_in = 0
+        self.frames_out = 0
+        self.frames_dropped = 0
+        # models only, static frames which reused the last insights
+        self.inferences_saved = 0
+
+
+def _format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for k, v in labels.items())
+
+
+class Registry:
+
+    def __init__(self):
+        self._elements = []
+        self._counters = []
+        self._lock = threading.Lock()
+
+    def register(self, element, **labels):
+        element.metrics.labels = labels
+        with self._lock:
+            self._elements.append(element)
+
+    def add_counter(self, name, description, collect):
+        """Counter kept outside the elements, collect() returns [(labels, value)]"""
+        with self._lock:
+            self._counters.append((name, description, collect, 'counter'))
+
+    def add_gauge(self, name, description, collect):
+        """Like add_counter for a value which goes up and down"""
+        with self._lock:
+            self._counters.append((name, description, collect, 'gauge'))
+
+    def render(self):
+        with self._lock:
+            elements = list(self._elements)
+            counters = list(self._counters)
+
+        lines = []
+
+        for name, attr, description in (
+                ('kanai_element_process_seconds', 'process_seconds', 'Time to process a frame'),
+                ('kanai_element_queue_wait_seconds', 'queue_wait_seconds', 'Time a frame waited in the input queue')):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for element in elements:
+                labels = element.metrics.labels
+                histogram = getattr(element.metrics, attr)
+                cumulative = 0
+                for le, count in zip(histogram.buckets + ('+Inf',), list(histogram.counts)):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{_format_labels(labels, le=le)}}} {cumulative}')
+                lines.append(f'{name}_sum{{{_format_labels(labels)}}} {histogram.sum}')
+                lines.append(f'{name}_count{{{_format_labels(labels)}}} {cumulative}')
+
+        for name, attr, description in (
+                ('kanai_element_frames_in_total', 'frames_in', 'Frames received'),
+                ('kanai_element_frames_out_total', 'frames_out', 'Frames sent to the children'),
+                ('kanai_element_frames_dropped_total', 'frames_dropped', 'Frames dropped because the input queue was full or their worker process exited'),
+                ('kanai_element_inferences_saved_total', 'inferences_saved', 'Static frames which reused the last insights instead of running the model')):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} counter')
+            for element in elements:
+                lines.append(f'{name}{{{_format_labels(element.metrics.labels)}}} {getattr(element.metrics, attr)}')
+
+        lines.append('# HELP kanai_element_queue_depth Frames waiting in the input queue')
+        lines.append('# TYPE kanai_element_queue_depth gauge')
+        for element in elements:
+            lines.append(f'kanai_element_queue_depth{{{_format_labels(element.metrics.labels)}}} {element.queue_depth()}')
+
+        for name, key, description in (
+                ('kanai_edge_frames_sent_total', 'frames_sent', 'Frames queued to the target'),
+                ('kanai_edge_frames_dropped_total', 'frames_dropped', 'Frames dropped by the edge queue policy'),
+                ('kanai_edge_frames_skipped_total', 'frames_skipped', 'Frames skipped by the edge sampling')):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} counter')
+            for element in elements:
+                for link in element._links:
+                    labels = {k: v for k, v in element.metrics.labels.items() if k != 'node'}
+                    lines.append(f'{name}{{{_format_labels(labels, source=link.parent.name, target=link.child.name)}}} {getattr(link, key)}')
+
+        for name, description, collect, kind in counters:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in collect():
+                lines.append(f'{name}{{{_format_labels(labels)}}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body = registry.render().encode()
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/trace':
+            body = json.dumps(tracing.tracer.chrome_trace()).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port=METRICS_PORT):
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('0.0.0.0', port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    print(f'[Metrics] serving prometheus metrics on :{port}/metrics', flush=True)
+    return server
@@ -0,0 +1,36 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+#
+# On-disk cache of everything that is slow to rebuild when the container restarts
+# (patched onnx, optimized graphs, TensorRT engines, OpenVINO blobs), kept next to
+# the model in models/<name>/cache/<model hash>-<provider>-<device>/
+#
+
+import os
+import hashlib
+
+
+def file_hash(*filenames):
+    h = hashlib.sha256()
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def get_cache_dir(model_filenames, provider, device):
+    """Return (and create) the cache folder for this model, provider and device"""
+    model_dir = os.path.dirname(model_filenames[0])
+    key = f'{file_hash(*model_filenames)}-{provider}-{device}'
+    cache_dir = os.path.join(model_dir, 'cache', key)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def atomic_save(save_func, filename):
+    # a container killed in the middle of a save must not leave a broken cache entry
+    tmp = filename + '.tmp'
+    save_func(tmp)
+    os.replace(tmp, filename)
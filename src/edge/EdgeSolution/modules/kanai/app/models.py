@@ -6,15 +6,19 @@ from typing import List
 import requests
 from pydantic import BaseModel
 
-from node import Model
+from node import Model, AsyncModel
 from frame import Frame, Bbox, ObjectMeta, Attribute
 #from common.voe_ipc import PredictModule
 from predict_module import predict_module
+import tracing
 from common.voe_utils import upload_relabel_image
 
-from core import ObjectDetectionResult, ClassificationResult
+from core import ObjectDetectionResult, ClassificationResult, ObjectDetectionArrays
+from roi import parse_regions, RoiMosaic
+from tiling import Tiling
 
 import cv2
+import numpy as np
 import base64
 import requests
 import time
@@ -47,9 +51,10 @@ class FakeModel(Model):
 
 RELABEL_INTERVAL = 10 #second
 
-class ObjectDetectionModel(Model):
+class ObjectDetectionModel(AsyncModel):
 
-    def __init__(self, model, symphony_name, provider, confidence_lower=None, confidence_upper=None, max_images=None):
+    def __init__(self, model, symphony_name, provider, confidence_lower=None, confidence_upper=None, max_images=None, roi=None,
+                 tile_size=None, tile_overlap=0.2, tile_full_frame=True):
         super().__init__()
         self.model = model
 
@@ -59,6 +64,16 @@ class ObjectDetectionModel(Model):
         self.symphony_name = symphony_name
         self.provider = provider
 
+        # only the regions of interest are inferred, cropped & stitched into one image (see roi)
+        self.roi = parse_regions(roi)
+        self._mosaics = {}
+
+        # frames larger than tile_size pixels are inferred as a batch of overlapping tiles (see tiling)
+        self.tile_size = int(tile_size) if tile_size else None
+        self.tile_overlap = float(tile_overlap)
+        self.tile_full_frame = tile_full_frame in (True, 'true', 'True', '1')
+        self._tilings = {}
+
         self.is_relabel = False
         if (self.confidence_lower is not None) and \
             (self.confidence_upper is not None) and \
@@ -71,7 +86,7 @@ class ObjectDetectionModel(Model):
         self.last_relabel = -1
         self.relabel_count = 0
 
-    def process(self, frame):
+    def process_async(self, frame, done):
 
         # FIXME should resize according to model input size
         #img_to_predict = cv2.resize(frame.image.image_pointer, (300, 300))
@@ -86,12 +101,49 @@ class ObjectDetectionModel(Model):
         #    return 
 
         img = frame.image.image_pointer
-        width = frame.image.properties.width
-        height = frame.image.properties.height
-        
-        res = predict_module.predict(self.model, img)
-        
+        if self.roi:
+            img = self._mosaic(img).crop(img)
+
+        if self.tile_size:
+            h, w = img.shape[:2]
+            predict_module.predict_batch_async(self.model, self._tiling(w, h).crop(img), done, trace=tracing.context(frame))
+            return
         
+        predict_module.predict_async(self.model, img, done, trace=tracing.context(frame))
+
+    def _mosaic(self, img):
+        h, w = img.shape[:2]
+        if (w, h) not in self._mosaics:
+            mosaic = RoiMosaic(self.roi, w, h)
+            print(f'[ObjectDetectionModel] {self.name} infers {len(mosaic)} regions of {w}x{h} frames as a {mosaic.mosaic_width}x{mosaic.mosaic_height} image ({mosaic.pixel_ratio()*100:.0f}% of the pixels)', flush=True)
+            self._mosaics[w, h] = mosaic
+        return self._mosaics[w, h]
+
+    def _tiling(self, w, h):
+        if (w, h) not in self._tilings:
+            tiling = Tiling(w, h, self.tile_size, self.tile_overlap, self.tile_full_frame)
+            print(f'[ObjectDetectionModel] {self.name} infers {w}x{h} images as {len(tiling)} tiles of {self.tile_size} pixels', flush=True)
+            self._tilings[w, h] = tiling
+        return self._tilings[w, h]
+
+    def process_result(self, frame, res):
+
+        if res is None: return
+
+        img = frame.image.image_pointer
+
+        if self.tile_size:
+            # the tiles are cut from the mosaic when there are regions of interest
+            if self.roi:
+                mosaic = self._mosaic(img)
+                w, h = mosaic.mosaic_width, mosaic.mosaic_height
+            else:
+                h, w = img.shape[:2]
+            res = ObjectDetectionArrays(*self._tiling(w, h).merge(res))
+
+        if self.roi:
+            boxes, keep = self._mosaic(img).map_boxes(res.boxes)
+            res = ObjectDetectionArrays(boxes, np.asarray(res.confidences, dtype=np.float64)[keep], [res.labels[i] for i in keep])
 
         #print(res)
         #print(res.json())
@@ -99,33 +151,25 @@ class ObjectDetectionModel(Model):
         #    res = ObjectDetectionModelResult(**res.json())
         #except:
         #    return
-        for obj in res.objects:
-
-            x1 = max(0, obj.bbox.l)
-            y1 = max(0, obj.bbox.t)
-            x2 = min(1, obj.bbox.l + obj.bbox.w)
-            y2 = min(1, obj.bbox.t + obj.bbox.h)
-
-            
-            n_bbox = Bbox(
-                l=x1,
-                t=y1,
-                w=x2-x1,
-                h=y2-y1,
-            )
-
-            # FIXME
-            object_meta = ObjectMeta(timestamp=0, inference_id='0', label=obj.label, bbox=n_bbox, confidence=obj.confidence, attributes=[])
-            frame.insights_meta.objects_meta.append(object_meta)
-
-            # FIXME send image to webmodule for train new models (according to confidence threshold)
-            if self.provider == 'customvision':
-                if self.is_relabel and self.relabel_count < self.max_images:
+        boxes = np.asarray(res.boxes, dtype=np.float64).reshape(-1, 4)
+        confidences = np.asarray(res.confidences, dtype=np.float64)
+
+        x1 = np.maximum(0, boxes[:, 0])
+        y1 = np.maximum(0, boxes[:, 1])
+        x2 = np.minimum(1, boxes[:, 0] + boxes[:, 2])
+        y2 = np.minimum(1, boxes[:, 1] + boxes[:, 3])
+
+        # FIXME
+        frame.insights_meta.objects.append(np.stack([x1, y1, x2-x1, y2-y1], axis=1), confidences, res.labels, timestamps=0, inference_ids='0')
+
+        # FIXME send image to webmodule for train new models (according to confidence threshold)
+        if self.provider == 'customvision' and self.is_relabel:
+            for i in np.flatnonzero((self.confidence_lower <= confidences) & (confidences <= self.confidence_upper)):
+                if self.relabel_count < self.max_images:
                     if time.time() > self.last_relabel + RELABEL_INTERVAL:
-                        if self.confidence_lower <= obj.confidence <= self.confidence_upper:
-                            self.relabel_count += 1
-                            self.last_relabel = time.time()
-                            upload_relabel_image(self.symphony_name, img, [obj], self.max_images)
+                        self.relabel_count += 1
+                        self.last_relabel = time.time()
+                        upload_relabel_image(self.symphony_name, img, [res.objects[i]], self.max_images)
                        
 #class Classification(BaseModel):
 #    name: str
@@ -144,40 +188,35 @@ class ClassificationModel(Model):
         self.model = model
 
     def process(self, frame):
-        
+
         img = frame.image.image_pointer
         width = frame.image.properties.width
         height = frame.image.properties.height
-    
-        for object_meta in frame.insights_meta.objects_meta:
-
-            x1 = max(0, int(object_meta.bbox.l * width))
-            x2 = min(width-1, int( ( object_meta.bbox.l+ object_meta.bbox.w) * width ))
-            y1 = max(0, int( object_meta.bbox.t * height ))
-            y2 = min(height-1, int( ( object_meta.bbox.t+ object_meta.bbox.h) * height ))
-
-            if x2-x1 <= 0 or y2-y1 <= 0: continue
-            
-            cropped_img = img[y1:y2, x1:x2].copy()
-            cropped_h, cropped_w, _ = cropped_img.shape
-
-            #try:
-            #    res = requests.post(PredictModule.Url + '/predict/'+self.model, files={'file': cropped_img}, params={'width': cropped_w, 'height': cropped_h})
-            #except:
-            #    return
-            #print(res, flush=True)
-
-            #res = ClassificationModelResult(**res.json())
-            res = predict_module.predict(self.model, img)
-
-            for classification in res.classifications:
-                object_meta.attributes.append(
-                    Attribute(
-                        name=classification.name,
-                        label=classification.label,
-                        confidence=classification.confidence
-                    )
-                )   
+
+        objects = frame.insights_meta.objects
+
+        # pixel rectangles of the objects with a bbox, the crops are views of the frame
+        rows = np.flatnonzero(~np.isnan(objects.boxes[:, 0]))
+        l, t, w, h = objects.boxes[rows].T
+        x1 = np.maximum(0, (l * width).astype(int))
+        x2 = np.minimum(width-1, ((l + w) * width).astype(int))
+        y1 = np.maximum(0, (t * height).astype(int))
+        y2 = np.minimum(height-1, ((t + h) * height).astype(int))
+        keep = (x2 > x1) & (y2 > y1)
+        if not keep.any(): return
+
+        crops = [img[b:d, a:c] for a, b, c, d in zip(x1[keep].tolist(), y1[keep].tolist(), x2[keep].tolist(), y2[keep].tolist())]
+
+        # one inference for all the crops, up to the max batch size of the model
+        results = predict_module.predict_batch(self.model, crops, trace=tracing.context(frame))
+        if results is None: return
+
+        classifications = [(i, classification) for i, res in zip(rows[keep].tolist(), results) for classification in res.classifications]
+        objects.add_attributes(
+            [i for i, _ in classifications],
+            [classification.name for _, classification in classifications],
+            [classification.label for _, classification in classifications],
+            [classification.confidence for _, classification in classifications])
 
 class GPT4Model(Model):
 
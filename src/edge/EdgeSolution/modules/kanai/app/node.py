@@ -3,9 +3,83 @@
 
 import queue
 import threading
-import copy
+import time
+import collections
+
+from frame_attr import Frame, Image, fork_frame
+from metrics import ElementMetrics
+import tracing
+
+QUEUE_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+EDGE_REPORT_INTERVAL = 10 # second
+
+
+class Link:
+    """Edge from an element to one of its children
+
+    The queue policy decides what happens when the child is still busy:
+    'block' waits for it, 'drop_oldest' replaces the oldest queued frame and
+    'drop_newest' discards the incoming one, so a slow branch only loses its
+    own frames instead of stalling its siblings. With sample_interval N only
+    every Nth frame is forwarded.
+    """
+
+    def __init__(self, parent, child, queue_policy='block', sample_interval=1):
+        if queue_policy not in QUEUE_POLICIES:
+            raise Exception(f'Unknown queue policy {queue_policy}')
+        if sample_interval < 1:
+            raise Exception(f'Invalid sample interval {sample_interval}')
+
+        self.parent = parent
+        self.child = child
+        self.queue_policy = queue_policy
+        self.sample_interval = sample_interval
+
+        self.frames_in = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.frames_skipped = 0
+        self._last_report = 0
+        self._last_report_dropped = 0
+
+    @property
+    def name(self):
+        return f'{self.parent.name}->{self.child.name}'
+
+    def send(self, frame):
+        self.frames_in += 1
+        if (self.frames_in - 1) % self.sample_interval:
+            self.frames_skipped += 1
+            if frame.trace:
+                tracing.tracer.instant(tracing.context(frame), self.name, 'skipped', time.time())
+            return
+
+        if self.child.send(frame, self.queue_policy):
+            self.frames_sent += 1
+        else:
+            self.frames_dropped += 1
+
+        timestamp = time.time()
+        if self.frames_dropped > self._last_report_dropped and timestamp > self._last_report + EDGE_REPORT_INTERVAL:
+            print(f'[Link] {self.name} dropped {self.frames_dropped - self._last_report_dropped} frames ({self.queue_policy}, queue depth {self.queue_depth()})', flush=True)
+            self._last_report = timestamp
+            self._last_report_dropped = self.frames_dropped
+
+    def queue_depth(self):
+        return self.child.queue_depth()
+
+    def stats(self):
+        return {
+            'edge': self.name,
+            'queue_policy': self.queue_policy,
+            'sample_interval': self.sample_interval,
+            'frames_in': self.frames_in,
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'frames_skipped': self.frames_skipped,
+            'queue_depth': self.queue_depth(),
+        }
 
-from frame import Frame, Image
 
 class Element:
     def __init__(self):
@@ -13,61 +87,191 @@ class Element:
         self._thread.setDaemon(True)
         self._running = False
         self._children = []
+        self._links = []
+        self._q = None
+        self.name = type(self).__name__
+        self.metrics = ElementMetrics()
+
+        # elements fused after this one run in this thread, see fuse()
+        self._fused = []
+        self._head = self
 
     def loop(self):
         raise NotImplementedError
 
-    def add_child(self, element):
+    def add_child(self, element, queue_policy='block', sample_interval=1):
         self._children.append(element)
+        self._links.append(Link(self, element, queue_policy, sample_interval))
+
+    def is_fusable(self):
+        """Whether process can run in the thread of the parent instead of its own"""
+        return False
+
+    def fuse(self, element):
+        """Run element.process in this element's thread right after it, without a queue
+
+        Fusing a chain a -> b -> c makes a run b.process then c.process and
+        send the frame to the children of c. b and c don't start a thread.
+        """
+        head = self._head
+        head._fused.append(element)
+        element._head = head
+
+    def send_children(self, frame):
+        self.metrics.frames_out += 1
+        element = self
+        for element in self._fused:
+            element.metrics.frames_in += 1
+            element.timed_process(frame)
+            element.metrics.frames_out += 1
+        for link in element._links:
+            link.send(frame)
+
+    def timed_process(self, frame):
+        start = time.perf_counter()
+        self.process(frame)
+        duration = time.perf_counter() - start
+        self.metrics.process_seconds.observe(duration)
+        if frame.trace:
+            self.trace(frame, 'process', duration)
+
+    def trace(self, frame, name, duration, **args):
+        """Record a span of a traced frame which ended now"""
+        end = time.time()
+        tracing.tracer.span(tracing.context(frame), self.name, name, end - duration, end, **args)
+
+    def threads(self):
+        return [self._thread] if self._head is self else []
+
+    def send(self, frame, queue_policy='block'):
+        """Queue a frame for this element, returns False if a frame was dropped"""
+        if not frame.trace:
+            return self._put(frame, queue_policy)
+
+        start = time.perf_counter()
+        sent = self._put(frame, queue_policy)
+        if sent or queue_policy == 'drop_oldest':
+            self.trace(frame, 'enqueue', time.perf_counter() - start, queue_policy=queue_policy)
+        else:
+            tracing.tracer.instant(tracing.context(frame), self.name, 'dropped', time.time(), queue_policy=queue_policy)
+        return sent
+
+    def _put(self, frame, queue_policy):
+        if queue_policy == 'drop_newest':
+            if self._q.full():
+                self.metrics.frames_dropped += 1
+                return False
+            try:
+                self._q.put_nowait((time.perf_counter(), fork_frame(frame)))
+            except queue.Full:
+                self.metrics.frames_dropped += 1
+                return False
+            return True
+
+        item = (time.perf_counter(), fork_frame(frame))
+        if queue_policy == 'drop_oldest':
+            dropped = False
+            while True:
+                try:
+                    self._q.put_nowait(item)
+                    return not dropped
+                except queue.Full:
+                    try:
+                        _, oldest = self._q.get_nowait()
+                        self.metrics.frames_dropped += 1
+                        dropped = True
+                        if oldest.trace:
+                            tracing.tracer.instant(tracing.context(oldest), self.name, 'dropped', time.time(), queue_policy=queue_policy)
+                    except queue.Empty:
+                        pass
+
+        self._q.put(item)
+        return True
+
+    def receive(self):
+        """Next frame of the input queue"""
+        enqueued, frame = self._q.get()
+        wait = time.perf_counter() - enqueued
+        self.metrics.queue_wait_seconds.observe(wait)
+        self.metrics.frames_in += 1
+        if frame.trace:
+            self.trace(frame, 'queue', wait)
+        return frame
+
+    def queue_depth(self):
+        return self._q.qsize() if self._q is not None else 0
+
+    def stats(self):
+        return [link.stats() for link in self._links]
 
     def start(self):
         self._running = True
-        self._thread.start()
+        if self._head is self:
+            self._thread.start()
 
     def stop(self):
         self._running = False
         
 
     def join(self):
-        self._thread.join()
+        if self._head is self:
+            self._thread.join()
 
 
 class Source(Element):
     def __init__(self):
         super().__init__()
-        
-        self._children = []
 
     def loop(self):
         while True:
             frame = self.next_frame()
-            for child in self._children:
-                child.send(frame)
+            # frames are shared by every branch, nobody should draw on the source image
+            frame.image.image_pointer.flags.writeable = False
+            if tracing.tracer.sample():
+                frame.trace = True
+                self.trace_capture(frame)
+            self.send_children(frame)
 
     def next_frame(self) -> Frame:
         raise NotImplementedError    
 
+    def trace_capture(self, frame):
+        """Record the spans of a sampled frame before it leaves the source"""
+        tracing.tracer.span(tracing.context(frame), self.name, 'capture', frame.timestamp, time.time())
+
+
+LATENCY_REPORT_INTERVAL = 5 # second
+
 
 class Export(Element):
     def __init__(self):
         super().__init__()
         self._q = queue.Queue(maxsize=2)
 
+        # moving avg of capture-to-export latency
+        self.latency = 0
+        self._last_latency_report = 0
+
     def loop(self):
         while True:
-            frame = self._q.get()
-            self.process(frame)
+            frame = self.receive()
+            self.timed_process(frame)
+            self._update_latency(frame)
+
+    def _update_latency(self, frame):
+        timestamp = time.time()
+        if frame.trace:
+            tracing.tracer.span(tracing.context(frame), self.name, 'capture_to_export', frame.timestamp, timestamp)
+        self.latency = self.latency * 7/8 + (timestamp - frame.timestamp) * 1/8
+        if timestamp > self._last_latency_report + LATENCY_REPORT_INTERVAL:
+            print(f'[{type(self).__name__}] {frame.skill_id} capture to export latency {self.latency*1000:.0f} ms', flush=True)
+            self._last_latency_report = timestamp
 
     def process(self, frame):
         raise NotImplementedError
 
 
 
-    def send(self, frame):
-        #FIXME dont deeply copy image
-        frame = copy.deepcopy(frame)
-        self._q.put(frame)
-
 
 class Transform(Element):
     def __init__(self):
@@ -76,19 +280,151 @@ class Transform(Element):
 
     def loop(self):
         while True:
-            frame = self._q.get()
-            self.process(frame)
-            for child in self._children:
-                child.send(frame)
+            frame = self.receive()
+            self.timed_process(frame)
+            self.send_children(frame)
 
     def process(self, frame):
         raise NotImplementedError
 
-    def send(self, frame):
-        #FIXME dont deeply copy image
-        frame = copy.deepcopy(frame)
-        self._q.put(frame)
+    def is_fusable(self):
+        # elements with their own loop (e.g. AsyncModel) need their thread
+        return type(self).loop is Transform.loop
 
 class Model(Transform):
+    """Transform running a model
+
+    Frames marked static (motion or keyframe gate) reuse the insights of the last frame
+    the model ran on instead of running it again.
+    """
+
     def __init__(self):
         super().__init__()
+        self._last_insights_meta = None
+
+    def timed_process(self, frame):
+        if self._reuse_insights(frame):
+            return
+        super().timed_process(frame)
+        self._remember_insights(frame)
+
+    def _reuse_insights(self, frame):
+        if not frame.static:
+            return False
+        if self._last_insights_meta is None:
+            # nothing to reuse yet, the models after this one must not reuse theirs either
+            frame.static = False
+            return False
+        frame.insights_meta = self._last_insights_meta.copy(deep=True)
+        self.metrics.inferences_saved += 1
+        return True
+
+    def _remember_insights(self, frame):
+        # only worth a copy behind a motion gate
+        if frame.static is not None:
+            self._last_insights_meta = frame.insights_meta.copy(deep=True)
+
+
+class AsyncModel(Model):
+    """Model whose inference finishes in a callback
+
+    The loop keeps dequeuing frames while up to MAX_IN_FLIGHT inferences run.
+    Callbacks only record the result, a sender thread calls process_result and
+    sends the frames to the children in the order they arrived, so a slow
+    child never blocks the thread that completed the inference.
+    """
+
+    MAX_IN_FLIGHT = 4
+
+    # result of the pending entries which reused the last insights
+    _REUSED = object()
+
+    def __init__(self):
+        super().__init__()
+        self._pending = collections.deque()
+        self._pending_cv = threading.Condition()
+        self._in_flight = threading.Semaphore(self.MAX_IN_FLIGHT)
+        self._sender_thread = threading.Thread(target=self._send_loop)
+        self._sender_thread.setDaemon(True)
+
+    def start(self):
+        super().start()
+        self._sender_thread.start()
+
+    def threads(self):
+        return super().threads() + [self._sender_thread]
+
+    def loop(self):
+        while True:
+            frame = self.receive()
+
+            if self._reuse_insights(frame):
+                # still sent in order, after the frames being inferred
+                with self._pending_cv:
+                    self._pending.append([frame, True, self._REUSED, time.perf_counter()])
+                    self._pending_cv.notify()
+                continue
+
+            self._in_flight.acquire()
+
+            # [frame, finished, result, start]
+            entry = [frame, False, None, time.perf_counter()]
+            with self._pending_cv:
+                self._pending.append(entry)
+
+            try:
+                self.process_async(frame, lambda result, entry=entry: self._done(entry, result))
+            except Exception as e:
+                print(f'[AsyncModel] failed to process frame {frame.frame_id}: {e}', flush=True)
+                self._done(entry, None)
+
+    def _done(self, entry, result):
+        with self._pending_cv:
+            entry[1] = True
+            entry[2] = result
+            self._pending_cv.notify()
+
+    def _send_loop(self):
+        while True:
+            with self._pending_cv:
+                while not (self._pending and self._pending[0][1]):
+                    self._pending_cv.wait()
+                frame, _, result, start = self._pending.popleft()
+
+            if result is self._REUSED:
+                self.send_children(frame)
+                continue
+
+            result_start = time.perf_counter()
+            try:
+                self.process_result(frame, result)
+            except Exception as e:
+                print(f'[AsyncModel] failed to process result of frame {frame.frame_id}: {e}', flush=True)
+            if frame.trace:
+                self.trace(frame, 'postprocess', time.perf_counter() - result_start)
+            if result is not None:
+                self._remember_insights(frame)
+            self._in_flight.release()
+            duration = time.perf_counter() - start
+            self.metrics.process_seconds.observe(duration)
+            if frame.trace:
+                self.trace(frame, 'process', duration)
+
+            self.send_children(frame)
+
+    def process(self, frame):
+        finished = threading.Event()
+        holder = []
+        def _done(result):
+            holder.append(result)
+            finished.set()
+        self.process_async(frame, _done)
+        finished.wait()
+        self.process_result(frame, holder[0])
+
+    def process_async(self, frame, done):
+        """Start the inference, done(result) may be called from any thread"""
+        raise NotImplementedError
+
+    def process_result(self, frame, result):
+        raise NotImplementedError
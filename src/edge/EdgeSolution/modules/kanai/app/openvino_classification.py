@@ -2,10 +2,14 @@
 # Licensed under the MIT License.
 
 from lib2to3.pgen2.token import OP
-from openvino.runtime import Core 
+from openvino.runtime import Core, AsyncInferQueue, PartialShape, Dimension
 import numpy as np
 import cv2
+import time
+import os
 
+from model_cache import get_cache_dir
+from preprocess_cache import preprocess_cache
 from core import ClassificationModel, Classification, ClassificationResult, Object, Bbox
 
 
@@ -64,12 +68,13 @@ outputs = {
 # Reference: https://docs.openvino.ai/latest/omz_models_model_face_detection_0200.html#doxid-omz-models-model-face-detection-0200
 class OpenVINOClassificationModel(ClassificationModel):
 
-    def __init__(self, model_name):
+    def __init__(self, model_name, max_batch_size=1, performance_hint='THROUGHPUT', num_requests=0):
 
         #FIXME download model if needed
 
 
         #model_xml = f'models/{model_name}/FP32/{model_name}.xml'
+        start = time.time()
         model_xml = f'models/{model_name}/{model_name}.xml'
         model = ie.read_model(model=model_xml)
 
@@ -80,86 +85,141 @@ class OpenVINOClassificationModel(ClassificationModel):
         device_name = 'CPU'
         if 'GPU' in ie.available_devices: device_name = 'GPU'
 
-        self.model = ie.compile_model(model=model, device_name=device_name) #FIXME device_name from solution
+        #self.dsize = (256, 256)
+        _, c, h, w = model.input().shape
+        # cv2 sizes are (width, height)
+        self.dsize = w, h
+        self.channels = c
+
+        self.max_batch_size = 1
+        if max_batch_size > 1:
+            # let the batch dimension float so crops from several streams can share one inference
+            try:
+                model.reshape(PartialShape([Dimension(1, max_batch_size), Dimension(c), Dimension(h), Dimension(w)]))
+                self.max_batch_size = max_batch_size
+            except Exception as e:
+                print(f'[OpenVINO] {model_name} does not support batching: {e}', flush=True)
+
+        # THROUGHPUT lets the plugin use several streams so parallel requests keep every core busy
+        config = {'PERFORMANCE_HINT': performance_hint}
+
+        # compiled blobs are reused across restarts, OpenVINO keys them by model & config itself
+        cache_dir = get_cache_dir([model_xml, model_xml[:-len('.xml')] + '.bin'], 'openvino', device_name)
+        cache_hit = len(os.listdir(cache_dir)) > 0
+        config['CACHE_DIR'] = cache_dir
+
+        try:
+            self.model = ie.compile_model(model=model, device_name=device_name, config=config) #FIXME device_name from solution
+        except Exception as e:
+            if self.max_batch_size == 1: raise
+            print(f'[OpenVINO] failed to compile {model_name} with dynamic batch on {device_name}: {e}', flush=True)
+            self.max_batch_size = 1
+            self.model = ie.compile_model(model=ie.read_model(model=model_xml), device_name=device_name, config=config)
         #FIXME do we need to release model while we re-deploy
 
+        # num_requests 0 means the optimal number of infer requests for the hint
+        self.infer_queue = AsyncInferQueue(self.model, num_requests)
+        self.infer_queue.set_callback(self._on_infer_done)
+        print(f'[OpenVINO] {model_name} ready on {device_name} in {time.time()-start:.1f}s (cache {"hit" if cache_hit else "miss"}), hint {performance_hint}, {len(self.infer_queue)} infer requests', flush=True)
+
         self.input = self.model.inputs[0]
         self.outputs = self.model.outputs
 
-        #self.dsize = (256, 256)
-        self.dsize = self.input.shape[2], self.input.shape[3]
-
 
-    def _preprocess(self, image):
+    def _preprocess(self, images):
+        """Images (e.g. the crops of the objects of a frame) resized into one N x C x H x W batch"""
 
-        resized_image = cv2.resize(image, dsize=self.dsize)
-        input_data = np.expand_dims(np.transpose(resized_image, (2, 0, 1)), 0).astype(np.float32)
+        w, h = self.dsize
+        input_data = np.empty((len(images), self.channels, h, w), dtype=np.float32)
+        for i, image in enumerate(images):
+            input_data[i] = preprocess_cache.get(image, self.dsize, 'NCHW', 'BGR', np.float32)
 
         return input_data
 
 
-    def _postprocess(self, output_data, threshold):
+    def _postprocess(self, output_data, threshold, n=1):
+        """One ClassificationResult per image of the batch"""
 
-        # result: [1, 1, 200, 7]
-        # [image_id, label, conf, x_min, y_min, x_max, y_max]
+        classifications = [[] for _ in range(n)]
 
-        #arr = output_data[self.output] 
+        if self.output_infos is None:
+            return [ClassificationResult(classifications=c) for c in classifications]
 
-        #label = arr.argmax()
+        for output in self.outputs:
+            output_name = list(output.names)[0]
+            if output_name not in self.output_infos: continue
 
-        #objects = []
-        #for _, _, confidence, x_min, y_min, x_max, y_max in arr[arr[:,:,:,2]>threshold]:
-        #    bbox = Bbox(l=x_min, t=y_min, w=x_max-x_min, h=y_max-y_min)
-        #    objects.append( Object(bbox=bbox, confidence=confidence, label='face') ) #FIXME find something better instead of just put face here
+            output_info = self.output_infos[output_name]
+            name = output_info['name']
+            arr = output_data[output][:n].reshape(n, -1)
 
-        #return ClassificationResult(
-        #    classification=Classification(name='', label='')
-        #)
+            if output_info['type'] == OUTPUT_TYPE_FLOAT:
+                for c, value in zip(classifications, arr[:, 0]):
+                    c.append(Classification(name=name, label=str(value), confidence=1.0))
 
-        classifications = []
+            elif output_info['type'] == OUTPUT_TYPE_INTEGER_DIVIDED_BY_100:
+                for c, value in zip(classifications, (arr[:, 0] * 100).astype(int).tolist()):
+                    c.append(Classification(name=name, label=str(value), confidence=1.0))
 
-        if self.output_infos is None:
-            return ClassificationResult(classifications=classifications)
-        
-        for output in self.outputs:
-            output_name = list(output.names)[0]
-            arr = output_data[output]
-
-            if output_name in self.output_infos:
-                output_info = self.output_infos[output_name]
-                
-                name = output_info['name']
-                
-                if output_info['type'] == OUTPUT_TYPE_FLOAT:
-                    classifications.append(Classification(
-                        name=name,
-                        label=str(arr.flatten()[0]),
-                        confidence=1.0
-                    ))
-                elif output_info['type'] == OUTPUT_TYPE_INTEGER_DIVIDED_BY_100:
-                    classifications.append(Classification(
-                        name=name,
-                        label=str(int(arr.flatten()[0]*100)),
-                        confidence=1.0
-                    ))
-                elif output_info['type'] == OUTPUT_TYPE_STRING:
-                    label_index = arr.argmax()
-                    if label_index < len(output_info['labels']):
-                        classifications.append(Classification(
-                            name=name,
-                            label=output_info['labels'][label_index],
-                            confidence=arr.flatten()[label_index],
-                        ))
-        return ClassificationResult(classifications=classifications)
+            elif output_info['type'] == OUTPUT_TYPE_STRING:
+                labels = output_info['labels']
+                label_indices = arr.argmax(axis=1)
+                confidences = arr[np.arange(n), label_indices].tolist()
+                for c, label_index, confidence in zip(classifications, label_indices.tolist(), confidences):
+                    if label_index < len(labels):
+                        c.append(Classification(name=name, label=labels[label_index], confidence=confidence))
+
+        return [ClassificationResult(classifications=c) for c in classifications]
 
 
     def predict(self, image, threshold=0.1) -> ClassificationResult:
 
-        input_data = self._preprocess(image)
+        input_data = self._preprocess([image])
         output_data = self.model([input_data])
-        result = self._postprocess(output_data, threshold)
+        result = self._postprocess(output_data, threshold)[0]
 
         return result
+
+    def predict_batch(self, images, threshold=0.1):
+
+        if self.max_batch_size == 1:
+            return [self.predict(image, threshold) for image in images]
+
+        results = []
+        for i in range(0, len(images), self.max_batch_size):
+            batch = images[i:i+self.max_batch_size]
+            input_data = self._preprocess(batch)
+            output_data = self.model([input_data])
+            results += self._postprocess(output_data, threshold, len(batch))
+
+        return results
+
+    def predict_batch_async(self, images, callback, threshold=0.1):
+        """Start the inference without waiting for it
+
+        callback(results, error) is called from an OpenVINO thread once the
+        request completes, error is None on success.
+        """
+
+        if len(images) > self.max_batch_size:
+            raise ValueError(f'batch of {len(images)} exceeds max_batch_size {self.max_batch_size}')
+
+        input_data = self._preprocess(images)
+        # blocks only while every infer request of the pool is busy
+        self.infer_queue.start_async({0: input_data}, (callback, len(images), threshold))
+
+    def predict_async(self, image, callback, threshold=0.1):
+        self.predict_batch_async([image], lambda results, error: callback(results[0] if results else None, error), threshold)
+
+    def _on_infer_done(self, request, userdata):
+        callback, n, threshold = userdata
+        try:
+            output_data = request.results
+            results = self._postprocess(output_data, threshold, n)
+        except Exception as e:
+            callback(None, e)
+            return
+        callback(results, None)
         
 
 if __name__ == '__main__':
@@ -1,11 +1,15 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-from openvino.runtime import Core 
+from openvino.runtime import Core, AsyncInferQueue, PartialShape, Dimension
 import numpy as np
 import cv2
+import time
+import os
 
-from core import ObjectDetectionModel, ObjectDetectionResult, Object, Bbox
+from model_cache import get_cache_dir
+from preprocess_cache import preprocess_cache
+from core import ObjectDetectionModel, ObjectDetectionArrays
 
 
 ie = Core()
@@ -29,13 +33,14 @@ outputs = {
 
 class OpenVINOObjectDetectionModel(ObjectDetectionModel):
 
-    def __init__(self, model_name):
+    def __init__(self, model_name, max_batch_size=1, performance_hint='THROUGHPUT', num_requests=0):
 
         #FIXME download model if needed
 
 
         #model_xml = f'models/{model_name}/FP32/{model_name}.xml'
 
+        start = time.time()
         model_xml = f'models/{model_name}/{model_name}.xml'
         model = ie.read_model(model=model_xml)
 
@@ -46,57 +51,124 @@ class OpenVINOObjectDetectionModel(ObjectDetectionModel):
         device_name = 'CPU'
         if 'GPU' in ie.available_devices: device_name = 'GPU'
 
-        self.model = ie.compile_model(model=model, device_name=device_name) #FIXME device_name from solution
+        #self.dsize = (256, 256)
+        _, c, h, w = model.input().shape
+        self.dsize = w, h
+
+        self.max_batch_size = 1
+        if max_batch_size > 1:
+            # let the batch dimension float so frames from several streams can share one inference
+            try:
+                model.reshape(PartialShape([Dimension(1, max_batch_size), Dimension(c), Dimension(h), Dimension(w)]))
+                self.max_batch_size = max_batch_size
+            except Exception as e:
+                print(f'[OpenVINO] {model_name} does not support batching: {e}', flush=True)
+
+        # THROUGHPUT lets the plugin use several streams so parallel requests keep every core busy
+        config = {'PERFORMANCE_HINT': performance_hint}
+
+        # compiled blobs are reused across restarts, OpenVINO keys them by model & config itself
+        cache_dir = get_cache_dir([model_xml, model_xml[:-len('.xml')] + '.bin'], 'openvino', device_name)
+        cache_hit = len(os.listdir(cache_dir)) > 0
+        config['CACHE_DIR'] = cache_dir
+
+        try:
+            self.model = ie.compile_model(model=model, device_name=device_name, config=config) #FIXME device_name from solution
+        except Exception as e:
+            if self.max_batch_size == 1: raise
+            print(f'[OpenVINO] failed to compile {model_name} with dynamic batch on {device_name}: {e}', flush=True)
+            self.max_batch_size = 1
+            self.model = ie.compile_model(model=ie.read_model(model=model_xml), device_name=device_name, config=config)
         #FIXME do we need to release model while we re-deploy
 
+        # num_requests 0 means the optimal number of infer requests for the hint
+        self.infer_queue = AsyncInferQueue(self.model, num_requests)
+        self.infer_queue.set_callback(self._on_infer_done)
+        print(f'[OpenVINO] {model_name} ready on {device_name} in {time.time()-start:.1f}s (cache {"hit" if cache_hit else "miss"}), hint {performance_hint}, {len(self.infer_queue)} infer requests', flush=True)
+
         self.input = self.model.inputs[0]
         self.output = self.model.outputs[0]
 
-        #self.dsize = (256, 256)
-        #print(self.input)
-        self.dsize = self.input.shape[3], self.input.shape[2]
-
 
     def _preprocess(self, image):
 
-        resized_image = cv2.resize(image, dsize=self.dsize)
-        input_data = np.expand_dims(np.transpose(resized_image, (2, 0, 1)), 0).astype(np.float32)
+        # shared with the other models of the same input size on this frame
+        input_data = preprocess_cache.get(image, self.dsize, 'NCHW', 'BGR', np.float32)[None]
 
         #print(input_data.shape)
 
         return input_data
 
 
-    def _postprocess(self, output_data, threshold):
+    def _postprocess(self, output_data, threshold, image_id=0):
 
-        # result: [1, 1, 200, 7]
+        # result: [1, 1, 200 * batch_size, 7]
         # [image_id, label, conf, x_min, y_min, x_max, y_max]
 
 
-        arr = output_data[self.output] 
+        arr = output_data[self.output].reshape(-1, 7)
+        arr = arr[(arr[:, 0] == image_id) & (arr[:, 2] > threshold)]
 
-        objects = []
-        for _, label_index, confidence, x_min, y_min, x_max, y_max in arr[arr[:,:,:,2]>threshold]:
-            #if confidence > 0.05: print(x_min, y_min, x_max, y_max)
-            bbox = Bbox(l=x_min, t=y_min, w=x_max-x_min, h=y_max-y_min)
-            label_index = int(label_index)
-            #print(label_index, self.labels)
-            if 0 < label_index < len(self.labels):
-                label = self.labels[label_index]
-                objects.append( Object(bbox=bbox, confidence=confidence, label=label) ) #FIXME find something better instead of just put face here
+        #FIXME find something better instead of just put face here
+        label_indexes = arr[:, 1].astype(int)
+        keep = (0 < label_indexes) & (label_indexes < len(self.labels))
+        arr, label_indexes = arr[keep], label_indexes[keep]
 
-        return ObjectDetectionResult(objects=objects)
+        boxes = np.stack([arr[:, 3], arr[:, 4], arr[:, 5] - arr[:, 3], arr[:, 6] - arr[:, 4]], axis=1)
+
+        return ObjectDetectionArrays(boxes, arr[:, 2], [self.labels[i] for i in label_indexes])
         
 
 
 
-    def predict(self, image, threshold=0.03) -> ObjectDetectionResult:
+    def predict(self, image, threshold=0.03) -> ObjectDetectionArrays:
 
         input_data = self._preprocess(image)
         output_data = self.model([input_data])
         result = self._postprocess(output_data, threshold)
 
         return result
+
+    def predict_batch(self, images, threshold=0.03):
+
+        if self.max_batch_size == 1:
+            return [self.predict(image, threshold) for image in images]
+
+        results = []
+        for i in range(0, len(images), self.max_batch_size):
+            batch = images[i:i+self.max_batch_size]
+            input_data = np.concatenate([self._preprocess(image) for image in batch])
+            output_data = self.model([input_data])
+            results += [self._postprocess(output_data, threshold, image_id) for image_id in range(len(batch))]
+
+        return results
+
+    def predict_batch_async(self, images, callback, threshold=0.03):
+        """Start the inference without waiting for it
+
+        callback(results, error) is called from an OpenVINO thread once the
+        request completes, error is None on success.
+        """
+
+        if len(images) > self.max_batch_size:
+            raise ValueError(f'batch of {len(images)} exceeds max_batch_size {self.max_batch_size}')
+
+        input_data = np.concatenate([self._preprocess(image) for image in images])
+        # blocks only while every infer request of the pool is busy
+        self.infer_queue.start_async({0: input_data}, (callback, len(images), threshold))
+
+    def predict_async(self, image, callback, threshold=0.03):
+        self.predict_batch_async([image], lambda results, error: callback(results[0] if results else None, error), threshold)
+
+    def _on_infer_done(self, request, userdata):
+        callback, n, threshold = userdata
+        try:
+            output_data = request.results
+            results = [self._postprocess(output_data, threshold, image_id) for image_id in range(n)]
+        except Exception as e:
+            callback(None, e)
+            return
+        callback(results, None)
         
 
 if __name__ == '__main__':
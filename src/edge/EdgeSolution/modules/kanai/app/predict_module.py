@@ -9,7 +9,10 @@ if find_spec('common'):
 from common.voe_ipc import PredictModuleSetting
 
 import os
+import time
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 
 if find_spec('openvino_object_detection'):
@@ -18,8 +21,25 @@ if find_spec('openvino_classification'):
     from openvino_classification import OpenVINOClassificationModel
 
 from customvision_object_detection import CustomVisionObjectDetectionModel
+from batch_scheduler import BatchScheduler, THROUGHPUT_WINDOW
+from result_cache import ResultCache
+import metrics
 
 
+# models are exported, downloaded and compiled concurrently by this many workers
+LOADING_WORKERS = int(os.environ.get('PREDICT_LOADING_WORKERS', 4))
+
+MODEL_LOADING = 'loading'
+MODEL_READY = 'ready'
+MODEL_FAILED = 'failed'
+
+MAX_BATCH_SIZE = int(os.environ.get('PREDICT_MAX_BATCH_SIZE', 4))
+MAX_BATCH_WAIT_MS = float(os.environ.get('PREDICT_MAX_BATCH_WAIT_MS', 5))
+
+# THROUGHPUT or LATENCY, and the number of in-flight requests per model (0: let OpenVINO decide)
+OPENVINO_PERFORMANCE_HINT = os.environ.get('OPENVINO_PERFORMANCE_HINT', 'THROUGHPUT')
+OPENVINO_NUM_REQUESTS = int(os.environ.get('OPENVINO_NUM_REQUESTS', 0))
+
 
 def get_customvision_object_detection_model(name, download_uri):
     if os.path.isdir(f'models/{name}'):
@@ -34,7 +54,7 @@ def get_customvision_object_detection_model(name, download_uri):
     return model
 
 
-def get_openvino_object_detection_model(name):
+def get_openvino_object_detection_model(name, max_batch_size=1, performance_hint='THROUGHPUT', num_requests=0):
 
     if os.path.isdir(f'models/{name}'):
         print(f'model {name} already exists')
@@ -43,12 +63,12 @@ def get_openvino_object_detection_model(name):
         download_folder = f'models/{name}'
         subprocess.check_output(f'bash downloaders/download_openvino_object_detection.sh {name} {download_folder}'.split())
 
-    model = OpenVINOObjectDetectionModel(name)
+    model = OpenVINOObjectDetectionModel(name, max_batch_size, performance_hint, num_requests)
 
     return model
 
 
-def get_openvino_classification_model(name):
+def get_openvino_classification_model(name, max_batch_size=1, performance_hint='THROUGHPUT', num_requests=0):
 
     if os.path.isdir(f'models/{name}'):
         print(f'model {name} already exists')
@@ -57,7 +77,7 @@ def get_openvino_classification_model(name):
         download_folder = f'models/{name}'
         subprocess.check_output(f'bash downloaders/download_openvino_object_detection.sh {name} {download_folder}'.split())
 
-    model = OpenVINOClassificationModel(name)
+    model = OpenVINOClassificationModel(name, max_batch_size, performance_hint, num_requests)
 
     return model
 
@@ -67,39 +87,183 @@ class PredictModule:
         if not os.path.isdir('models'):
             os.mkdir('models')
         self.models = {}
+        self.schedulers = {}
+        self.model_configs = {}
+
+        # model_name -> MODEL_LOADING / MODEL_READY / MODEL_FAILED
+        self.model_status = {}
+        self._model_ready = {}
+        self._executor = ThreadPoolExecutor(max_workers=LOADING_WORKERS)
+
+        # pipelines sharing a camera & a model run each inference once
+        self.cache = ResultCache()
 
-    def set(self, settings: PredictModuleSetting):
+    def set(self, settings: PredictModuleSetting, prepare=None):
+        """Start downloading and initializing the models in the background
+
+        Returns immediately, use wait_models or model_status to know which models
+        are ready. prepare(model_config) runs first in the worker if given, e.g. to
+        wait for a customvision export and fill download_uri.
+        """
         
         print('--> Start to download models')
 
         for model_config in settings.model_configs:
 
-            if model_config.provider == 'customvision':
+            # several skills may use the same model
+            if model_config.name in self.model_status: continue
+
+            self.model_configs[model_config.name] = model_config
+            self.model_status[model_config.name] = MODEL_LOADING
+            self._model_ready[model_config.name] = threading.Event()
+            self._executor.submit(self._load_model, model_config, prepare)
+
+    def _load_model(self, model_config, prepare):
+
+        try:
+            start = time.time()
+
+            if prepare is not None:
+                prepare(model_config)
+
+            model = self._create_model(model_config)
+
+            if model is not None:
+                print(f'--> Model {model_config.name} ready in {time.time()-start:.1f}s', flush=True)
+            else:
+                print(f'--> Model {model_config.name} is not served by predict module', flush=True)
+            self.model_status[model_config.name] = MODEL_READY
+
+        except Exception as e:
+            print(f'[ERROR] failed to load model {model_config.name}: {e}', flush=True)
+            self.model_status[model_config.name] = MODEL_FAILED
+
+        finally:
+            self._model_ready[model_config.name].set()
+
+    def _create_model(self, model_config):
+
+        max_batch_size = model_config.max_batch_size or MAX_BATCH_SIZE
+        max_batch_wait_ms = model_config.max_batch_wait_ms
+        if max_batch_wait_ms is None: max_batch_wait_ms = MAX_BATCH_WAIT_MS
+        performance_hint = model_config.performance_hint or OPENVINO_PERFORMANCE_HINT
+        num_requests = model_config.num_requests
+        if num_requests is None: num_requests = OPENVINO_NUM_REQUESTS
+
+        model = None
+
+        if model_config.provider == 'customvision':
+            if model_config.type == 'ObjectDetection':
+                model = get_customvision_object_detection_model(model_config.name, model_config.download_uri)
+
+        elif model_config.provider == 'modelzoo': 
+            if model_config.executor == 'openvino':
                 if model_config.type == 'ObjectDetection':
-                    model = get_customvision_object_detection_model(model_config.name, model_config.download_uri)
-                    self.models[model_config.name] = model
+                    model = get_openvino_object_detection_model(model_config.name, max_batch_size, performance_hint, num_requests)
+
+                elif model_config.type == 'Classification':
+                    model = get_openvino_classification_model(model_config.name, max_batch_size, performance_hint, num_requests)
 
-            elif model_config.provider == 'modelzoo': 
-                if model_config.executor == 'openvino':
-                    if model_config.type == 'ObjectDetection':
-                        model = get_openvino_object_detection_model(model_config.name)
-                        #print('adding model_config', model_config.name)
-                        self.models[model_config.name] = model
+        if model is not None:
+            #print('adding model_config', model_config.name)
+            self.models[model_config.name] = model
+            self.schedulers[model_config.name] = BatchScheduler(model_config.name, model, max_batch_size, max_batch_wait_ms)
 
-                    elif model_config.type == 'Classification':
-                        model = get_openvino_classification_model(model_config.name)
-                        #print('adding model_config', model_config.name)
-                        self.models[model_config.name] = model
+        return model
 
-        print('--> Download finished')
+    def wait_models(self, model_names, timeout=None):
+        """Block until every given model finished loading (or failed), unknown names are not waited for"""
+        for model_name in model_names:
+            if model_name in self._model_ready:
+                if not self._model_ready[model_name].wait(timeout):
+                    return False
+        return True
 
-    def predict(self, model_name, img):
-        if model_name not in self.models:
+    def predict(self, model_name, img, trace=None):
+        """trace is the tracing context of the frame, if it is traced"""
+        if model_name not in self.schedulers:
             print("[ERROR] unknown model", model_name, flush=True)
             return None
         
-        r = self.models[model_name].predict(img)
+        r = self._submit(model_name, img, trace).result()
         
         return r
 
-predict_module = PredictModule()
\ No newline at end of file
+    def predict_batch(self, model_name, imgs, trace=None):
+        """Results of the images, submitted together so the scheduler batches them"""
+        if model_name not in self.schedulers:
+            print("[ERROR] unknown model", model_name, flush=True)
+            return None
+
+        futures = [self._submit(model_name, img, trace) for img in imgs]
+
+        return [future.result() for future in futures]
+
+    def predict_async(self, model_name, img, callback, trace=None):
+        """Like predict but returns immediately, callback(result) runs once the inference is done
+
+        result is None if the model is unknown or the inference failed.
+        """
+        if model_name not in self.schedulers:
+            print("[ERROR] unknown model", model_name, flush=True)
+            callback(None)
+            return
+
+        def _done(future):
+            if future.exception() is not None:
+                callback(None)
+            else:
+                callback(future.result())
+
+        self._submit(model_name, img, trace).add_done_callback(_done)
+
+    def predict_batch_async(self, model_name, imgs, callback, trace=None):
+        """Like predict_async for several images, callback(results) once they are all done
+
+        The images are submitted together so the scheduler batches them.
+        results is None if any inference failed.
+        """
+        if model_name not in self.schedulers:
+            print("[ERROR] unknown model", model_name, flush=True)
+            callback(None)
+            return
+
+        futures = [self._submit(model_name, img, trace) for img in imgs]
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def _done(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]: return
+            if any(future.exception() is not None for future in futures):
+                callback(None)
+            else:
+                callback([future.result() for future in futures])
+
+        for future in futures:
+            future.add_done_callback(_done)
+
+    def _submit(self, model_name, img, trace):
+        scheduler = self.schedulers[model_name]
+        return self.cache.submit(model_name, img, lambda: scheduler.submit(img, trace))
+
+    def stats(self):
+        return {model_name: {**scheduler.stats(), **self.cache.stats(model_name)} for model_name, scheduler in self.schedulers.items()}
+
+predict_module = PredictModule()
+
+metrics.registry.add_counter('kanai_predict_cache_hits_total', 'Inference results reused from another request',
+                             lambda: [({'model': model_name}, hits) for model_name, hits in predict_module.cache.hits.items()])
+metrics.registry.add_counter('kanai_predict_cache_misses_total', 'Cacheable inference requests sent to the model',
+                             lambda: [({'model': model_name}, misses) for model_name, misses in predict_module.cache.misses.items()])
+
+for stat, name, description in (
+        ('throughput', 'kanai_predict_throughput', f'Inferences per second over the last {THROUGHPUT_WINDOW:g} seconds'),
+        ('p50_latency_ms', 'kanai_predict_latency_p50_ms', 'Median time from submitting an image to its result'),
+        ('p99_latency_ms', 'kanai_predict_latency_p99_ms', '99th percentile of the time from submitting an image to its result'),
+        ('avg_batch_size', 'kanai_predict_batch_size_avg', 'Average number of images per batch sent to the model'),
+        ('queue_size', 'kanai_predict_queue_size', 'Images waiting for a batch')):
+    metrics.registry.add_gauge(name, description,
+                               lambda stat=stat: [({'model': model_name}, scheduler.stats()[stat])
+                                                  for model_name, scheduler in list(predict_module.schedulers.items())])
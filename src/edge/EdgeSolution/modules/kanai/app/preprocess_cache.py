@@ -0,0 +1,145 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import time
+import weakref
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+import metrics
+
+
+# memory kept for the preprocessed images of the frames in flight, 0 disables the cache
+PREPROCESS_CACHE_MB = float(os.environ.get('PREPROCESS_CACHE_MB', 256))
+EVICTION_REPORT_INTERVAL = 60 # second
+
+
+def preprocess(image, dsize, layout='NCHW', color='BGR', dtype=np.float32):
+    """BGR image resized to dsize (width, height), as a C x H x W (NCHW) or H x W x C (NHWC) array"""
+    resized = cv2.resize(image, dsize=tuple(dsize))
+    if color == 'RGB':
+        resized = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+    if layout == 'NCHW':
+        resized = resized.transpose(2, 0, 1)
+    return np.ascontiguousarray(resized, dtype=dtype)
+
+
+class PreprocessCache:
+    """Preprocessed versions of the frames, shared by every model node
+
+    Entries are keyed by the image (the array owning the buffer and the
+    offset, shape and strides of the view, so crops and tiles have their
+    own) and by (size, layout, colour, dtype). Models with the same input
+    size in a cascade, or pipelines sharing a frame (see
+    sources.SharedCapture), resize and convert it once.
+
+    The entries of a frame are released as soon as its image is freed, i.e.
+    when the last frame referencing it was exported or dropped. Images kept
+    longer (e.g. by a video snippet export) would pin their entries, so once
+    max_bytes are held the least recently used images are evicted. Writable
+    images are never cached since their content may change in place.
+    Cached arrays are read-only.
+    """
+
+    def __init__(self, max_bytes=PREPROCESS_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+
+        # id of the image owner -> {key -> array}, least recently used first
+        self._images = OrderedDict()
+        self.bytes = 0
+        self.peak_bytes = 0
+        self.evictions = 0
+        self._evictions_reported = 0
+        self._last_eviction_report = 0
+        # an image freed while the lock is held releases its entries from the same thread
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, image, dsize, layout='NCHW', color='BGR', dtype=np.float32):
+        if self.max_bytes <= 0 or not isinstance(image, np.ndarray) or image.flags.writeable:
+            return preprocess(image, dsize, layout, color, dtype)
+
+        owner = image
+        while isinstance(owner.base, np.ndarray):
+            owner = owner.base
+        key = (image.__array_interface__['data'][0], image.shape, image.strides, tuple(dsize), layout, color, np.dtype(dtype).str)
+
+        with self._lock:
+            entries = self._images.get(id(owner))
+            if entries is not None and key in entries:
+                self.hits += 1
+                self._images.move_to_end(id(owner))
+                return entries[key]
+            self.misses += 1
+
+        # concurrent misses may compute it twice, the first one stored is kept
+        result = preprocess(image, dsize, layout, color, dtype)
+        result.flags.writeable = False
+
+        with self._lock:
+            if result.nbytes > self.max_bytes:
+                return result
+            entries = self._images.get(id(owner))
+            if entries is None:
+                entries = self._images[id(owner)] = {}
+                weakref.finalize(owner, self._release, id(owner))
+            self._images.move_to_end(id(owner))
+            if key not in entries:
+                self._evict(self.max_bytes - result.nbytes, keep=id(owner))
+                entries[key] = result
+                self.bytes += result.nbytes
+                self.peak_bytes = max(self.peak_bytes, self.bytes)
+            return entries[key]
+
+    def _evict(self, max_bytes, keep):
+        """Release the least recently used entries until max_bytes at most are held"""
+        while self.bytes > max_bytes:
+            owner_id = next(iter(self._images))
+            if owner_id == keep:
+                # only the entries of this image are left
+                evicted = [self._images[owner_id].popitem()[1]]
+            else:
+                evicted = list(self._images.pop(owner_id).values())
+            self.bytes -= sum(array.nbytes for array in evicted)
+            self.evictions += len(evicted)
+
+        timestamp = time.time()
+        if self.evictions > self._evictions_reported and timestamp > self._last_eviction_report + EVICTION_REPORT_INTERVAL:
+            print(f'[PreprocessCache] {self.max_bytes / 2**20:g} MB limit reached, evicted {self.evictions - self._evictions_reported} '
+                  f'preprocessed images, {len(self._images)} frames cached, see PREPROCESS_CACHE_MB', flush=True)
+            self._evictions_reported = self.evictions
+            self._last_eviction_report = timestamp
+
+    def _release(self, owner_id):
+        with self._lock:
+            entries = self._images.pop(owner_id, {})
+            self.bytes -= sum(array.nbytes for array in entries.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'images': len(self._images),
+                'bytes': self.bytes,
+                'peak_bytes': self.peak_bytes,
+                'evictions': self.evictions,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+preprocess_cache = PreprocessCache()
+
+metrics.registry.add_counter('kanai_preprocess_cache_hits_total', 'Preprocessed images reused from another model or pipeline',
+                             lambda: [({}, preprocess_cache.hits)])
+metrics.registry.add_counter('kanai_preprocess_cache_misses_total', 'Cacheable images preprocessed',
+                             lambda: [({}, preprocess_cache.misses)])
+metrics.registry.add_gauge('kanai_preprocess_cache_bytes', 'Memory held by the preprocessed images of the frames in flight',
+                           lambda: [({}, preprocess_cache.bytes)])
+metrics.registry.add_counter('kanai_preprocess_cache_evictions_total', 'Preprocessed images evicted to stay within PREPROCESS_CACHE_MB',
+                             lambda: [({}, preprocess_cache.evictions)])
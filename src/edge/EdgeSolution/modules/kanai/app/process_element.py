@@ -0,0 +1,197 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import time
+import queue
+import threading
+import multiprocessing
+
+from node import Element, Export
+from frame_attr import Frame, Image
+from frame_pool import FramePool
+import tracing
+
+
+# frames in flight between an element and its worker process
+POOL_SLOTS = int(os.environ.get('PROCESS_POOL_SLOTS', 4))
+WORKER_CHECK_INTERVAL = 1 # second
+WORKER_STOP_TIMEOUT = 5 # second
+
+# the models and the element threads don't survive a fork
+_mp = multiprocessing.get_context('spawn')
+
+
+def _worker_main(element_class, configurations, model_config, request_q, response_q):
+    if model_config is not None:
+        from predict_module import predict_module
+        from common.voe_ipc import PredictModuleSetting
+        predict_module.set(PredictModuleSetting(model_configs=[model_config]))
+        predict_module.wait_models([model_config.name])
+
+    element = element_class(**configurations)
+    pools = {}
+
+    while True:
+        request = request_q.get()
+        if request is None:
+            break
+
+        seq, pool_name, slot_size, slot, shape, dtype, img, properties, meta = request
+        try:
+            if img is None:
+                if pool_name not in pools:
+                    pools[pool_name] = FramePool(slot_size, 0, name=pool_name)
+                img = pools[pool_name].view(slot, shape, dtype)
+            img.flags.writeable = False
+
+            frame = Frame(image=Image(image_pointer=img, properties=properties), **meta)
+            element.timed_process(frame)
+            if isinstance(element, Export):
+                element._update_latency(frame)
+
+            # every field but the image, e.g. static set by the motion gate & keyframe transforms
+            response_q.put((seq, frame.meta(), None))
+
+        except Exception as e:
+            response_q.put((seq, None, str(e)))
+
+    for pool in pools.values():
+        pool.close()
+
+
+class ProcessElement(Element):
+    """Runs a transform, model or export in a worker process
+
+    The image is copied once into a shared memory pool slot, only the slot
+    index and the frame metadata cross the process boundary. The worker runs
+    element.process and sends every field but the image back (insights meta,
+    static, ...), the children keep running in this process so the graph is
+    unchanged. Elements must not keep a reference to the image after process
+    returns, the slot is reused.
+    """
+
+    def __init__(self, element_class, configurations, model_config=None, pool_slots=POOL_SLOTS):
+        super().__init__()
+        self._q = queue.Queue(maxsize=2)
+        self.name = element_class.__name__
+
+        self.element_class = element_class
+        self.configurations = configurations
+        self.model_config = model_config
+        self.pool_slots = pool_slots
+
+        # created on the first frame, its size is the slot size
+        self._pool = None
+        self._in_flight = threading.Semaphore(pool_slots)
+
+        # seq -> (frame, slot, start)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._seq = 0
+
+        self._request_q = None
+        self._response_q = None
+        self._worker = None
+        self._result_thread = threading.Thread(target=self._result_loop)
+        self._result_thread.setDaemon(True)
+
+    def start(self):
+        self._start_worker()
+        self._result_thread.start()
+        super().start()
+
+    def stop(self):
+        super().stop()
+        self._request_q.put(None)
+        self._worker.join(WORKER_STOP_TIMEOUT)
+        # the pool outlives worker restarts, it's only released here
+        if self._pool is not None:
+            self._pool.close()
+
+    def threads(self):
+        return super().threads() + [self._result_thread]
+
+    def _start_worker(self):
+        # a killed worker may die holding the queue locks, never reuse them
+        self._request_q = _mp.Queue()
+        self._response_q = _mp.Queue()
+        self._worker = _mp.Process(
+            target=_worker_main,
+            args=(self.element_class, self.configurations, self.model_config, self._request_q, self._response_q),
+            daemon=True)
+        self._worker.start()
+        print(f'[ProcessElement] {self.name} running in process {self._worker.pid}', flush=True)
+
+    def loop(self):
+        while True:
+            frame = self.receive()
+            self._in_flight.acquire()
+
+            img = frame.image.image_pointer
+            if self._pool is None:
+                self._pool = FramePool(img.nbytes, self.pool_slots)
+
+            if self._pool.fits(img):
+                slot = self._pool.acquire()
+                self._pool.write(slot, img)
+                image = None
+            else:
+                # bigger than the first frame (e.g. the camera changed resolution), send it pickled
+                slot = None
+                image = img
+
+            self._seq += 1
+            request = (self._seq, self._pool.name, self._pool.slot_size, slot, img.shape, img.dtype.str,
+                       image, frame.image.properties, frame.meta())
+            with self._pending_lock:
+                self._pending[self._seq] = (frame, slot, time.perf_counter())
+                self._request_q.put(request)
+
+    def _result_loop(self):
+        while True:
+            try:
+                seq, meta, error = self._response_q.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                if not self._worker.is_alive():
+                    self._restart_worker()
+                continue
+
+            with self._pending_lock:
+                entry = self._pending.pop(seq, None)
+            if entry is None:
+                # answered by a restarted worker, the frame was already dropped
+                continue
+
+            frame, slot, start = entry
+            if slot is not None:
+                self._pool.release(slot)
+            self._in_flight.release()
+            duration = time.perf_counter() - start
+            self.metrics.process_seconds.observe(duration)
+            if frame.trace:
+                self.trace(frame, 'process', duration, pid=self._worker.pid)
+
+            if error is not None:
+                print(f'[ProcessElement] {self.name} failed to process frame {frame.frame_id}: {error}', flush=True)
+            else:
+                for name, value in meta.items():
+                    setattr(frame, name, value)
+
+            self.send_children(frame)
+
+    def _restart_worker(self):
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            print(f'[ProcessElement] {self.name} worker exited with code {self._worker.exitcode}, '
+                  f'restarting, {len(pending)} frames in flight dropped', flush=True)
+            self._start_worker()
+
+        for frame, slot, _ in pending:
+            if slot is not None:
+                self._pool.release(slot)
+            self._in_flight.release()
+            self.metrics.frames_dropped += 1
+            if frame.trace:
+                tracing.tracer.instant(tracing.context(frame), self.name, 'dropped', time.time(), reason='worker exited')
@@ -0,0 +1,92 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import time
+import weakref
+import threading
+import collections
+
+import numpy as np
+
+
+# number of inference results kept, 0 disables the cache
+PREDICT_CACHE_SIZE = int(os.environ.get('PREDICT_CACHE_SIZE', 64))
+PREDICT_CACHE_TTL_MS = float(os.environ.get('PREDICT_CACHE_TTL_MS', 1000))
+
+
+class ResultCache:
+    """Short-lived cache of inference results keyed by model and source image
+
+    Pipelines on the same camera get the very same read-only image (see
+    sources.SharedCapture), so a second pipeline running the same model on
+    the same frame, or on the same crop of it, gets the future of the first
+    inference, even while it is still running. The preprocessing is fixed
+    per model, the model name covers it.
+
+    The image is identified by the array owning the buffer, the offset, shape
+    and strides of the view. Only a weak reference is kept, an entry whose
+    image was freed is stale. Writable images are never cached since their
+    content may change in place (e.g. a reused frame pool slot). Results are
+    shared, callers must not modify them.
+    """
+
+    def __init__(self, size=PREDICT_CACHE_SIZE, ttl_ms=PREDICT_CACHE_TTL_MS):
+        self.size = size
+        self.ttl = ttl_ms / 1000
+
+        # key -> (image owner weakref, future, expiry)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    def _key(self, model_name, image):
+        owner = image
+        while isinstance(owner.base, np.ndarray):
+            owner = owner.base
+        return (model_name, id(owner), image.__array_interface__['data'][0], image.shape, image.strides), owner
+
+    def submit(self, model_name, image, submit):
+        """Future of the result of model_name on image, submit() is only called on a miss"""
+        if self.size <= 0 or not isinstance(image, np.ndarray) or image.flags.writeable:
+            return submit()
+
+        key, owner = self._key(model_name, image)
+        timestamp = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                ref, future, expiry = entry
+                if ref() is owner and timestamp < expiry:
+                    self._entries.move_to_end(key)
+                    self.hits[model_name] += 1
+                    return future
+                del self._entries[key]
+
+            self.misses[model_name] += 1
+            future = submit()
+            self._entries[key] = (weakref.ref(owner), future, timestamp + self.ttl)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+        future.add_done_callback(lambda future, key=key: self._discard_failed(key, future))
+        return future
+
+    def _discard_failed(self, key, future):
+        if future.exception() is None:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is future:
+                del self._entries[key]
+
+    def stats(self, model_name):
+        hits, misses = self.hits[model_name], self.misses[model_name]
+        return {
+            'cache_hits': hits,
+            'cache_misses': misses,
+            'cache_hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        }
@@ -0,0 +1,155 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+#
+# Regions of interest, in the format the portal stores on the cameras
+#   area:         {"useAOI": true, "AOIs": [{"type": "BBox", "label": {"x1": .., "y1": .., "x2": .., "y2": ..}}]}
+#   danger_zones: {"useDangerZone": true, "dangerZones": [{"type": "Polygon", "label": [{"x": .., "y": ..}, ..]}]}
+# a list of shapes or of [l, t, w, h] boxes works too. Coordinates are pixels,
+# or ratios of the frame size when none is above 1.
+#
+
+import json
+
+import numpy as np
+
+
+def parse_regions(value):
+    """Polygons of a region configuration, as a list of N x 2 arrays"""
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        value = json.loads(value)
+
+    if isinstance(value, dict):
+        use = next((v for k, v in value.items() if k.startswith('use')), True)
+        if not use:
+            return []
+        value = next((v for k, v in value.items() if isinstance(v, list)), [])
+
+    polygons = []
+    for shape in value:
+        if isinstance(shape, dict):
+            label = shape['label']
+            if isinstance(label, dict):
+                x1, y1, x2, y2 = label['x1'], label['y1'], label['x2'], label['y2']
+                polygon = [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
+            else:
+                polygon = [(p['x'], p['y']) for p in label]
+        else:
+            l, t, w, h = shape
+            polygon = [(l, t), (l + w, t), (l + w, t + h), (l, t + h)]
+        polygons.append(np.asarray(polygon, dtype=np.float64))
+    return polygons
+
+
+def normalize(polygons, width, height):
+    """Polygons as ratios of the frame size"""
+    if not polygons or max(polygon.max() for polygon in polygons) <= 1:
+        return polygons
+    scale = np.array([width, height], dtype=np.float64)
+    return [polygon / scale for polygon in polygons]
+
+
+def points_in_polygons(points, polygons):
+    """Whether each of the N x 2 points lies in any polygon (even-odd rule)"""
+    inside = np.zeros(len(points), dtype=bool)
+    x, y = points[:, 0:1], points[:, 1:2]
+    for polygon in polygons:
+        x1, y1 = polygon[:, 0], polygon[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        crosses = ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / np.where(y2 == y1, 1, y2 - y1) + x1)
+        inside |= (np.count_nonzero(crosses, axis=1) % 2).astype(bool)
+    return inside
+
+
+class RoiMosaic:
+    """Crops the bounding boxes of the regions and packs them into one image
+
+    Overlapping regions are merged first so no pixel is inferred twice.
+    Tiles are placed on shelves about as wide as the mosaic is tall, so the
+    mosaic keeps a squarish aspect ratio once the model resizes it. Boxes
+    detected on the mosaic are mapped back to the frame with map_boxes.
+    """
+
+    def __init__(self, polygons, width, height):
+        self.width = width
+        self.height = height
+
+        rects = []
+        for polygon in normalize(polygons, width, height):
+            x1, y1 = np.floor(polygon.min(axis=0) * (width, height)).astype(int)
+            x2, y2 = np.ceil(polygon.max(axis=0) * (width, height)).astype(int)
+            x1, y1, x2, y2 = max(0, x1), max(0, y1), min(width, x2), min(height, y2)
+            if x2 > x1 and y2 > y1:
+                rects.append((x1, y1, x2, y2))
+
+        # overlapping regions are cropped once
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    a, b = rects[i], rects[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        rects[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                        del rects[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        rects = [(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in rects]
+
+        # each tile: x, y in the mosaic, w, h, x, y in the frame
+        tiles = []
+        shelf_width = max([int(np.sqrt(sum(w * h for _, _, w, h in rects)))] + [w for _, _, w, _ in rects])
+        x = y = shelf_height = 0
+        for fx, fy, w, h in sorted(rects, key=lambda rect: -rect[3]):
+            if x + w > shelf_width:
+                x, y = 0, y + shelf_height
+                shelf_height = 0
+            tiles.append((x, y, w, h, fx, fy))
+            x += w
+            shelf_height = max(shelf_height, h)
+
+        self.tiles = np.array(tiles, dtype=np.int64).reshape(-1, 6)
+        self.mosaic_width = int((self.tiles[:, 0] + self.tiles[:, 2]).max()) if tiles else 0
+        self.mosaic_height = int((self.tiles[:, 1] + self.tiles[:, 3]).max()) if tiles else 0
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def pixel_ratio(self):
+        """Pixels of the mosaic over the pixels of the frame"""
+        return self.mosaic_width * self.mosaic_height / (self.width * self.height)
+
+    def crop(self, img):
+        mosaic = np.zeros((self.mosaic_height, self.mosaic_width) + img.shape[2:], dtype=img.dtype)
+        for x, y, w, h, fx, fy in self.tiles:
+            mosaic[y:y+h, x:x+w] = img[fy:fy+h, fx:fx+w]
+        return mosaic
+
+    def map_boxes(self, boxes):
+        """Boxes (l, t, w, h ratios of the mosaic) to the frame, and the indices kept
+
+        A box belongs to the tile its center is in and is clipped to it, boxes
+        centered on the padding are dropped.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4) * (self.mosaic_width, self.mosaic_height, self.mosaic_width, self.mosaic_height)
+        x1, y1 = boxes[:, 0], boxes[:, 1]
+        x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+
+        tx, ty, tw, th, fx, fy = (self.tiles[:, i] for i in range(6))
+        member = (tx <= cx[:, None]) & (cx[:, None] < tx + tw) & (ty <= cy[:, None]) & (cy[:, None] < ty + th)
+        keep = np.flatnonzero(member.any(axis=1))
+        tile = member[keep].argmax(axis=1)
+
+        dx, dy = fx[tile] - tx[tile], fy[tile] - ty[tile]
+        x1 = np.maximum(x1[keep], tx[tile]) + dx
+        y1 = np.maximum(y1[keep], ty[tile]) + dy
+        x2 = np.minimum(x2[keep], tx[tile] + tw[tile]) + dx
+        y2 = np.minimum(y2[keep], ty[tile] + th[tile]) + dy
+
+        mapped = np.stack([x1 / self.width, y1 / self.height, (x2 - x1) / self.width, (y2 - y1) / self.height], axis=1)
+        return mapped, keep
@@ -3,35 +3,199 @@
 
 import time
 import os
+import subprocess
 import cv2
+import threading
 import datetime
 import pytz
 
 
 from node import Source
-from frame import Frame, Image, ImageProperties, ColorFormat
+from frame import ColorFormat
+from frame_attr import Frame, Image, ImageProperties
+from capture_backends import create_capture
+from fps_controller import FpsController, watched_elements, ADAPTIVE_FPS
+import tracing
 
 from common.symphony_agent_client import SymphonyAgentClient
 
 client = SymphonyAgentClient()
 instance_name = os.environ.get('INSTANCE')
 
+# decoded frames are kept in a small ring, the capture thread never writes into
+# the newest frame nor the one being copied out
+RING_SIZE = 3
+STATS_INTERVAL = 5 # second
+
+
+class SharedCapture:
+    """Decodes one camera for every RtspSource reading it
+
+    The capture thread keeps decoding the newest frame into the ring. The
+    newest frame is copied out once, marked read-only and handed to every
+    source asking for it, each source throttles to its own fps.
+    """
+
+    def __init__(self, ip, backend, backend_options):
+        self.ip = ip
+        self.backend = backend
+        self.backend_options = backend_options
+        # None while the camera can't be opened, the capture thread retries
+        self.cap = self._create_cap()
+        self.failed_counter = 0
+        self.sources = 0
+
+        self._ring = [None] * RING_SIZE
+        self._captured_at = [0] * RING_SIZE
+        self._decode_started_at = [0] * RING_SIZE
+        self._latest = None
+        self._seq = 0
+        self._reading = None
+        self._ring_cv = threading.Condition()
+
+        # (seq, image, captured_at, decode_started_at) of the last frame copied out of the ring
+        self._copy = (0, None, 0, 0)
+        self._copy_lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._capture_loop)
+        self._thread.setDaemon(True)
+        self._started = False
+        self._start_lock = threading.Lock()
+
+        self.decoded_frames = 0
+        self.read_frames = 0
+        self.dropped_frames = 0
+
+    def start(self):
+        with self._start_lock:
+            if not self._started:
+                self._started = True
+                self._thread.start()
+
+    def _create_cap(self):
+        try:
+            return create_capture(self.backend, self.ip, **self.backend_options)
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            # e.g. ffprobe failing on a camera which is down
+            print(f'[ERROR] cannot open {self.ip}: {e}', flush=True)
+            return None
+
+    def _restart_cap(self):
+        if self.cap is not None:
+            self.cap.release()
+        self.cap = self._create_cap()
+
+    def _capture_loop(self):
+        while True:
+            with self._ring_cv:
+                index = next(i for i in range(RING_SIZE) if i != self._latest and i != self._reading)
+
+            # decode into the preallocated buffer (opencv reallocates only if the resolution changes)
+            decode_started_at = time.time()
+            if self.cap is None:
+                b, image_pointer = False, None
+            else:
+                b, image_pointer = self.cap.read(self._ring[index])
+            if b is False or image_pointer is None:
+                print(f'failed to get image from {self.ip}')
+                self.failed_counter += 1
+                if self.failed_counter > 10:
+                    self._restart_cap()
+                    self.failed_counter = 0
+                time.sleep(1)
+                continue
+            self.failed_counter = 0
+
+            with self._ring_cv:
+                self._ring[index] = image_pointer
+                self._captured_at[index] = time.time()
+                self._decode_started_at[index] = decode_started_at
+                if self._copy[0] != self._seq:
+                    # nobody read the previous one
+                    self.dropped_frames += 1
+                self._latest = index
+                self._seq += 1
+                self.decoded_frames += 1
+                self._ring_cv.notify_all()
+
+    def read(self, last_seq):
+        """Newest frame decoded after last_seq, as (seq, image, captured_at, decode_started_at)"""
+        with self._ring_cv:
+            while self._seq == last_seq:
+                self._ring_cv.wait()
+
+        with self._copy_lock:
+            with self._ring_cv:
+                # another source may have copied it already
+                if self._copy[0] == self._seq:
+                    return self._copy
+                index = self._latest
+                self._reading = index
+                seq = self._seq
+                captured_at = self._captured_at[index]
+                decode_started_at = self._decode_started_at[index]
+
+            # the pipelines keep the frame, so it must not live in the ring
+            image = self._ring[index].copy()
+            image.flags.writeable = False
+
+            with self._ring_cv:
+                self._reading = None
+            self.read_frames += 1
+            self._copy = (seq, image, captured_at, decode_started_at)
+            return self._copy
+
+    def stats(self):
+        return f'decoded {self.decoded_frames}, read {self.read_frames}, dropped {self.dropped_frames} frames for {self.sources} sources, {self.cap.stats() if self.cap else "not opened"}'
+
+
+# every RtspSource on the same camera & decoding options shares one capture
+_captures = {}
+_captures_lock = threading.Lock()
+
+
+def get_capture(ip, backend, backend_options):
+    key = (ip, backend, tuple(sorted(backend_options.items())))
+    with _captures_lock:
+        capture = _captures.get(key)
+        if capture is None:
+            capture = _captures[key] = SharedCapture(ip, backend, backend_options)
+        else:
+            print(f'[RTSP Source] sharing the capture of {ip}', flush=True)
+        capture.sources += 1
+    return capture
+
+
 class RtspSource(Source):
-    def __init__(self, ip, skill_name, device_name='', fps=30):
+    def __init__(self, ip, skill_name, device_name='', fps=30, backend='opencv', width=None, height=None, hwaccel=None, decoder=None,
+                 codec=None, depay=None, min_fps=1, adaptive_fps=None):
         super().__init__()
         #self.cap = cv2.VideoCapture(0)
 
         client.post_instance_fps(instance_name, skill_name, 0)
 
         self.ip = ip
-        self.failed_counter = 0
-        self.cap = cv2.VideoCapture(ip)
+
+        # see capture_backends for the options
+        self.backend = backend
+        self.backend_options = {'width': width, 'height': height}
+        if hwaccel: self.backend_options['hwaccel'] = hwaccel
+        if decoder: self.backend_options['decoder'] = decoder
+        if codec: self.backend_options['codec'] = codec
+        if depay: self.backend_options['depay'] = depay
+        self.capture = get_capture(ip, backend, self.backend_options)
         try:
             self.fps_upperbound = max(0.001, float(fps))
         except:
             self.fps_upperbound = 30.0
+
+        # the capture rate goes down to min_fps when the pipeline falls behind, see FpsController
+        self.min_fps = max(0.001, float(min_fps))
+        self.adaptive_fps = ADAPTIVE_FPS if adaptive_fps is None else str(adaptive_fps).lower() == 'true'
+        self.fps_controller = None
         print(f'[RTSP Source] IP: {self.ip}', flush=True)
         print(f'[RTSP Source] FPS: {fps}', flush=True)
+        print(f'[RTSP Source] Backend: {backend} {self.backend_options}', flush=True)
 
         self.last_timestamp = time.time()
         self.frame_interval_upperbound = 1 / self.fps_upperbound
@@ -46,38 +210,54 @@ class RtspSource(Source):
 
         self.skill_name = skill_name
         self.device_name = device_name
-        
 
+        self._last_seq = 0
+        self._emitted_decode_started_at = 0
+        self.emitted_frames = 0
 
-    def _restart_cap(self):
-        self.cap = cv2.VideoCapture(self.ip)
+    def start(self):
+        if self.adaptive_fps:
+            # the children are linked by now
+            self.fps_controller = FpsController(watched_elements(self), self.fps_upperbound, self.min_fps)
+        self.capture.start()
+        super().start()
+
+    def trace_capture(self, frame):
+        # read and decode, then the wait for the fps throttle and the copy out of the ring
+        tracing.tracer.span(tracing.context(frame), self.name, 'read', self._emitted_decode_started_at, frame.timestamp)
+        super().trace_capture(frame)
 
     def next_frame(self):
-        while True:
-            b, image_pointer = self.cap.read()
-            if b is False or image_pointer is None:
-                print(f'failed to get image from {self.ip}')
-                self.failed_counter += 1
-                if self.failed_counter > 10:
-                    self._restart_cap()
-                    self.failed_counter = 0
-                time.sleep(1)
-            else:
-                self.failed_counter = 0
-                timestamp = time.time()
-                if timestamp > self.last_timestamp + self.frame_interval_upperbound:
 
-                    # we count moving avg for frame interval, then inverse it as fps
-                    self.frame_interval = self.frame_interval * 7/8 + (timestamp-self.last_timestamp) * 1/8
-                    self.fps = 1 / self.frame_interval
+        # throttle to the target fps, then always take the newest decoded frame
+        frame_interval = self.frame_interval_upperbound
+        if self.fps_controller is not None:
+            frame_interval = 1 / self.fps_controller.update()
+        delay = self.last_timestamp + frame_interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        if self.fps_controller is not None:
+            self.fps_controller.sample()
+
+        self._last_seq, image_pointer, captured_timestamp, self._emitted_decode_started_at = self.capture.read(self._last_seq)
+        self.emitted_frames += 1
+
+        timestamp = time.time()
+
+        # we count moving avg for frame interval, then inverse it as fps
+        self.frame_interval = self.frame_interval * 7/8 + (timestamp-self.last_timestamp) * 1/8
+        self.fps = 1 / self.frame_interval
 
-                    # update fps to symphony
-                    if timestamp > self.last_update_fps_timestamp + 5:
-                        client.post_instance_fps(instance_name, self.skill_name, int(self.fps*10)/10)
-                        self.last_update_fps_timestamp = timestamp
+        # update the effective fps to symphony
+        if timestamp > self.last_update_fps_timestamp + STATS_INTERVAL:
+            client.post_instance_fps(instance_name, self.skill_name, int(self.fps*10)/10)
+            print(f'[RTSP Source] {self.ip} {self.skill_name} {self.fps:.1f} fps, emitted {self.emitted_frames} frames, capture {self.capture.stats()}', flush=True)
+            if self.fps_controller is not None:
+                controller = self.fps_controller
+                print(f'[RTSP Source] {self.skill_name} target {controller.fps:.1f} fps ({controller.min_fps:g}-{controller.max_fps:g}), utilization {controller.utilization:.2f}, queue depth {controller.queue_depth:.2f}', flush=True)
+            self.last_update_fps_timestamp = timestamp
 
-                    self.last_timestamp = timestamp
-                    break
+        self.last_timestamp = timestamp
         #FIXME add some error handling
 
         #print(image_pointer.shape)
@@ -89,11 +269,12 @@ class RtspSource(Source):
         image = Image(image_pointer=image_pointer, properties=properties)
 
 
-        dt = datetime.datetime.fromtimestamp(timestamp, tz=pytz.utc).isoformat()
+        # timestamp of the capture, exports use it for the end-to-end latency
+        dt = datetime.datetime.fromtimestamp(captured_timestamp, tz=pytz.utc).isoformat()
 
         frame = Frame(
             image=image, 
-            timestamp=timestamp, 
+            timestamp=captured_timestamp, 
             datetime=dt,
             frame_id=str(self.frame_id),
             skill_id=self.skill_name,
@@ -1,13 +1,27 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import os
 import networkx as nx
 from common.voe_cascade_config import CascadeConfig
 
 from sources import RtspSource
-from transforms import FilterTransform, GrpcTransform
+from transforms import FilterTransform, GrpcTransform, MotionGateTransform, RoiTransform, KeyframeTransform, TrackingTransform
 from exports import VideoSnippetExport, IothubExport, MqttExport, IotedgeExport, Cv2ImshowExport, HttpExport
 from models import FakeModel, ObjectDetectionModel, ClassificationModel, GPT4Model
+from process_element import ProcessElement
+from predict_module import predict_module
+import metrics
+
+
+# 'thread' or 'process', default for the transform/model/export nodes which don't set it.
+# A model node in a process loads its own copy of the model next to the one of
+# predict_module (used by the nodes running in a thread), so the model memory
+# doubles and its inferences are neither batched nor cached with the other streams.
+EXECUTION = os.environ.get('STREAM_EXECUTION', 'thread')
+
+# run single-parent/single-child chains of transforms and models in one thread
+FUSION = os.environ.get('STREAM_FUSION', 'true') == 'true'
 
 
 supported_sources = {
@@ -16,7 +30,11 @@ supported_sources = {
 
 supported_transforms = {
     'filter_transform': FilterTransform,
-    'grpc_transform': GrpcTransform
+    'grpc_transform': GrpcTransform,
+    'motion_gate_transform': MotionGateTransform,
+    'roi_transform': RoiTransform,
+    'keyframe_transform': KeyframeTransform,
+    'tracking_transform': TrackingTransform
 }
 
 supported_exports = {
@@ -37,9 +55,12 @@ supported_models = {
 
 class Stream:
     
-    def __init__(self, g: nx.DiGraph=None):
+    def __init__(self, g: nx.DiGraph=None, fusion=FUSION, name=None):
         self._elements = []
         self._g = g
+        self._fusion = fusion
+        self.fused = 0
+        self.name = name
 
 
         for i, node_id in enumerate(nx.topological_sort(self._g)):
@@ -55,6 +76,7 @@ class Stream:
                     if node_name not in supported_sources:
                         raise Exception(f'Unknown Name {node_name} for Type {node_type}')
                     element = supported_sources[node_name](**node_configurations)
+                    element.name = node_id
 
                     node['element'] = element
                     self._elements.append(element)
@@ -63,12 +85,10 @@ class Stream:
             elif node_type == 'transform':
                     if node_name not in supported_transforms:
                         raise Exception(f'Unknown Name {node_name} for Type {node_type}')
-                    element = supported_transforms[node_name](**node_configurations)
+                    element = self._create_element(node, supported_transforms[node_name])
+                    element.name = node_id
 
-                    #for parent_node_id in nx.predecessors(self._g, node_id):
-                    for parent_node_id in self._g.predecessors(node_id):
-                        parent_node = self._g.nodes[parent_node_id]
-                        parent_node['element'].add_child(element)
+                    self._link_parents(node_id, element)
 
                     node['element'] = element
                     self._elements.append(element)
@@ -79,12 +99,10 @@ class Stream:
                 #   case 'export':
                     if node_name not in supported_exports:
                         raise Exception(f'Unknown Name {node_name} for Type {node_type}')
-                    element = supported_exports[node_name](**node_configurations)
+                    element = self._create_element(node, supported_exports[node_name])
+                    element.name = node_id
 
-                    #for parent_node_id in nx.predecessors(self._g, node_id):
-                    for parent_node_id in self._g.predecessors(node_id):
-                        parent_node = self._g.nodes[parent_node_id]
-                        parent_node['element'].add_child(element)
+                    self._link_parents(node_id, element)
 
                     node['element'] = element
                     self._elements.append(element)
@@ -93,12 +111,10 @@ class Stream:
                     #case 'model':
                     if node_name not in supported_models:
                         raise Exception(f'Unknown Name {node_name} for Type {node_type}')
-                    element = supported_models[node_name](**node_configurations)
+                    element = self._create_element(node, supported_models[node_name])
+                    element.name = node_id
 
-                    #for parent_node_id in nx.predecessors(self._g, node_id):
-                    for parent_node_id in self._g.predecessors(node_id):
-                        parent_node = self._g.nodes[parent_node_id]
-                        parent_node['element'].add_child(element)
+                    self._link_parents(node_id, element)
 
                     node['element'] = element
                     self._elements.append(element)
@@ -107,12 +123,65 @@ class Stream:
                     #case _:
                     raise Exception(f'Unknown Type {node_type}')
 
-
+        skill = next((node['configurations'].get('skill_name', '') for _, node in self._g.nodes(data=True) if node['type'] == 'source'), '')
+        for node_id in self._g.nodes:
+            metrics.registry.register(self._g.nodes[node_id]['element'], stream=self.name or skill, skill=skill, node=node_id)
+
+        threads = sum(len(element.threads()) for element in self._elements)
+        print(f'[Stream] {self.name or skill} {len(self._elements)} elements, {self.fused} fused, {threads} threads ({threads + self.fused} without fusion)', flush=True)
+
+
+    def _create_element(self, node, element_class):
+        if (node.get('execution') or EXECUTION) != 'process':
+            return element_class(**node['configurations'])
+
+        model_config = None
+        if node['type'] == 'model':
+            # the worker loads its own copy of the model
+            model_config = predict_module.model_configs.get(node['configurations'].get('model'))
+        return ProcessElement(element_class, node['configurations'], model_config)
+
+    def _can_fuse(self, node_id, element):
+        if not (self._fusion and element.is_fusable()):
+            return False
+
+        parent_node_ids = list(self._g.predecessors(node_id))
+        if len(parent_node_ids) != 1:
+            return False
+        parent_node_id = parent_node_ids[0]
+
+        # fan-out points keep their queues, so do sources and exports
+        if self._g.out_degree(parent_node_id) != 1:
+            return False
+        if self._g.nodes[parent_node_id]['type'] not in ('transform', 'model'):
+            return False
+
+        # the edge has no queue anymore, it can't drop or sample frames
+        edge = self._g.edges[parent_node_id, node_id]
+        return edge.get('queue_policy', 'block') == 'block' and edge.get('sample_interval', 1) == 1
+
+    def _link_parents(self, node_id, element):
+        if self._can_fuse(node_id, element):
+            parent_node_id = next(iter(self._g.predecessors(node_id)))
+            self._g.nodes[parent_node_id]['element'].fuse(element)
+            self.fused += 1
+            return
+
+        for parent_node_id in self._g.predecessors(node_id):
+            parent_node = self._g.nodes[parent_node_id]
+            edge = self._g.edges[parent_node_id, node_id]
+            parent_node['element'].add_child(
+                element,
+                queue_policy=edge.get('queue_policy', 'block'),
+                sample_interval=edge.get('sample_interval', 1))
+
+    def stats(self):
+        return [link_stats for element in self._elements for link_stats in element.stats()]
 
     @classmethod
-    def from_cascade_config(cls, cascade_config):
+    def from_cascade_config(cls, cascade_config, fusion=FUSION):
         g = nx.node_link_graph(data=cascade_config.dict(), directed=True, multigraph=False, attrs={'link': 'edges'})
-        return Stream(g=g)
+        return Stream(g=g, fusion=fusion, name=cascade_config.name)
 
     def start(self):
         for node_id in reversed(list(nx.topological_sort(self._g))):
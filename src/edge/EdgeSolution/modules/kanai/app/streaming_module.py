@@ -7,7 +7,10 @@ if not importlib.util.find_spec('common'):
     sys.path.append('../../common')
 
 from stream import Stream
+from predict_module import predict_module, MODEL_FAILED
 import time
+import threading
+import traceback
 
 from common.voe_ipc import StreamingModuleSetting
 
@@ -15,15 +18,48 @@ class StreamingModule:
 
     def __init__(self):
         self.streams = []
+        # pipeline name -> why it didn't start
+        self.failed = {}
+        self._starting_threads = []
 
     def start(self, setting: StreamingModuleSetting):
         
+        # don't let a slow model download hold back pipelines whose models are ready
         for cascade_config in setting.cascade_configs:
+            t = threading.Thread(target=self._start_when_ready, args=(cascade_config,))
+            t.setDaemon(True)
+            t.start()
+            self._starting_threads.append(t)
+
+    def _start_when_ready(self, cascade_config):
+        model_names = [node.configurations['model'] for node in cascade_config.nodes
+                       if node.type == 'model' and 'model' in node.configurations]
+        predict_module.wait_models(model_names)
+
+        failed_models = [model_name for model_name in model_names if predict_module.model_status.get(model_name) == MODEL_FAILED]
+        if failed_models:
+            print(f'[ERROR] [StreamingModule] models {failed_models} failed to load, not starting stream {cascade_config.name}', flush=True)
+            self.failed[cascade_config.name] = f'models {failed_models} failed to load'
+            return
+        print(f'[StreamingModule] models {model_names} ready, starting stream', flush=True)
+
+        try:
             s = Stream.from_cascade_config(cascade_config)
             s.start()
-            self.streams.append(s)
+        except Exception as e:
+            print(f'[ERROR] [StreamingModule] failed to start stream {cascade_config.name}: {e}', flush=True)
+            traceback.print_exc()
+            self.failed[cascade_config.name] = str(e)
+            return
+        self.streams.append(s)
+
+    def wait_started(self):
+        """Block until every stream started or failed to"""
+        for t in self._starting_threads:
+            t.join()
 
     def join(self):
+        self.wait_started()
         for s in self.streams:
             s.join()
         
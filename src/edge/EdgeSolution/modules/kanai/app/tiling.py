@@ -0,0 +1,147 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+#
+# Tiled inference: a high resolution image is split into overlapping tiles
+# inferred at the model input size, so small objects keep enough pixels.
+# Detections of the tiles are mapped back to the image and merged.
+#
+
+import numpy as np
+
+
+# boxes of the same label overlapping a better one by more than this IoU are duplicates (plain NMS)
+TILE_NMS_THRESHOLD = 0.5
+# a box cut by a tile edge inside the image, overlapping a better one by more
+# than this fraction of the smaller of the two, is a part of the same object
+TILE_MERGE_THRESHOLD = 0.5
+# pixels of a tile from an edge within which a box is considered cut by it
+TILE_EDGE_MARGIN = 2
+
+
+def _positions(size, tile, overlap):
+    """Offsets of the tiles covering size, spread evenly so they overlap at least overlap pixels"""
+    if size <= tile:
+        return [0]
+    n = int(np.ceil((size - overlap) / (tile - overlap)))
+    return np.linspace(0, size - tile, n).round().astype(int).tolist()
+
+
+def merge_duplicates(boxes, confidences, labels, cut=None, threshold=TILE_NMS_THRESHOLD, merge_threshold=TILE_MERGE_THRESHOLD):
+    """Indices of the boxes kept, by decreasing confidence, and their merged boxes
+
+    Greedy non-maximum suppression on IoU, like a detector on a single image,
+    so distinct overlapping objects are kept. Boxes flagged in cut touch a
+    tile edge inside the image: a cut box is also a duplicate when it
+    overlaps a better one by more than merge_threshold of the smaller of the
+    two, and the kept box grows to their union. So the parts of an object
+    cut by tile edges, or a part and the whole object seen on the full
+    frame, end up as one box.
+    """
+    if cut is None:
+        cut = np.zeros(len(boxes), dtype=bool)
+    order = np.argsort(-confidences, kind='stable')
+    boxes, labels, cut = boxes[order], labels[order], cut[order]
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    selected = []
+    merged = []
+    alive = np.arange(len(boxes))
+    while len(alive) > 0:
+        i, alive = alive[0], alive[1:]
+
+        w = np.maximum(0, np.minimum(x2[i], x2[alive]) - np.maximum(x1[i], x1[alive]))
+        h = np.maximum(0, np.minimum(y2[i], y2[alive]) - np.maximum(y1[i], y1[alive]))
+        intersection = w * h
+        union = areas[i] + areas[alive] - intersection
+        smaller = np.minimum(areas[i], areas[alive])
+        iou = intersection / np.where(union > 0, union, 1)
+        ios = intersection / np.where(smaller > 0, smaller, 1)
+
+        same = labels[alive] == labels[i]
+        parts = same & (cut[i] | cut[alive]) & (ios > merge_threshold)
+        duplicate = parts | (same & (iou > threshold))
+
+        group = np.concatenate([[i], alive[parts]])
+        l, t = x1[group].min(), y1[group].min()
+        merged.append((l, t, x2[group].max() - l, y2[group].max() - t))
+        selected.append(i)
+        alive = alive[~duplicate]
+
+    return order[np.array(selected, dtype=np.int64)], np.array(merged, dtype=np.float64).reshape(-1, 4)
+
+
+class Tiling:
+    """Overlapping tiles of tile_size pixels covering a width x height image
+
+    overlap is the minimum fraction of a tile shared with its neighbours.
+    With full_frame the whole image is inferred too, for the objects larger
+    than a tile: its detections lying inside a tile are dropped since the
+    tile saw them at a higher resolution.
+    """
+
+    def __init__(self, width, height, tile_size, overlap=0.2, full_frame=True):
+        self.width = width
+        self.height = height
+
+        tile_w, tile_h = min(tile_size, width), min(tile_size, height)
+        overlap_px = int(tile_size * overlap)
+        xs = _positions(width, tile_w, overlap_px)
+        ys = _positions(height, tile_h, overlap_px)
+
+        # x, y, w, h of each tile
+        tiles = [(x, y, tile_w, tile_h) for y in ys for x in xs]
+        self.full_frame = full_frame and len(tiles) > 1
+        if self.full_frame:
+            tiles.append((0, 0, width, height))
+        self.tiles = np.array(tiles, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def crop(self, img):
+        """Views of img, one per tile"""
+        return [img[y:y+h, x:x+w] for x, y, w, h in self.tiles.tolist()]
+
+    def _cut(self, x, y, w, h, tile_boxes):
+        """Which boxes of the tile touch one of its edges lying inside the image"""
+        mx, my = TILE_EDGE_MARGIN / w, TILE_EDGE_MARGIN / h
+        l, t = tile_boxes[:, 0], tile_boxes[:, 1]
+        r, b = l + tile_boxes[:, 2], t + tile_boxes[:, 3]
+        return (((l <= mx) & (x > 0)) | ((t <= my) & (y > 0))
+                | ((r >= 1 - mx) & (x + w < self.width)) | ((b >= 1 - my) & (y + h < self.height)))
+
+    def _inside_tile(self, boxes):
+        """Which boxes of the image lie within one of the tiles"""
+        boxes = boxes * (self.width, self.height, self.width, self.height)
+        l, t = boxes[:, 0:1], boxes[:, 1:2]
+        r, b = l + boxes[:, 2:3], t + boxes[:, 3:4]
+        x, y, w, h = self.tiles[:-1].T
+        m = TILE_EDGE_MARGIN
+        return ((l >= x - m) & (t >= y - m) & (r <= x + w + m) & (b <= y + h + m)).any(axis=1)
+
+    def merge(self, results):
+        """(boxes, confidences, labels) of the image from the results of the tiles
+
+        Boxes are (l, t, w, h) ratios of the tile in the results and of the
+        image in the merged detections.
+        """
+        boxes, confidences, labels, cut = [], [], [], []
+        for (x, y, w, h), result in zip(self.tiles.tolist(), results):
+            tile_boxes = np.asarray(result.boxes, dtype=np.float64).reshape(-1, 4)
+            cut.append(self._cut(x, y, w, h, tile_boxes))
+            scale = np.array([w, h, w, h]) / (self.width, self.height, self.width, self.height)
+            offset = np.array([x / self.width, y / self.height, 0, 0])
+            boxes.append(tile_boxes * scale + offset)
+            confidences.append(np.asarray(result.confidences, dtype=np.float64).reshape(-1))
+            labels.append(np.asarray(result.labels, dtype=object).reshape(-1))
+
+        if self.full_frame:
+            inside = self._inside_tile(boxes[-1])
+            boxes[-1], confidences[-1], labels[-1], cut[-1] = boxes[-1][~inside], confidences[-1][~inside], labels[-1][~inside], cut[-1][~inside]
+
+        boxes, confidences, labels, cut = np.concatenate(boxes), np.concatenate(confidences), np.concatenate(labels), np.concatenate(cut)
+        keep, boxes = merge_duplicates(boxes, confidences, labels, cut)
+        return boxes, confidences[keep], labels[keep].tolist()
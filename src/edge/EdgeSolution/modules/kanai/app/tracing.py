@@ -0,0 +1,88 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import json
+import random
+import collections
+
+
+# fraction of the frames traced from capture to export, 0 disables tracing
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+# number of spans kept, the oldest ones are overwritten
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', 100000))
+
+
+def context(frame):
+    """What a span needs to know about its frame, None if the frame is not traced
+
+    Keep this instead of the frame when the span is recorded later, so the
+    image isn't held by a queue.
+    """
+    if not frame.trace:
+        return None
+    return (frame.skill_id, frame.frame_id)
+
+
+class Tracer:
+    """Ring buffer of per-frame spans, dumped in the Chrome trace format
+
+    Timestamps are time.time() seconds. Each skill is a process in the trace
+    and each traced frame a thread, so the row of a frame shows where its
+    time went from capture to export, e.g. in chrome://tracing or
+    https://ui.perfetto.dev. Spans are named after the node (or model) and
+    the step.
+    """
+
+    def __init__(self, sample_rate=TRACE_SAMPLE_RATE, buffer_size=TRACE_BUFFER_SIZE):
+        self.sample_rate = sample_rate
+        # deque.append is atomic, recording a span takes no lock
+        self._spans = collections.deque(maxlen=buffer_size)
+
+    def sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def span(self, ctx, node, name, start, end, **args):
+        if ctx is not None:
+            self._spans.append((ctx, node, name, start, end, args))
+
+    def instant(self, ctx, node, name, timestamp, **args):
+        if ctx is not None:
+            self._spans.append((ctx, node, name, timestamp, None, args))
+
+    def clear(self):
+        self._spans.clear()
+
+    def chrome_trace(self):
+        spans = list(self._spans)
+
+        pids = {}
+        tids = {}
+        events = []
+        for (skill_id, frame_id), node, name, start, end, args in spans:
+            if skill_id not in pids:
+                pids[skill_id] = len(pids) + 1
+                events.append({'name': 'process_name', 'ph': 'M', 'pid': pids[skill_id], 'tid': 0, 'args': {'name': skill_id}})
+            pid = pids[skill_id]
+            if (pid, frame_id) not in tids:
+                tids[pid, frame_id] = len(tids) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tids[pid, frame_id], 'args': {'name': f'frame {frame_id}'}})
+
+            event = {'name': f'{node} {name}', 'cat': name, 'pid': pid, 'tid': tids[pid, frame_id], 'ts': start * 1e6,
+                     'args': {'frame_id': frame_id, 'node': node, **args}}
+            if end is None:
+                event.update(ph='i', s='t')
+            else:
+                event.update(ph='X', dur=(end - start) * 1e6)
+            events.append(event)
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        trace = self.chrome_trace()
+        with open(path, 'w') as f:
+            json.dump(trace, f)
+        print(f'[Tracer] {len(trace["traceEvents"])} events written to {path}', flush=True)
+
+
+tracer = Tracer()
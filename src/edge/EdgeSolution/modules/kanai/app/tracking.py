@@ -0,0 +1,190 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+#
+# SORT-style multi-object tracker: a constant velocity Kalman filter per track
+# and IoU association, vectorized over all the tracks of a stream.
+# Boxes are (l, t, w, h) ratios of the frame, time is in seconds.
+#
+
+import numpy as np
+
+
+# noise standard deviations, relative to the box size (position, measurement)
+# and per second (process), so they don't depend on the resolution or the fps
+STD_POSITION = 0.05
+STD_VELOCITY = 0.2
+STD_MEASUREMENT = 0.05
+
+# tracks are predicted with at least, and at most, this time step
+MIN_DT = 1e-3
+MAX_DT = 5 # second
+
+_I = np.eye(8)
+
+
+def iou(a, b):
+    """N x M IoU of the (l, t, w, h) boxes a and b"""
+    a, b = a[:, None], b[None, :]
+    w = np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+    h = np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+    overlap = np.maximum(w, 0) * np.maximum(h, 0)
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - overlap
+    return np.where(union > 0, overlap / np.where(union > 0, union, 1), 0)
+
+
+def greedy_match(scores, threshold):
+    """Pairs (rows, cols) by decreasing score, each row and column used once"""
+    rows, cols = np.nonzero(scores >= threshold)
+    order = np.argsort(-scores[rows, cols], kind='stable')
+    used_rows, used_cols = set(), set()
+    matches = []
+    for r, c in zip(rows[order].tolist(), cols[order].tolist()):
+        if r not in used_rows and c not in used_cols:
+            used_rows.add(r)
+            used_cols.add(c)
+            matches.append((r, c))
+    matches = np.array(matches, dtype=np.int64).reshape(-1, 2)
+    return matches[:, 0], matches[:, 1]
+
+
+def _to_state(boxes):
+    return np.concatenate([boxes[:, :2] + boxes[:, 2:] / 2, boxes[:, 2:]], axis=1)
+
+
+def _to_boxes(state):
+    wh = np.maximum(state[:, 2:4], 0)
+    return np.concatenate([state[:, :2] - wh / 2, wh], axis=1)
+
+
+class Tracker:
+    """Assigns stable ids to the boxes detected on successive frames
+
+    The state of a track is its box center and size and their velocities.
+    On every detection the tracks are predicted to the frame time and
+    matched to the boxes of the same label by decreasing IoU, unmatched
+    boxes start new tracks. A track is output once it was matched min_hits
+    times, and forgotten after max_age detections without a match. Between
+    detections predict() gives where the tracks matched on the last one are.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=2, min_hits=1):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+
+        self.ids = np.empty(0, dtype=np.int64)
+        self.labels = np.empty(0, dtype=object)
+        self.hits = np.empty(0, dtype=np.int64)
+        self.misses = np.empty(0, dtype=np.int64)
+        self.x = np.empty((0, 8))
+        self.P = np.empty((0, 8, 8))
+
+        self._next_id = 1
+        self._timestamp = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _advance(self, timestamp):
+        """Kalman prediction of every track to timestamp"""
+        if self._timestamp is None:
+            self._timestamp = timestamp
+        dt = min(MAX_DT, max(MIN_DT, timestamp - self._timestamp))
+        self._timestamp = timestamp
+        if len(self) == 0:
+            return
+
+        F = _I.copy()
+        F[range(4), range(4, 8)] = dt
+        size = np.tile(self.x[:, 2:4], 2)
+        q = np.concatenate([(STD_POSITION * size) ** 2, (STD_VELOCITY * size) ** 2], axis=1) * dt
+
+        self.x = self.x @ F.T
+        self.P = F @ self.P @ F.T
+        self.P[:, range(8), range(8)] += q
+
+    def _correct(self, tracks, boxes):
+        """Kalman update of the tracks with their matched boxes"""
+        z = _to_state(boxes)
+        r = (STD_MEASUREMENT * np.tile(z[:, 2:4], 2)) ** 2
+        P = self.P[tracks]
+
+        S = P[:, :4, :4].copy()
+        S[:, range(4), range(4)] += r
+        # K = P H^T S^-1, P and S are symmetric
+        K = np.linalg.solve(S, P[:, :4, :]).transpose(0, 2, 1)
+
+        self.x[tracks] += (K @ (z - self.x[tracks, :4])[..., None])[..., 0]
+        self.P[tracks] = (_I - np.concatenate([K, np.zeros_like(K)], axis=2)) @ P
+
+    def update(self, boxes, labels, timestamp):
+        """Track id of each detected box, -1 for the ones not output yet, and their velocities"""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        labels = np.asarray(labels, dtype=object).reshape(-1)
+        self._advance(timestamp)
+
+        scores = iou(_to_boxes(self.x), boxes)
+        scores[self.labels[:, None] != labels[None, :]] = 0
+        tracks, detections = greedy_match(scores, self.iou_threshold)
+        if len(tracks):
+            self._correct(tracks, boxes[detections])
+
+        self.hits[tracks] += 1
+        self.misses += 1
+        self.misses[tracks] = 0
+
+        track_of = np.full(len(boxes), -1, dtype=np.int64)
+        track_of[detections] = tracks
+
+        new = np.flatnonzero(track_of < 0)
+        if len(new):
+            z = _to_state(boxes[new])
+            size = np.tile(z[:, 2:4], 2)
+            P = np.zeros((len(new), 8, 8))
+            P[:, range(8), range(8)] = np.concatenate([(2 * STD_MEASUREMENT * size) ** 2, (10 * STD_VELOCITY * size) ** 2], axis=1)
+
+            track_of[new] = np.arange(len(self), len(self) + len(new))
+            self.ids = np.concatenate([self.ids, np.arange(self._next_id, self._next_id + len(new))])
+            self.labels = np.concatenate([self.labels, labels[new]])
+            self.hits = np.concatenate([self.hits, np.ones(len(new), dtype=np.int64)])
+            self.misses = np.concatenate([self.misses, np.zeros(len(new), dtype=np.int64)])
+            self.x = np.concatenate([self.x, np.concatenate([z, np.zeros((len(new), 4))], axis=1)])
+            self.P = np.concatenate([self.P, P])
+            self._next_id += len(new)
+
+        confirmed = self.hits[track_of] >= self.min_hits
+        track_ids = np.where(confirmed, self.ids[track_of], -1)
+        velocities = self.x[track_of, 4:6]
+
+        # the indices of the kept tracks shift, forget them last
+        self._forget(self.misses <= self.max_age)
+        return track_ids, velocities
+
+    def predict(self, timestamp, track_ids):
+        """Boxes and velocities of the tracks track_ids at timestamp, NaN for forgotten tracks"""
+        self._advance(timestamp)
+        track_ids = np.asarray(track_ids, dtype=np.int64).reshape(-1)
+
+        # ids are increasing
+        index = np.zeros(len(track_ids), dtype=np.int64)
+        found = np.zeros(len(track_ids), dtype=bool)
+        if len(self):
+            index = np.minimum(np.searchsorted(self.ids, track_ids), len(self) - 1)
+            found = self.ids[index] == track_ids
+
+        boxes = np.full((len(track_ids), 4), np.nan)
+        velocities = np.full((len(track_ids), 2), np.nan)
+        boxes[found] = _to_boxes(self.x[index[found]])
+        velocities[found] = self.x[index[found], 4:6]
+        return boxes, velocities
+
+    def _forget(self, keep):
+        if keep.all():
+            return
+        self.ids = self.ids[keep]
+        self.labels = self.labels[keep]
+        self.hits = self.hits[keep]
+        self.misses = self.misses[keep]
+        self.x = self.x[keep]
+        self.P = self.P[keep]
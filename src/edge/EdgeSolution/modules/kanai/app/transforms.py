@@ -1,7 +1,14 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import time
+
+import cv2
+import numpy as np
+
 from node import Transform
+from roi import parse_regions, normalize, points_in_polygons
+from tracking import Tracker
 from frame import ObjectMeta, Bbox, InsightsMeta
 from common.voe_ipc import is_iotedge
 
@@ -26,23 +33,194 @@ class FilterTransform(Transform):
 
     def process(self, frame):
 
-        new_objects_meta = []
+        objects = frame.insights_meta.objects
+
+        mask = np.ones(len(objects), dtype=bool)
+        if self.labels:
+            mask &= objects.label_mask(self.labels)
+        if self.confidence_threshold:
+            mask &= objects.confidences >= self.confidence_threshold / 100
+
+        if not mask.all():
+            frame.insights_meta.objects = objects.select(mask)
+
+
+class RoiTransform(Transform):
+    """Keeps the objects whose box center is in one of the regions, e.g. the danger zones of a camera
+
+    regions takes the camera area or danger zones as stored by the portal, see roi.
+    Objects without a bbox are kept.
+    """
+
+    def __init__(self, regions=None, instance_name=None):
+        super().__init__()
+        self.polygons = parse_regions(regions)
+
+    def process(self, frame):
+
+        objects = frame.insights_meta.objects
+        if not self.polygons or len(objects) == 0:
+            return
+
+        boxes = objects.boxes
+        centers = boxes[:, :2] + boxes[:, 2:] / 2
+        polygons = normalize(self.polygons, frame.image.properties.width, frame.image.properties.height)
+        mask = points_in_polygons(centers, polygons) | np.isnan(centers[:, 0])
+
+        if not mask.all():
+            frame.insights_meta.objects = objects.select(mask)
+
+
+MOTION_GATE_REPORT_INTERVAL = 10 # second
+
+class MotionGateTransform(Transform):
+    """Marks the frames where nothing moved, so the models after it reuse their last insights
+
+    The frame is downscaled to width pixels and grayscaled, then compared with
+    the last frame let through ('diff') or fed to a MOG2 background subtractor
+    ('mog2'). It is static when at most motion_threshold percent of the pixels
+    changed, i.e. differ by more than pixel_threshold gray levels ('diff') or
+    are foreground ('mog2', pixel_threshold is the variance threshold). A frame
+    is let through at least every refresh_interval seconds, so reused insights
+    are never older than that.
+    """
+
+    def __init__(self, method='diff', width=64, pixel_threshold=25, motion_threshold=0.5, refresh_interval=5, instance_name=None):
+        super().__init__()
+
+        if method not in ('diff', 'mog2'):
+            raise Exception(f'Unknown motion gate method {method}')
+
+        self.method = method
+        self.width = int(width)
+        self.pixel_threshold = float(pixel_threshold)
+        self.motion_threshold = float(motion_threshold)
+        self.refresh_interval = float(refresh_interval)
+
+        self._reference = None
+        self._subtractor = None
+        if method == 'mog2':
+            self._subtractor = cv2.createBackgroundSubtractorMOG2(varThreshold=self.pixel_threshold, detectShadows=False)
+        self._last_refresh = 0
+
+        self.frames_passed = 0
+        self.frames_gated = 0
+        self._last_report = 0
+
+    def _downscale(self, img):
+        h, w = img.shape[:2]
+        small = cv2.resize(img, (self.width, max(1, round(h * self.width / w))), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
 
-        #print(self.labels, self.confidence_threshold)
+    def motion(self, small):
+        """Percentage of the pixels which changed"""
+        if self.method == 'mog2':
+            changed = np.count_nonzero(self._subtractor.apply(small))
+        elif self._reference is None or self._reference.shape != small.shape:
+            return 100.0
+        else:
+            changed = np.count_nonzero(cv2.absdiff(small, self._reference) > self.pixel_threshold)
+        return changed * 100 / small.size
+
+    def process(self, frame):
+
+        small = self._downscale(frame.image.image_pointer)
+        motion = self.motion(small)
+
+        timestamp = time.time()
+        if motion > self.motion_threshold or timestamp > self._last_refresh + self.refresh_interval:
+            frame.static = False
+            self._reference = small
+            self._last_refresh = timestamp
+            self.frames_passed += 1
+        else:
+            frame.static = True
+            self.frames_gated += 1
+
+        if timestamp > self._last_report + MOTION_GATE_REPORT_INTERVAL:
+            print(f'[MotionGate] {self.name} {frame.skill_id} let {self.frames_passed} frames through, {self.frames_gated} static', flush=True)
+            self._last_report = timestamp
+
+
+class KeyframeTransform(Transform):
+    """Lets the models after it run on one frame out of interval
+
+    The other frames are marked static, the models reuse their last insights
+    and a tracking_transform after them moves the boxes along their tracks.
+    Frames a motion gate before it marked static stay static.
+    """
+
+    def __init__(self, interval=3, instance_name=None):
+        super().__init__()
+        self.interval = max(1, int(interval))
+        self._frames = 0
+
+    def process(self, frame):
+        if self._frames % self.interval:
+            frame.static = True
+        elif frame.static is None:
+            frame.static = False
+        self._frames += 1
+
+
+TRACKING_REPORT_INTERVAL = 10 # second
+
+class TrackingTransform(Transform):
+    """Gives the objects with a bbox a stable tracking id, see tracking.Tracker
+
+    Detections update the tracks. On static frames (see KeyframeTransform
+    and MotionGateTransform) the models reused the objects of the last
+    detection, their boxes are replaced by where the tracks are predicted at
+    the frame time. Put it after the last model. Objects whose track is not
+    confirmed yet (min_hits) are dropped, objects without a bbox are kept.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=2, min_hits=1, instance_name=None):
+        super().__init__()
+        self.tracker = Tracker(float(iou_threshold), int(max_age), int(min_hits))
 
-        print(frame.insights_meta.objects_meta)
+        # track id of each object of the last detection
+        self._track_ids = None
+
+        self.frames_detected = 0
+        self.frames_propagated = 0
+        self._last_report = 0
+
+    def process(self, frame):
+
+        objects = frame.insights_meta.objects
+        boxed = ~np.isnan(objects.boxes[:, 0])
+
+        if frame.static and self._track_ids is not None and len(self._track_ids) == len(objects):
+            boxes, velocities = self.tracker.predict(frame.timestamp, self._track_ids)
+            track_ids = self._track_ids
+            self.frames_propagated += 1
+        else:
+            rows = np.flatnonzero(boxed)
+            labels = np.asarray(objects.labels, dtype=object)[objects.label_ids[rows]]
+            row_track_ids, row_velocities = self.tracker.update(objects.boxes[rows], labels, frame.timestamp)
 
-        for object_meta in frame.insights_meta.objects_meta:
-            if self.labels:
-                if object_meta.label not in self.labels:
-                    continue
-            if self.confidence_threshold:
-                if object_meta.confidence < self.confidence_threshold / 100:
-                    continue
+            boxes = objects.boxes
+            track_ids = np.full(len(objects), -1, dtype=np.int64)
+            track_ids[rows] = row_track_ids
+            velocities = np.full((len(objects), 2), np.nan)
+            velocities[rows] = row_velocities
+            self._track_ids = track_ids
+            self.frames_detected += 1
 
-            new_objects_meta.append(object_meta)
+        keep = ~boxed | (track_ids >= 0) & ~np.isnan(boxes[:, 0])
+        tracked = objects.select(keep)
+        tracked.boxes = np.where(boxed[keep, None], boxes[keep], objects.boxes[keep])
+        tracked.track_ids = np.where(boxed[keep], track_ids[keep], -1)
+        tracked.velocities = np.where(boxed[keep, None], velocities[keep], np.nan)
+        frame.insights_meta.objects = tracked
 
-        frame.insights_meta.objects_meta = new_objects_meta
+        timestamp = time.time()
+        if timestamp > self._last_report + TRACKING_REPORT_INTERVAL:
+            print(f'[Tracking] {self.name} {frame.skill_id} {len(self.tracker)} tracks, {self.frames_detected} frames detected, {self.frames_propagated} propagated', flush=True)
+            self._last_report = timestamp
 
 
 from grpc_proto.custom_node_client import CustomNodeClient
@@ -6,30 +6,39 @@ import cv2
 
 def insights_overlay(img, frame):
 
+    # the image buffer may be shared with other branches, draw on a copy
+    if not img.flags.writeable:
+        img = img.copy()
+
     h, w, _ = img.shape
 
-    print(f'img shape -> h {h} w {w}', flush=True)
-  
+    objects = frame.insights_meta.objects
+
+    attributes = [''] * len(objects)
+    for object_id, name, label in zip(objects.attr_object_ids.tolist(), objects.attr_names, objects.attr_labels):
+        attributes[object_id] += f', {name}: {label}'
 
-    for object_meta in frame.insights_meta.objects_meta:
-        bbox = object_meta.bbox
-        print(f'bbox-->', bbox)
-        p1 = int(bbox.l * w), int(bbox.t * h)
-        p2 = int((bbox.l+bbox.w) * w), int((bbox.t+bbox.h) * h)
+    for (l, t, bw, bh), confidence, label_id, object_attributes in zip(
+            objects.boxes.tolist(), objects.confidences.tolist(), objects.label_ids.tolist(), attributes):
+        if l != l: continue # no bbox
+
+        p1 = int(l * w), int(t * h)
+        p2 = int((l+bw) * w), int((t+bh) * h)
         color = (0, 0, 255)
         thickness = 2
 
         cv2.rectangle(img, p1, p2, color, thickness)
 
-        label = f'{object_meta.label} ({round(object_meta.confidence, 2)})'
+        label = f'{objects.labels[label_id]} ({round(confidence, 2)})'
         fontScale = 1
         font = cv2.FONT_HERSHEY_SIMPLEX
         org = p1[0], p1[1]-20
         thickness = 2
         color = (0, 0, 255)
 
-        for attribute in object_meta.attributes:
-            label += f', {attribute.name}: {attribute.label}'
+        label += object_attributes
 
         cv2.putText(img, label, org, font,
                fontScale, color, thickness, cv2.LINE_AA)
+
+    return img
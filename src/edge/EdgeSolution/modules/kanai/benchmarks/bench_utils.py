@@ -0,0 +1,36 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Shared helpers for the kanai benchmarks, run them from this folder, e.g.
+#   python frame_fanout.py
+
+import os
+import sys
+import time
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(_here, '..', 'app'))
+sys.path.append(os.path.join(_here, '..', '..', 'common'))
+
+import numpy as np
+
+
+def make_image(width=1920, height=1080):
+    return np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+
+
+def timeit(func, repeat=100):
+    """Return the mean runtime of func() in ms"""
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def print_table(header, rows):
+    widths = [max(len(str(x)) for x in col) for col in zip(header, *rows)]
+    fmt = '  '.join('{:>%d}' % w for w in widths)
+    print(fmt.format(*header))
+    for row in rows:
+        print(fmt.format(*row))
@@ -0,0 +1,81 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Crops per second of a classification_model node on frames with N objects,
+# through OpenVINOClassificationModel and the batch scheduler, for several
+# max batch sizes. 'legacy' is the per-object loop it replaced, which sent
+# the full frame once per object. The model is downloaded into app/models
+# from the OpenVINO model zoo if needed, like the module does.
+#   python crop_classification.py --model vehicle-attributes-recognition-barrier-0039
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+import bench_utils
+import frame
+import frame_attr
+from batch_scheduler import BatchScheduler
+from models import ClassificationModel
+from predict_module import predict_module, get_openvino_classification_model
+
+
+def make_frame(img, n_objects, rng):
+    h, w, _ = img.shape
+    f = frame_attr.Frame(
+        image=frame_attr.Image(image_pointer=img, properties=frame_attr.ImageProperties(height=h, width=w, color_format=frame.ColorFormat.BGR)),
+        timestamp=time.time(), frame_id='0', skill_id='skill', device_id='device', datetime='')
+    size = rng.uniform(0.03, 0.2, (n_objects, 2))
+    boxes = np.concatenate([rng.uniform(0, 1, (n_objects, 2)) * (1 - size), size], axis=1)
+    f.insights_meta.objects.append(boxes, np.ones(n_objects), ['object'] * n_objects)
+    return f
+
+
+def legacy_process(node, f):
+    img = f.image.image_pointer
+    for _ in range(len(f.insights_meta.objects)):
+        predict_module.predict(node.model, img)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='age-gender-recognition-retail-0013')
+    parser.add_argument('--objects', type=int, default=20)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--batch-sizes', default='1,2,4,8,16,32')
+    args = parser.parse_args()
+
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+    img = bench_utils.make_image()
+    img.flags.writeable = False
+
+    rows = []
+    for name, batch_size in [('legacy', 1)] + [(f'batch {b}', int(b)) for b in args.batch_sizes.split(',')]:
+        model = get_openvino_classification_model(args.model, batch_size)
+        predict_module.models[args.model] = model
+        predict_module.schedulers[args.model] = BatchScheduler(args.model, model, batch_size, 5)
+        # every run infers, results of the previous one aren't reused
+        predict_module.cache = type(predict_module.cache)(size=0)
+
+        node = ClassificationModel(args.model, args.model, 'modelzoo')
+        process = (lambda f: legacy_process(node, f)) if name == 'legacy' else node.process
+
+        rng = np.random.default_rng(0)
+        frames = [make_frame(img, args.objects, rng) for _ in range(args.frames)]
+        process(make_frame(img, args.objects, rng))
+
+        start = time.perf_counter()
+        for f in frames:
+            process(f)
+        elapsed = time.perf_counter() - start
+
+        rows.append((name, model.max_batch_size, f'{elapsed / len(frames) * 1000:.1f}', f'{len(frames) * args.objects / elapsed:.0f}'))
+
+    bench_utils.print_table(('mode', 'model batch', 'ms/frame', 'crops/s'), rows)
+
+
+if __name__ == '__main__':
+    main()
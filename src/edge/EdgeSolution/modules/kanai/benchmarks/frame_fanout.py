@@ -0,0 +1,95 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Bytes copied per frame while a 1080p frame travels through a graph,
+# legacy copy.deepcopy per edge vs. copy-on-write fork_frame per edge.
+
+import copy
+import tracemalloc
+
+import bench_utils
+import node
+from node import Transform, Export
+from frame import ColorFormat, ObjectMeta, Bbox
+from frame_attr import Frame, Image, ImageProperties
+
+
+class NopTransform(Transform):
+    def process(self, frame):
+        pass
+
+
+class NopExport(Export):
+    def process(self, frame):
+        pass
+
+
+def build(shape):
+    # shape: list of (parent index, 'transform' | 'export'), index 0 is the source
+    elements = [NopTransform()]
+    for parent, kind in shape:
+        element = NopTransform() if kind == 'transform' else NopExport()
+        elements[parent].add_child(element)
+        elements.append(element)
+    return elements[0]
+
+
+def push(element, frame, alive):
+    # synchronous version of Source.loop / Transform.loop
+    for child in element._children:
+        child.send(frame)
+        f = child.receive()
+        alive.append(f)
+        push(child, f, alive)
+
+
+GRAPHS = {
+    'source->export': [(0, 'export')],
+    'source->model->export': [(0, 'transform'), (1, 'export')],
+    'source->model->filter->export': [(0, 'transform'), (1, 'transform'), (2, 'export')],
+    'source->3 exports': [(0, 'export'), (0, 'export'), (0, 'export')],
+    'source->model->3 exports': [(0, 'transform'), (1, 'export'), (1, 'export'), (1, 'export')],
+}
+
+
+def make_frame():
+    img = bench_utils.make_image()
+    img.flags.writeable = False
+    h, w, _ = img.shape
+    frame = Frame(
+        image=Image(image_pointer=img, properties=ImageProperties(height=h, width=w, color_format=ColorFormat.BGR)),
+        timestamp=0, frame_id='0', skill_id='skill', device_id='device', datetime='',
+    )
+    for i in range(10):
+        frame.insights_meta.objects_meta.append(
+            ObjectMeta(timestamp=0, label='person', confidence=0.5, inference_id=str(i), attributes=[],
+                       bbox=Bbox(l=0.1, t=0.1, w=0.2, h=0.2)))
+    return frame
+
+
+def bytes_per_frame(root, n_frames=5):
+    frames = [make_frame() for _ in range(n_frames)]
+    alive = []
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for frame in frames:
+        push(root, frame, alive)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / n_frames
+
+
+def main():
+    fork_frame = node.fork_frame
+    rows = []
+    for name, shape in GRAPHS.items():
+        node.fork_frame = copy.deepcopy
+        legacy = bytes_per_frame(build(shape))
+        node.fork_frame = fork_frame
+        cow = bytes_per_frame(build(shape))
+        rows.append((name, len(shape), f'{legacy/1e6:.2f}', f'{cow/1e3:.1f}'))
+    bench_utils.print_table(('graph', 'edges', 'deepcopy MB/frame', 'fork_frame KB/frame'), rows)
+
+
+if __name__ == '__main__':
+    main()
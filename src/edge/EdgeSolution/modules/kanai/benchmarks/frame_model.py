@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Cost per frame of the runtime frame model (slotted attrs, frame_attr.py)
+# vs. the pydantic one (frame.py) it replaced inside a Stream.
+
+import argparse
+
+import numpy as np
+
+import bench_utils
+import frame
+import frame_attr
+
+
+def make_insights_meta(n_objects):
+    insights_meta = frame.InsightsMeta()
+    insights_meta.objects.append(np.random.rand(n_objects, 4), np.random.rand(n_objects), ['person'] * n_objects)
+    return insights_meta
+
+
+def pydantic_frame(img, insights_meta):
+    h, w, _ = img.shape
+    return frame.Frame(
+        image=frame.Image(image_pointer=img, properties=frame.ImageProperties(height=h, width=w, color_format=frame.ColorFormat.BGR)),
+        insights_meta=insights_meta, timestamp=0, frame_id='0', skill_id='skill', device_id='device', datetime='')
+
+
+def attrs_frame(img, insights_meta):
+    h, w, _ = img.shape
+    return frame_attr.Frame(
+        image=frame_attr.Image(image_pointer=img, properties=frame_attr.ImageProperties(height=h, width=w, color_format=frame.ColorFormat.BGR)),
+        insights_meta=insights_meta, timestamp=0, frame_id='0', skill_id='skill', device_id='device', datetime='')
+
+
+def pydantic_fork(f):
+    # fork_frame before the runtime frame moved to attrs
+    return f.model_copy(update={'insights_meta': f.insights_meta.copy(deep=True)})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=10000)
+    args = parser.parse_args()
+
+    img = bench_utils.make_image()
+    insights_meta = make_insights_meta(args.objects)
+
+    p = pydantic_frame(img, insights_meta)
+    a = attrs_frame(img, insights_meta)
+    assert p.model_dump_json() == a.json() == a.to_pydantic().model_dump_json()
+
+    rows = []
+    for name, pydantic_func, attrs_func in (
+            ('construct', lambda: pydantic_frame(img, insights_meta), lambda: attrs_frame(img, insights_meta)),
+            ('fork', lambda: pydantic_fork(p), lambda: frame_attr.fork_frame(a)),
+            ('serialize', p.model_dump_json, a.json)):
+        pydantic_us = bench_utils.timeit(pydantic_func, args.repeat) * 1000
+        attrs_us = bench_utils.timeit(attrs_func, args.repeat) * 1000
+        rows.append((name, f'{pydantic_us:.1f}', f'{attrs_us:.1f}', f'{pydantic_us/attrs_us:.1f}x'))
+
+    print(f'{args.objects} objects per frame')
+    bench_utils.print_table(('op', 'pydantic us/frame', 'attrs us/frame', 'speedup'), rows)
+
+
+if __name__ == '__main__':
+    main()
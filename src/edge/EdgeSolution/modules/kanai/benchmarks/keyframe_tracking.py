@@ -0,0 +1,140 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Detector calls saved vs. tracking quality when the detector only runs on one
+# frame out of N (keyframe_transform + tracking_transform) on a recorded clip.
+# The clip is a MOT challenge ground truth file (frame, id, l, t, w, h, ...
+# in pixels), or synthetic crossing trajectories without --mot. The detector
+# is emulated by the ground truth boxes with noise and missed detections.
+#   python keyframe_tracking.py --mot MOT17-04/gt/gt.txt --width 1920 --height 1080 --fps 30
+
+import argparse
+import collections
+
+import numpy as np
+
+import bench_utils
+import frame
+import frame_attr
+from transforms import KeyframeTransform, TrackingTransform
+from tracking import iou, greedy_match
+
+
+def load_mot(path, width, height):
+    rows = np.loadtxt(path, delimiter=',', ndmin=2)
+    # consider only the pedestrians of the gt files, detection files have -1 there
+    if rows.shape[1] > 7:
+        rows = rows[(rows[:, 6] != 0) & np.isin(rows[:, 7], (-1, 1))]
+    clip = collections.defaultdict(lambda: (np.empty((0, 4)), np.empty(0, dtype=np.int64)))
+    for frame_number in np.unique(rows[:, 0]).astype(int):
+        r = rows[rows[:, 0] == frame_number]
+        clip[frame_number - 1] = (r[:, 2:6] / (width, height, width, height), r[:, 1].astype(np.int64))
+    return [clip[i] for i in range(int(rows[:, 0].max()))]
+
+
+def synthetic_clip(n_frames, n_objects, fps, rng, max_speed=0.25):
+    """Objects walking around the frame at up to max_speed frames per second, crossing each other"""
+    size = rng.uniform(0.05, 0.15, (n_objects, 2))
+    position = rng.uniform(0, 1, (n_objects, 2)) * (1 - size)
+    velocity = rng.uniform(-max_speed, max_speed, (n_objects, 2)) / np.sqrt(2)
+    clip = []
+    for _ in range(n_frames):
+        velocity += rng.normal(0, 0.2, velocity.shape) / fps
+        speed = np.linalg.norm(velocity, axis=1, keepdims=True)
+        velocity *= np.minimum(1, max_speed / np.maximum(speed, 1e-9))
+        position += velocity / fps
+        bounce = (position < 0) | (position > 1 - size)
+        velocity[bounce] *= -1
+        position = np.clip(position, 0, 1 - size)
+        clip.append((np.concatenate([position, size], axis=1), np.arange(n_objects)))
+    return clip
+
+
+def detect(boxes, rng, noise, miss_rate):
+    keep = rng.random(len(boxes)) >= miss_rate
+    boxes = boxes[keep]
+    return boxes + rng.normal(0, noise, boxes.shape) * np.tile(boxes[:, 2:], 2)
+
+
+def make_frame(timestamp):
+    img = np.zeros((1, 1, 3), dtype=np.uint8)
+    return frame_attr.Frame(
+        image=frame_attr.Image(image_pointer=img, properties=frame_attr.ImageProperties(height=1, width=1, color_format=frame.ColorFormat.BGR)),
+        timestamp=timestamp, frame_id='0', skill_id='skill', device_id='device', datetime='')
+
+
+def run(clip, interval, fps, noise, miss_rate, seed):
+    rng = np.random.default_rng(seed)
+    keyframe = KeyframeTransform(interval=interval)
+    tracking = TrackingTransform()
+
+    detector_calls = 0
+    last_insights_meta = None
+    matched = ious = total = switches = 0
+    track_of = {}
+    for i, (gt_boxes, gt_ids) in enumerate(clip):
+        f = make_frame(i / fps)
+        keyframe.process(f)
+
+        # what Model does with a static frame
+        if f.static and last_insights_meta is not None:
+            f.insights_meta = last_insights_meta.copy(deep=True)
+        else:
+            boxes = detect(gt_boxes, rng, noise, miss_rate)
+            f.insights_meta.objects.append(boxes, np.ones(len(boxes)), ['person'] * len(boxes))
+            last_insights_meta = f.insights_meta.copy(deep=True)
+            detector_calls += 1
+
+        tracking.process(f)
+        objects = f.insights_meta.objects
+
+        # CLEAR MOT style: gt objects matched at IoU >= 0.5, a switch is a gt object changing of track
+        scores = iou(gt_boxes, objects.boxes)
+        gt_index, object_index = greedy_match(scores, 0.5)
+        total += len(gt_boxes)
+        matched += len(gt_index)
+        ious += scores[gt_index, object_index].sum()
+        for gt_id, track_id in zip(gt_ids[gt_index].tolist(), objects.track_ids[object_index].tolist()):
+            if gt_id in track_of and track_of[gt_id] != track_id:
+                switches += 1
+            track_of[gt_id] = track_id
+
+    return {
+        'detector_calls': detector_calls,
+        'recall': matched / max(1, total),
+        'mean_iou': ious / max(1, matched),
+        'id_switches': switches,
+        'switches_per_1k': switches / max(1, matched) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mot', help='MOT challenge gt.txt, synthetic clip without it')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--frames', type=int, default=900)
+    parser.add_argument('--objects', type=int, default=20)
+    parser.add_argument('--noise', type=float, default=0.02, help='detection noise, ratio of the box size')
+    parser.add_argument('--miss-rate', type=float, default=0.05)
+    parser.add_argument('--intervals', default='1,2,3,4,6,8')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.mot:
+        clip = load_mot(args.mot, args.width, args.height)
+    else:
+        clip = synthetic_clip(args.frames, args.objects, args.fps, np.random.default_rng(args.seed))
+    print(f'{len(clip)} frames at {args.fps:g} fps, {sum(len(ids) for _, ids in clip)} boxes')
+
+    rows = []
+    for interval in [int(i) for i in args.intervals.split(',')]:
+        r = run(clip, interval, args.fps, args.noise, args.miss_rate, args.seed)
+        rows.append((interval, r['detector_calls'], f'{1 - r["detector_calls"] / len(clip):.0%}',
+                     f'{r["recall"]:.3f}', f'{r["mean_iou"]:.3f}', r['id_switches'], f'{r["switches_per_1k"]:.1f}'))
+    bench_utils.print_table(('interval', 'detector calls', 'saved', 'recall', 'mean IoU', 'ID switches', 'per 1k matches'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Preprocessing time per frame when several model nodes, or several pipelines
+# on the same camera, feed the same frame to networks of the same input sizes,
+# with and without the shared preprocess_cache, and the memory it holds.
+
+import argparse
+
+import numpy as np
+
+import bench_utils
+from preprocess_cache import PreprocessCache
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--sizes', default='300,416', help='input sizes of the models of the cascade')
+    parser.add_argument('--pipelines', default='1,2,4')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    sizes = [(int(s), int(s)) for s in args.sizes.split(',')]
+    buffer = bench_utils.make_image(args.width, args.height).tobytes()
+
+    rows = []
+    for pipelines in [int(p) for p in args.pipelines.split(',')]:
+        for name, cache in (('off', PreprocessCache(max_bytes=0)), ('on', PreprocessCache())):
+
+            def run():
+                # a new read-only frame, freed once its models are done like in a Stream
+                img = np.ndarray((args.height, args.width, 3), dtype=np.uint8, buffer=buffer)
+                for _ in range(pipelines):
+                    for dsize in sizes:
+                        cache.get(img, dsize)
+
+            ms = bench_utils.timeit(run, args.repeat)
+            stats = cache.stats()
+            rows.append((pipelines, len(sizes) * pipelines, name, f'{ms:.2f}', stats['hits'], stats['misses'],
+                         f'{stats["peak_bytes"] / 2**20:.1f}', f'{stats["bytes"] / 2**20:.1f}'))
+
+    bench_utils.print_table(('pipelines', 'models/frame', 'cache', 'ms/frame', 'hits', 'misses', 'peak MB', 'MB held after'), rows)
+
+
+if __name__ == '__main__':
+    main()
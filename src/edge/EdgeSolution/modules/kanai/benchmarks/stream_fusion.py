@@ -0,0 +1,109 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Capture-to-export latency and thread count of a source -> N transforms -> export
+# chain built by Stream, with and without linear-chain fusion.
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+import bench_utils
+import stream
+from node import Source, Transform, Export
+from frame import ColorFormat
+from frame_attr import Frame, Image, ImageProperties
+from common.voe_cascade_config import CascadeConfig
+
+
+class BenchSource(Source):
+    def __init__(self, fps='30'):
+        super().__init__()
+        self.interval = 1 / float(fps)
+        self.frame_id = 0
+        self.img = np.zeros((1080, 1920, 3), dtype=np.uint8)
+
+    def next_frame(self):
+        time.sleep(self.interval)
+        while not self._running:
+            time.sleep(1)
+        self.frame_id += 1
+        h, w, _ = self.img.shape
+        return Frame(
+            image=Image(image_pointer=self.img, properties=ImageProperties(height=h, width=w, color_format=ColorFormat.BGR)),
+            timestamp=time.time(), frame_id=str(self.frame_id), skill_id='skill', device_id='device', datetime='')
+
+
+class BenchTransform(Transform):
+    def __init__(self, work_us='200'):
+        super().__init__()
+        self.work = float(work_us) / 1e6
+
+    def process(self, frame):
+        # stands for a little python work holding the GIL, e.g. a filter
+        end = time.perf_counter() + self.work
+        while time.perf_counter() < end:
+            pass
+
+
+class BenchExport(Export):
+    def __init__(self):
+        super().__init__()
+        self.latencies = []
+
+    def process(self, frame):
+        self.latencies.append(time.time() - frame.timestamp)
+
+
+stream.supported_sources['bench_source'] = BenchSource
+stream.supported_transforms['bench_transform'] = BenchTransform
+stream.supported_exports['bench_export'] = BenchExport
+
+
+def cascade_config(n_transforms, fps, work_us):
+    nodes = [dict(id='source', type='source', name='bench_source', configurations={'fps': str(fps)})]
+    nodes += [dict(id=f'transform{i}', type='transform', name='bench_transform', configurations={'work_us': str(work_us)})
+              for i in range(n_transforms)]
+    nodes += [dict(id='export', type='export', name='bench_export', configurations={})]
+    edges = [dict(source=a['id'], target=b['id']) for a, b in zip(nodes, nodes[1:])]
+    return CascadeConfig(nodes=nodes, edges=edges)
+
+
+def run(config, fusion, duration):
+    s = stream.Stream.from_cascade_config(config, fusion=fusion)
+    threads = sum(len(element.threads()) for element in s._elements)
+
+    active_before = threading.active_count()
+    s.start()
+    time.sleep(duration)
+    active = threading.active_count() - active_before
+    s.stop()
+
+    export = s._elements[-1]
+    latencies = np.array(export.latencies[10:]) * 1000
+    return threads, active, len(latencies) / duration, np.median(latencies), np.percentile(latencies, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transforms', type=int, default=4)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--work-us', type=float, default=200)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args()
+
+    config = cascade_config(args.transforms, args.fps, args.work_us)
+
+    rows = []
+    for fusion in (False, True):
+        threads, active, fps, p50, p99 = run(config, fusion, args.duration)
+        rows.append(('fused' if fusion else 'unfused', threads, active, f'{fps:.1f}', f'{p50:.2f}', f'{p99:.2f}'))
+
+    print(f'source -> {args.transforms} transforms ({args.work_us:.0f} us each) -> export at {args.fps:.0f} fps')
+    bench_utils.print_table(('graph', 'element threads', 'started threads', 'fps', 'p50 ms', 'p99 ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
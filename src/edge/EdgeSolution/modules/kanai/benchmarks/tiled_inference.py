@@ -0,0 +1,120 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Latency and recall of an ObjectDetectionModel node on 4K frames, untiled vs.
+# tiled (tile_size / tile_overlap). The detector squashes its input to a
+# 416 x 416 network size like the customvision and openvino ones, then finds
+# bright blobs: objects left with too few pixels after the resize are
+# missed, like with a real network. Its cost is only the resize, a real
+# network multiplies the images per frame column by its latency.
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import bench_utils
+import frame
+import frame_attr
+from batch_scheduler import BatchScheduler
+from core import ObjectDetectionArrays
+from models import ObjectDetectionModel
+from predict_module import predict_module
+from tracking import iou, greedy_match
+
+
+class BlobDetector:
+    def __init__(self, input_size=416, min_area=6):
+        self.dsize = (input_size, input_size)
+        self.min_area = min_area
+        self.images = 0
+
+    def predict(self, image):
+        self.images += 1
+        gray = cv2.cvtColor(cv2.resize(image, self.dsize, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        n, _, stats, _ = cv2.connectedComponentsWithStats((gray > 96).astype(np.uint8))
+        stats = stats[1:][stats[1:, cv2.CC_STAT_AREA] >= self.min_area]
+        boxes = stats[:, :4] / (self.dsize * 2)
+        return ObjectDetectionArrays(boxes, np.full(len(boxes), 0.9), ['blob'] * len(boxes))
+
+    def predict_batch(self, images):
+        return [self.predict(image) for image in images]
+
+
+def make_scene(width, height, n_objects, rng):
+    """Dark noisy frame with brighter boxes of 8 to 256 pixels, and their (l, t, w, h) ratios"""
+    img = rng.integers(0, 40, (height, width, 3), dtype=np.uint8)
+    boxes = []
+    while len(boxes) < n_objects:
+        w, h = np.exp(rng.uniform(np.log(8), np.log(256), 2)).astype(int)
+        l, t = rng.integers(0, width - w), rng.integers(0, height - h)
+        # keep a gap so blobs don't touch once resized
+        if any(l < bl + bw + 16 and bl < l + w + 16 and t < bt + bh + 16 and bt < t + h + 16 for bl, bt, bw, bh in boxes):
+            continue
+        boxes.append((l, t, w, h))
+        img[t:t+h, l:l+w] = rng.integers(120, 256)
+    img.flags.writeable = False
+    return img, np.array(boxes, dtype=np.float64) / (width, height, width, height)
+
+
+def make_frame(img):
+    h, w, _ = img.shape
+    return frame_attr.Frame(
+        image=frame_attr.Image(image_pointer=img, properties=frame_attr.ImageProperties(height=h, width=w, color_format=frame.ColorFormat.BGR)),
+        timestamp=time.time(), frame_id='0', skill_id='skill', device_id='device', datetime='')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=3840)
+    parser.add_argument('--height', type=int, default=2160)
+    parser.add_argument('--objects', type=int, default=60)
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--tile-sizes', default='640,960,1280')
+    parser.add_argument('--tile-overlap', type=float, default=0.2)
+    parser.add_argument('--max-batch-size', type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    scenes = [make_scene(args.width, args.height, args.objects, rng) for _ in range(args.frames)]
+
+    detector = BlobDetector()
+    predict_module.models['blob'] = detector
+    predict_module.schedulers['blob'] = BatchScheduler('blob', detector, args.max_batch_size, 5)
+
+    rows = []
+    for tile_size in [None] + [int(s) for s in args.tile_sizes.split(',')]:
+        node = ObjectDetectionModel('blob', 'blob', 'bench', tile_size=tile_size, tile_overlap=args.tile_overlap)
+        node.name = 'untiled' if tile_size is None else f'tile {tile_size}'
+        detector.images = 0
+
+        latencies = []
+        found = {'small': [0, 0], 'medium': [0, 0], 'large': [0, 0]}
+        false_positives = 0
+        for img, gt in scenes:
+            f = make_frame(img)
+            start = time.perf_counter()
+            node.process(f)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            boxes = f.insights_meta.objects.boxes
+            matched, _ = greedy_match(iou(gt, boxes), 0.5)
+            false_positives += len(boxes) - len(matched)
+            # COCO sizes, in pixels of the frame
+            area = gt[:, 2] * gt[:, 3] * args.width * args.height
+            size = np.where(area < 32 ** 2, 'small', np.where(area < 96 ** 2, 'medium', 'large'))
+            hit = np.zeros(len(gt), dtype=bool)
+            hit[matched] = True
+            for name in found:
+                found[name][0] += hit[size == name].sum()
+                found[name][1] += (size == name).sum()
+
+        rows.append((node.name, f'{detector.images / len(scenes):.0f}', f'{np.median(latencies):.1f}',
+                     *(f'{hits / max(1, total):.2f}' for hits, total in found.values()), false_positives))
+
+    bench_utils.print_table(('mode', 'images/frame', 'latency ms', 'recall small', 'medium', 'large', 'false pos.'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+# Custom Vision YOLO postprocess on a synthetic 13 x 13 x (5 * (5 + C)) output,
+# legacy per-box python NMS vs. the current ObjectDetection.postprocess_arrays.
+
+import argparse
+
+import numpy as np
+
+import bench_utils
+from customvision.object_detection import ObjectDetection
+
+
+class LegacyObjectDetection(ObjectDetection):
+    """The postprocess shipped before the vectorized NMS, kept here as reference"""
+
+    def _logistic(self, x):
+        return np.where(x > 0, 1 / (1 + np.exp(-x)), np.exp(x) / (1 + np.exp(x)))
+
+    def _legacy_non_maximum_suppression(self, boxes, class_probs, max_detections):
+        max_detections = min(max_detections, len(boxes))
+        max_probs = np.amax(class_probs, axis=1)
+        max_classes = np.argmax(class_probs, axis=1)
+        areas = boxes[:, 2] * boxes[:, 3]
+        selected_boxes, selected_classes, selected_probs = [], [], []
+
+        while len(selected_boxes) < max_detections:
+            i = np.argmax(max_probs)
+            if max_probs[i] < self.prob_threshold:
+                break
+            selected_boxes.append(boxes[i])
+            selected_classes.append(max_classes[i])
+            selected_probs.append(max_probs[i])
+
+            box = boxes[i]
+            other_indices = np.concatenate((np.arange(i), np.arange(i + 1, len(boxes))))
+            other_boxes = boxes[other_indices]
+            x1 = np.maximum(box[0], other_boxes[:, 0])
+            y1 = np.maximum(box[1], other_boxes[:, 1])
+            x2 = np.minimum(box[0] + box[2], other_boxes[:, 0] + other_boxes[:, 2])
+            y2 = np.minimum(box[1] + box[3], other_boxes[:, 1] + other_boxes[:, 3])
+            w = np.maximum(0, x2 - x1)
+            h = np.maximum(0, y2 - y1)
+            overlap_area = w * h
+            iou = overlap_area / (areas[i] + areas[other_indices] - overlap_area)
+
+            overlapping_indices = other_indices[np.where(iou > self.IOU_THRESHOLD)[0]]
+            overlapping_indices = np.append(overlapping_indices, i)
+            class_probs[overlapping_indices, max_classes[i]] = 0
+            max_probs[overlapping_indices] = np.amax(class_probs[overlapping_indices], axis=1)
+            max_classes[overlapping_indices] = np.argmax(class_probs[overlapping_indices], axis=1)
+
+        return selected_boxes, selected_classes, selected_probs
+
+    def legacy_postprocess(self, prediction_outputs):
+        boxes, class_probs = self._extract_bb(prediction_outputs, self.ANCHORS)
+        max_probs = np.amax(class_probs, axis=1)
+        index, = np.where(max_probs > self.prob_threshold)
+        index = index[(-max_probs[index]).argsort()]
+        selected_boxes, selected_classes, selected_probs = self._legacy_non_maximum_suppression(
+            boxes[index], class_probs[index], self.max_detections)
+        return [{'probability': round(float(selected_probs[i]), 8),
+                 'tagId': int(selected_classes[i]),
+                 'tagName': self.labels[selected_classes[i]],
+                 'boundingBox': {
+                     'left': round(float(selected_boxes[i][0]), 8),
+                     'top': round(float(selected_boxes[i][1]), 8),
+                     'width': round(float(selected_boxes[i][2]), 8),
+                     'height': round(float(selected_boxes[i][3]), 8)
+                 }
+                 } for i in range(len(selected_boxes))]
+
+
+def synthetic_output(num_classes, rng):
+    outputs = rng.normal(0, 1.5, (13, 13, 5, 5 + num_classes)).astype(np.float32)
+    # make a handful of confident, overlapping detections
+    outputs[..., 4] -= 2
+    outputs[rng.integers(0, 13, 30), rng.integers(0, 13, 30), rng.integers(0, 5, 30), 4] = 4
+    return outputs.reshape(13, 13, -1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--classes', type=int, nargs='*', default=[1, 2, 5, 10, 20, 40, 80])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for num_classes in args.classes:
+        labels = [str(i) for i in range(num_classes)]
+        legacy_od = LegacyObjectDetection(labels)
+        od = ObjectDetection(labels)
+        outputs = synthetic_output(num_classes, rng)
+
+        legacy = legacy_od.legacy_postprocess(outputs)
+        current = od.postprocess(outputs)
+        same = [p['tagId'] for p in legacy] == [p['tagId'] for p in current] and \
+            np.allclose([p['probability'] for p in legacy], [p['probability'] for p in current], atol=1e-6)
+
+        legacy_ms = bench_utils.timeit(lambda: legacy_od.legacy_postprocess(outputs), args.repeat)
+        dicts_ms = bench_utils.timeit(lambda: od.postprocess(outputs), args.repeat)
+        arrays_ms = bench_utils.timeit(lambda: od.postprocess_arrays(outputs), args.repeat)
+        rows.append((num_classes, len(current), f'{legacy_ms:.3f}', f'{dicts_ms:.3f}', f'{arrays_ms:.3f}', str(same)))
+
+    bench_utils.print_table(('classes', 'detections', 'legacy ms', 'dicts ms', 'arrays ms', 'same result'), rows)
+
+
+if __name__ == '__main__':
+    main()
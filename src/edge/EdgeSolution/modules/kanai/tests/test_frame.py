@@ -0,0 +1,54 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(here, '..', 'app'), os.path.join(here, '..', '..', 'common')]
+
+import numpy as np
+
+import frame
+import frame_attr
+
+
+# payload of this frame before the runtime frame model and tracking_info
+EXPECTED = (
+    '{"image":{"properties":{"height":4,"width":6,"color_format":"BGR"}},'
+    '"insights_meta":{"objects_meta":['
+    '{"timestamp":1.5,"label":"person","confidence":0.75,"inference_id":"7",'
+    '"attributes":[{"name":"age","label":"adult","confidence":0.5}],"bbox":{"l":0.125,"t":0.25,"w":0.5,"h":0.375}},'
+    '{"timestamp":1.5,"label":"car","confidence":0.5,"inference_id":"7","attributes":[],"bbox":null}]},'
+    '"timestamp":1.5,"frame_id":"1","instance_id":"inst","skill_id":"skill","device_id":"device","datetime":"2026-10-18"}'
+)
+
+
+def make_frame():
+    img = np.zeros((4, 6, 3), dtype=np.uint8)
+    f = frame_attr.Frame(
+        image=frame_attr.Image(image_pointer=img, properties=frame_attr.ImageProperties(height=4, width=6, color_format=frame.ColorFormat.BGR)),
+        timestamp=1.5, frame_id='1', skill_id='skill', device_id='device', datetime='2026-10-18', instance_id='inst')
+    f.insights_meta.objects.append([[0.125, 0.25, 0.5, 0.375], [np.nan] * 4], [0.75, 0.5], ['person', 'car'], 1.5, '7')
+    f.insights_meta.objects.add_attributes([0], ['age'], ['adult'], [0.5])
+    return f
+
+
+def test_untracked_frame_payload_unchanged():
+    f = make_frame()
+    assert f.json() == EXPECTED
+    assert f.to_pydantic().model_dump_json() == EXPECTED
+
+    # through the pydantic objects too
+    f.insights_meta.objects_meta
+    assert f.json() == EXPECTED
+
+
+def test_tracked_objects_have_tracking_info():
+    f = make_frame()
+    f.insights_meta.objects.track_ids[0] = 3
+    f.insights_meta.objects.velocities[0] = (0.0, 0.0)
+
+    objects_meta = f.insights_meta.dict()['objects_meta']
+    assert objects_meta[0]['tracking_info'] == {'tracking_id': '3', 'speed': 0.0, 'direction': None}
+    assert 'tracking_info' not in objects_meta[1]